@@ -0,0 +1,15 @@
+"""
+Offline benchmark harness for the chat API.
+
+Runs the FastAPI app in-process with a scripted fake LLM and local stand-ins
+for the hotel API, the IdP (token, CIBA, JWKS) and SMTP, so it needs no
+network access or credentials:
+
+    python -m bench.run --concurrency 8 --requests 200
+
+Cold-start time and RSS, failing when `import main` exceeds its budget:
+
+    python -m bench.startup --budget 2
+
+See `--help` of either module for the knobs.
+"""
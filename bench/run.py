@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+from bench.stubs import build_catalog, hotel_api_handler, idp_handler, start_http_stub, start_smtp_stub
+
+# One conversation per virtual user, restarted in a new thread when it runs out
+CONVERSATION = [
+    "Show me the hotels you have",
+    "Tell me more about hotel 1",
+    "What does room 101 look like?",
+    "Thanks, that is all for now",
+]
+
+def rss_mb() -> float:
+    """Current resident set size, falling back to the peak where /proc is unavailable"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class SigningKey:
+    """RSA key for the bench users' bearer tokens, published to the app as a JWKS file"""
+
+    def __init__(self):
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from jwt.algorithms import RSAAlgorithm
+
+        self.kid = "bench"
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(RSAAlgorithm.to_jwk(self.private_key.public_key()))
+        self.jwks = {"keys": [dict(jwk, kid=self.kid, alg="RS256", use="sig")]}
+
+    def token(self, user_id: str) -> str:
+        import jwt
+
+        claims = {"sub": user_id, "username": f"{user_id}@bench.local", "exp": int(time.time()) + 3600}
+        return jwt.encode(claims, self.private_key, algorithm="RS256", headers={"kid": self.kid})
+
+def start_environment(signing_key: SigningKey, hotels: int = 20, rooms_per_hotel: int = 8, description_chars: int = 600) -> Dict[str, object]:
+    """Start the stubs and point the app's configuration at them. Must run before importing main."""
+    catalog = build_catalog(hotels, rooms_per_hotel, description_chars)
+    hotel_api = start_http_stub(hotel_api_handler(catalog))
+    idp = start_http_stub(idp_handler(signing_key.jwks))
+    smtp = start_smtp_stub()
+    jwks_file = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    json.dump(signing_key.jwks, jwks_file)
+    jwks_file.close()
+
+    os.environ.update({
+        "HOTEL_API_BASE_URL": hotel_api.url,
+        "CLIENT_ID": "bench-client",
+        "CLIENT_SECRET": "bench-secret",
+        "TOKEN_URL": f"{idp.url}/oauth2/token",
+        "CIBA_URL": f"{idp.url}/oauth2/ciba",
+        "AUTHORIZE_URL": f"{idp.url}/oauth2/authorize",
+        "REDIRECT_URI": "http://127.0.0.1/callback",
+        "GOOGLE_REDIRECT_URI": "http://127.0.0.1/google_callback",
+        "WEBSITE_URL": "http://127.0.0.1",
+        "JWKS_FILE": jwks_file.name,
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp.port),
+        "SMTP_STARTTLS": "false",
+        "GMAIL_USER": "bench@bench.local",
+        "GMAIL_PASSWORD": "bench",
+        "SESSION_STORE_BACKEND": "memory",
+        "CHAT_HISTORY_CLEANUP_INTERVAL_SECONDS": "0",
+        "LLM_STREAM": "false",
+        "OPS_TOKEN": "bench-ops",
+    })
+    return {"hotel_api": hotel_api, "idp": idp, "smtp": smtp, "jwks_file": jwks_file.name}
+
+def stop_environment(stubs: Dict[str, object]) -> None:
+    for name in ("hotel_api", "idp", "smtp"):
+        stubs[name].stop()
+    os.unlink(stubs["jwks_file"])
+
+def start_app(port: int):
+    """Import the app with the fake LLM wired in and serve it with uvicorn on a background thread"""
+    import uvicorn
+
+    from bench.fake_llm import FakeLLM
+    from crew import crew_factory
+    import main
+
+    crew_factory.llm_factory = lambda: FakeLLM(latency=start_app.llm_latency)
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The app failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+async def run_load(base_url: str, signing_key: SigningKey, concurrency: int, total: int, timeout: float) -> Dict[str, object]:
+    import httpx
+
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    counter = iter(range(total))
+
+    async def virtual_user(index: int, client) -> None:
+        user_id = f"bench-user-{index}"
+        headers = {"Authorization": f"Bearer {signing_key.token(user_id)}"}
+        turn = 0
+        thread_id = None
+        for _ in counter:
+            if turn % len(CONVERSATION) == 0:
+                thread_id = f"bench-{index}-{uuid.uuid4().hex[:8]}"
+            message = CONVERSATION[turn % len(CONVERSATION)]
+            turn += 1
+            start = time.perf_counter()
+            try:
+                response = await client.post("/chat", json={"message": message}, headers={**headers, "ThreadID": thread_id})
+                statuses[response.status_code] += 1
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(virtual_user(index, client) for index in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {"latencies": latencies, "statuses": statuses, "elapsed": elapsed}
+
+def summarize(result: Dict[str, object], rss_before: float, rss_after: float, concurrency: int) -> Dict[str, object]:
+    latencies = result["latencies"]
+    return {
+        "concurrency": concurrency,
+        "requests": sum(result["statuses"].values()),
+        "ok": len(latencies),
+        "statuses": {str(status): count for status, count in result["statuses"].items()},
+        "elapsed_seconds": round(result["elapsed"], 3),
+        "throughput_rps": round(len(latencies) / result["elapsed"], 2) if result["elapsed"] else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2) if latencies else float("nan"),
+        },
+        "rss_mb": {
+            "before": round(rss_before, 1),
+            "after": round(rss_after, 1),
+            "growth": round(rss_after - rss_before, 1),
+        },
+    }
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Offline load test of /chat with a fake LLM and local stubs")
+    parser.add_argument("--concurrency", type=int, default=8, help="virtual users sending requests in parallel")
+    parser.add_argument("--requests", type=int, default=200, help="measured /chat requests in total")
+    parser.add_argument("--warmup", type=int, default=20, help="requests sent before measuring")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds each fake LLM call sleeps")
+    parser.add_argument("--hotels", type=int, default=20)
+    parser.add_argument("--rooms-per-hotel", type=int, default=8)
+    parser.add_argument("--description-chars", type=int, default=600)
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, object]:
+    args = parse_args(argv)
+    signing_key = SigningKey()
+    stubs = start_environment(signing_key, args.hotels, args.rooms_per_hotel, args.description_chars)
+    start_app.llm_latency = args.llm_latency
+    port = free_port()
+    server, thread = start_app(port)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        if args.warmup:
+            asyncio.run(run_load(base_url, signing_key, args.concurrency, args.warmup, args.timeout))
+        rss_before = rss_mb()
+        result = asyncio.run(run_load(base_url, signing_key, args.concurrency, args.requests, args.timeout))
+        rss_after = rss_mb()
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        stop_environment(stubs)
+
+    report = summarize(result, rss_before, rss_after, args.concurrency)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        latency = report["latency_ms"]
+        print(f"requests   {report['requests']} ({report['ok']} ok) at concurrency {report['concurrency']}, statuses {report['statuses']}")
+        print(f"latency    p50 {latency['p50']} ms  p95 {latency['p95']} ms  p99 {latency['p99']} ms  max {latency['max']} ms")
+        print(f"throughput {report['throughput_rps']} req/s over {report['elapsed_seconds']} s")
+        print(f"rss        {report['rss_mb']['before']} MB -> {report['rss_mb']['after']} MB ({report['rss_mb']['growth']:+} MB)")
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from bench.run import SigningKey, free_port, start_environment, stop_environment
+
+# Run in a fresh interpreter per sample, so nothing is already in sys.modules
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+seconds = time.perf_counter() - start
+heavy = sorted(name for name in ("crewai", "litellm", "langchain_openai", "crew") if name in sys.modules)
+rss = next(int(line.split()[1]) for line in open("/proc/self/status") if line.startswith("VmRSS:"))
+print(json.dumps({"import_seconds": seconds, "rss_mb": rss / 1024, "modules": len(sys.modules), "heavy": heavy}))
+"""
+
+def process_rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+def measure_import(env: Dict[str, str]) -> Dict[str, object]:
+    output = subprocess.run([sys.executable, "-c", IMPORT_PROBE], env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def measure_serve(env: Dict[str, str], timeout: float) -> Dict[str, object]:
+    """Time from spawning uvicorn to the first /health answer, and until crew is imported"""
+    import httpx
+
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    result: Dict[str, object] = {"ready_seconds": None, "crew_loaded_seconds": None}
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline and process.poll() is None:
+            try:
+                if result["ready_seconds"] is None:
+                    if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                        result["ready_seconds"] = time.perf_counter() - start
+                        result["ready_rss_mb"] = process_rss_mb(process.pid)
+                        if env.get("CREW_PRELOAD") == "false":
+                            break
+                else:
+                    snapshot = httpx.get(
+                        f"http://127.0.0.1:{port}/metrics",
+                        params={"format": "json"},
+                        headers={"Authorization": f"Bearer {env['OPS_TOKEN']}"},
+                        timeout=1,
+                    ).json()
+                    if snapshot.get("crew_import", {}).get("loaded"):
+                        result["crew_loaded_seconds"] = time.perf_counter() - start
+                        break
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.02)
+        result["rss_mb"] = process_rss_mb(process.pid)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return result
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Cold-start time and memory of the app")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to sample the import with")
+    parser.add_argument("--budget", type=float, default=float(os.environ.get('STARTUP_IMPORT_BUDGET_SECONDS', 2.0)),
+                        help="fail when the median `import main` exceeds this many seconds")
+    parser.add_argument("--no-preload", action="store_true", help="start with CREW_PRELOAD=false")
+    parser.add_argument("--no-serve", action="store_true", help="only measure the import, do not start uvicorn")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for the server")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    stubs = start_environment(SigningKey())
+    env = dict(os.environ, CREW_PRELOAD="false" if args.no_preload else "true")
+    try:
+        samples = [measure_import(env) for _ in range(args.runs)]
+        serve = None if args.no_serve else measure_serve(env, args.timeout)
+    finally:
+        stop_environment(stubs)
+
+    import_seconds = statistics.median(sample["import_seconds"] for sample in samples)
+    report = {
+        "import_seconds": round(import_seconds, 3),
+        "import_seconds_samples": [round(sample["import_seconds"], 3) for sample in samples],
+        "import_rss_mb": round(statistics.median(sample["rss_mb"] for sample in samples), 1),
+        "modules": samples[-1]["modules"],
+        "heavy_modules_at_import": samples[-1]["heavy"],
+        "budget_seconds": args.budget,
+        "within_budget": import_seconds <= args.budget,
+        "serve": serve,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"import main  {report['import_seconds']} s (samples {report['import_seconds_samples']}), budget {args.budget} s")
+        print(f"import rss   {report['import_rss_mb']} MB, {report['modules']} modules, heavy: {', '.join(report['heavy_modules_at_import']) or 'none'}")
+        if serve:
+            ready = serve["ready_seconds"]
+            print(f"serve        /health after {ready:.2f} s" if ready is not None else "serve        /health never answered")
+            if serve["crew_loaded_seconds"] is not None:
+                print(f"             crew imported after {serve['crew_loaded_seconds']:.2f} s")
+            print(f"             rss {serve.get('ready_rss_mb', float('nan')):.1f} MB when ready, {serve['rss_mb']:.1f} MB at exit")
+    if not report["within_budget"]:
+        print(f"import main took {report['import_seconds']} s, over the {args.budget} s budget", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+import json
+import re
+import socketserver
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs
+
+class StubServer:
+    """A local server on an ephemeral port, served from a daemon thread"""
+
+    def __init__(self, server):
+        self.server = server
+        self.thread = threading.Thread(target=server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+class JsonHandler(BaseHTTPRequestHandler):
+    """Routes requests to methods by regex. Subclasses define routes as (method, pattern, handler name)."""
+
+    routes: List[Tuple[str, str, str]] = []
+    protocol_version = "HTTP/1.1"
+
+    def _dispatch(self, method: str) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+        path = self.path.split("?", 1)[0]
+        for route_method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                status, payload = getattr(self, name)(*match.groups())
+                return self._send(status, payload)
+        self._send(404, {"error": "not_found"})
+
+    def _send(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def json(self) -> Dict:
+        return json.loads(self.body or b"{}")
+
+    def form(self) -> Dict[str, str]:
+        return {key: values[0] for key, values in parse_qs(self.body.decode()).items()}
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+def build_catalog(hotels: int, rooms_per_hotel: int, description_chars: int) -> Dict[str, Dict]:
+    """Deterministic hotel catalog, with long descriptions so tool output shaping has work to do"""
+    description = ("Lush gardens, ocean views and signature Sri Lankan dining. " * (description_chars // 60 + 1))[:description_chars]
+    catalog = {"hotels": {}, "rooms": {}}
+    for hotel_id in range(1, hotels + 1):
+        rooms = []
+        for index in range(rooms_per_hotel):
+            room = {
+                "id": hotel_id * 100 + index,
+                "hotel_id": hotel_id,
+                "room_type": ["Deluxe", "Suite", "Standard", "Villa"][index % 4],
+                "price_per_night": 120 + 15 * index,
+                "currency": "USD",
+                "max_occupancy": 2 + index % 3,
+                "description": description,
+                "images": [f"https://img.example/{hotel_id}/{index}/{n}.jpg" for n in range(5)],
+            }
+            rooms.append(room)
+            catalog["rooms"][str(room["id"])] = room
+        catalog["hotels"][str(hotel_id)] = {
+            "id": hotel_id,
+            "name": f"Gardeo Hotel {hotel_id}",
+            "city": ["Colombo", "Kandy", "Galle", "Ella"][hotel_id % 4],
+            "rating": 4 + (hotel_id % 10) / 10,
+            "description": description,
+            "rooms": rooms,
+        }
+    return catalog
+
+def hotel_api_handler(catalog: Dict[str, Dict]):
+    class HotelApiHandler(JsonHandler):
+        routes = [
+            ("GET", r"/hotels", "list_hotels"),
+            ("GET", r"/hotels/(\w+)", "get_hotel"),
+            ("GET", r"/rooms/(\w+)", "get_room"),
+            ("POST", r"/bookings/preview", "preview"),
+            ("POST", r"/bookings", "book"),
+            ("GET", r"/bookings/(\w+)", "get_booking"),
+        ]
+
+        def list_hotels(self):
+            summaries = [{key: value for key, value in hotel.items() if key != "rooms"} for hotel in catalog["hotels"].values()]
+            return 200, {"hotels": summaries}
+
+        def get_hotel(self, hotel_id):
+            hotel = catalog["hotels"].get(hotel_id)
+            return (200, hotel) if hotel else (404, {"error": "hotel not found"})
+
+        def get_room(self, room_id):
+            room = catalog["rooms"].get(room_id)
+            return (200, room) if room else (404, {"error": "room not found"})
+
+        def _preview(self):
+            request = self.json()
+            room = catalog["rooms"].get(str(request.get("room_id")), {})
+            hotel = catalog["hotels"].get(str(room.get("hotel_id")), {})
+            return {
+                "room_id": request.get("room_id"),
+                "hotel_id": room.get("hotel_id"),
+                "hotel_name": hotel.get("name"),
+                "room_type": room.get("room_type"),
+                "check_in": request.get("check_in"),
+                "check_out": request.get("check_out"),
+                "total_price": room.get("price_per_night", 0) * 2,
+                "is_available": bool(room),
+            }
+
+        def preview(self):
+            return 200, self._preview()
+
+        def book(self):
+            return 200, {"id": uuid.uuid4().int % 100000, **self._preview()}
+
+        def get_booking(self, booking_id):
+            return 200, {"id": int(booking_id), "hotel_id": 1, "hotel_name": "Gardeo Hotel 1", "room_id": 100,
+                         "check_in": "2025-08-01", "check_out": "2025-08-03", "status": "confirmed"}
+
+    return HotelApiHandler
+
+def idp_handler(jwks: Dict):
+    class IdpHandler(JsonHandler):
+        routes = [
+            ("POST", r"/oauth2/token", "token"),
+            ("POST", r"/oauth2/ciba", "ciba"),
+            ("GET", r"/oauth2/jwks", "jwks"),
+        ]
+
+        def token(self):
+            grant_type = self.form().get("grant_type")
+            return 200, {"access_token": f"{grant_type}-{uuid.uuid4().hex}", "token_type": "Bearer", "expires_in": 3600}
+
+        def ciba(self):
+            return 200, {"auth_req_id": uuid.uuid4().hex, "interval": 1, "expires_in": 120}
+
+        def jwks(self):
+            return 200, jwks
+
+    return IdpHandler
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: EHLO, AUTH PLAIN, MAIL/RCPT/DATA, NOOP, RSET, QUIT"""
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 bench-smtp ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip().upper()
+            if command.startswith("EHLO"):
+                self.wfile.write(b"250-bench-smtp\r\n250 AUTH PLAIN\r\n")
+            elif command.startswith("HELO") or command.startswith(("MAIL", "RCPT", "NOOP", "RSET")):
+                self.reply("250 OK")
+            elif command.startswith("AUTH"):
+                self.reply("235 Authentication successful")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while True:
+                    data = self.rfile.readline()
+                    if not data:
+                        return
+                    if data.rstrip(b"\r\n") == b".":
+                        break
+                self.server.delivered += 1
+                self.reply("250 OK queued")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class SmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SmtpHandler)
+        self.delivered = 0
+
+def start_http_stub(handler_class) -> StubServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+    server.daemon_threads = True
+    return StubServer(server)
+
+def start_smtp_stub() -> StubServer:
+    return StubServer(SmtpServer())
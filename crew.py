@@ -1,9 +1,23 @@
 from datetime import date
+import functools
 import logging
 import os
+import threading
+from typing import Callable
 from crewai import Agent, Task, Crew, LLM, Process
-from dotenv import load_dotenv
-from schemas import CrewOutput
+from crewai.utilities.events import (
+    crewai_event_bus,
+    LLMCallCompletedEvent,
+    LLMCallFailedEvent,
+    LLMCallStartedEvent,
+    LLMStreamChunkEvent,
+    TaskCompletedEvent,
+    TaskFailedEvent,
+    TaskStartedEvent,
+    ToolUsageErrorEvent,
+    ToolUsageFinishedEvent,
+    ToolUsageStartedEvent,
+)
 from tools.add_calander import AddCalanderTool
 from tools.booking import BookingTool
 from tools.fetch_booking import FetchBookingsTool
@@ -13,40 +27,85 @@ from tools.fetch_hotels import FetchHotelsTool
 from tools.fetch_room import FetchRoomTool
 from tools.get_booking_preview import BookingPreviewTool
 from tools.upgrade_room import RoomUpgradeTool
+from utils.chat_history import chat_history_manager
+from utils.event_stream import emit_event
+from utils.message_router import RouteDecision, route_message
+from utils.metrics import metrics
+from utils.response_cache import note_tool_use
 from utils.state_manager import state_manager
+from utils.structured_output import collect_tool_results, published_tool_results, structured_output_parser
+from utils.tracing import SPAN_KIND_CLIENT, trace_tool, tracer
 
-load_dotenv()
+AGENT_ROLE = 'Hotel Assistant Agent'
 
-def create_crew(question, thread_id: str = None):
-    llm = LLM(model='azure/gpt4-o')
-    hotel_agent = Agent(
-        role='Hotel Assistant Agent',
-        goal=(
-            "Answer the given question using your tools without modifying the question itself. Please make sure to follow the instructions in the task description. Do not perform any actions outside the scope of the task."
-        ),
-        backstory=(
-            "You are the Hotel Assistant Agent for Gardeo Hotel. You have access to a language model "
-            "and a set of tools to help answer questions and assist with hotel bookings. Gardeo Hotels "
-            "offer the finest Sri Lankan hospitality and blend seamlessly with nature, creating luxurious experiences. "
-            "Our rooms immerse you in a world of their own, and our signature dining transports you to another realm—"
-            "ensuring a stay that is always memorable. We welcome every guest with warmth and a tropical embrace, making "
-            "them feel at home. As guests explore our island, they will be accompanied by the smiles of our people, "
-            "through its many natural and historical wonders. While we value our rich legacies, we also carefully preserve "
-            "our exotic habitat for the future. We share this home with the world and with one another, united by warmth "
-            "and compassion."
-        ),
-        verbose=True,
-        llm=llm,
-        logging_level=logging.INFO,
-        tools=[FetchHotelsTool(thread_id), FetchHotelTool(thread_id), FetchRoomTool(thread_id), BookingPreviewTool(thread_id), BookingTool(thread_id), FetchChatHistoryTool(thread_id), FetchBookingsTool(thread_id), AddCalanderTool(thread_id), RoomUpgradeTool(thread_id)]
+AGENT_GOAL = (
+    "Answer the given question using your tools without modifying the question itself. Please make sure to follow the instructions in the task description. Do not perform any actions outside the scope of the task."
+)
+
+AGENT_BACKSTORY = (
+    "You are the Hotel Assistant Agent for Gardeo Hotel. You have access to a language model "
+    "and a set of tools to help answer questions and assist with hotel bookings. Gardeo Hotels "
+    "offer the finest Sri Lankan hospitality and blend seamlessly with nature, creating luxurious experiences. "
+    "Our rooms immerse you in a world of their own, and our signature dining transports you to another realm—"
+    "ensuring a stay that is always memorable. We welcome every guest with warmth and a tropical embrace, making "
+    "them feel at home. As guests explore our island, they will be accompanied by the smiles of our people, "
+    "through its many natural and historical wonders. While we value our rich legacies, we also carefully preserve "
+    "our exotic habitat for the future. We share this home with the world and with one another, united by warmth "
+    "and compassion."
+)
+
+def answer_when_final(tool_class):
+    """
+    crewai ends the turn on every result of a result_as_answer tool. Make it
+    end the turn only when the call published a final tool_result, so error
+    results go back to the agent. crewai reads result_as_answer from the
+    structured tool after each call. Idempotent.
+    """
+    to_structured_tool = tool_class.to_structured_tool
+    if getattr(to_structured_tool, "__answer_when_final__", False):
+        return tool_class
+
+    @functools.wraps(to_structured_tool)
+    def wrapped(self):
+        structured = to_structured_tool(self)
+        run = structured.func
+
+        def func(*args, **kwargs):
+            published = published_tool_results()
+            start = len(published) if published is not None else 0
+            try:
+                return run(*args, **kwargs)
+            finally:
+                if published is not None:
+                    structured.result_as_answer = self.result_as_answer and any(
+                        result.final for result in published[start:]
+                    )
+
+        structured.func = func
+        return structured
+
+    wrapped.__answer_when_final__ = True
+    tool_class.to_structured_tool = wrapped
+    return tool_class
+
+TOOL_CLASSES = [
+    answer_when_final(trace_tool(tool_class)) for tool_class in (
+        FetchHotelsTool,
+        FetchHotelTool,
+        FetchRoomTool,
+        BookingPreviewTool,
+        BookingTool,
+        FetchChatHistoryTool,
+        FetchBookingsTool,
+        AddCalanderTool,
+        RoomUpgradeTool,
     )
-    flow_state = state_manager.get_states_as_string(thread_id)
-    chat_history_task = Task(
-        description=
-            f"""
+]
+
+CHAT_HISTORY_TASK_TEMPLATE = """
             User message: {question}
             Current flow state: [{flow_state}]
-            Current year: { date.today().isoformat() }
+            Current year: {today}
 
             # Message Aggregator Assistant
 
@@ -76,17 +135,23 @@ def create_crew(question, thread_id: str = None):
 
             4. Deliver only the final summarized message in your chat_response
             """
-        ,
-        agent=hotel_agent,
-        expected_output=(
-            "Well structured message that captures all crucial information (ids, dates, preferences, location, etc.) "
-        ),
-    )
-    agent_task = Task(
-        description=
-            f"""
+
+CHAT_HISTORY_EXPECTED_OUTPUT = (
+    "Well structured message that captures all crucial information (ids, dates, preferences, location, etc.) "
+)
+
+# Prepended to the booking task when the aggregator pass is skipped
+FAST_PATH_CONTEXT_TEMPLATE = """
+            ** User message: {question} **
+            ** Previous assistant reply: {previous_reply} **
+            If any detail you need is missing from the message above, use FetchChatHistoryTool.
+"""
+
+FAST_PATH_PREVIOUS_REPLY_CHARS = 1500
+
+AGENT_TASK_TEMPLATE = """
             ** Current flow state: [{flow_state}] **
-            ** Current year: { date.today().isoformat() } **
+            ** Current year: {today} **
 
             # Hotel Booking Assistant
 
@@ -106,7 +171,8 @@ def create_crew(question, thread_id: str = None):
             - Only initiate booking preview when flow_state includes one of [FETCHED_HOTELS, FETCHED_ROOMS, FETCHED_ROOM]
             - URLs belong only in tool_response, never in chat_response
             - Any exceptions comeing from the tools should be formatted to nice message to user and presented in chat_response.
-            - Since you need the exact hotels and room details, always keep excat data come from the tools in tool_response. If you are using multple tools in a single step, keep the data in the tool_response of all tools.
+            - When BookingTool, AddCalendarTool or RoomUpgradeTool succeed they answer the user directly and end your turn, call them last. When they fail, their error comes back to you like any other tool result
+            - Large tool results are summarized as {{"handle": ..., "data": ...}}; the full data is attached for the user automatically. Copy the tool results you rely on into tool_response unchanged, always keeping their handle. If you are using multple tools in a single step, keep the results of all tools in tool_response.
 
             ## Action Protocol
 
@@ -170,16 +236,183 @@ def create_crew(question, thread_id: str = None):
             - Minimize tool usage per step
             - Keep URLs in tool_response only
             """
-        ,
-        agent=hotel_agent,
-        context=[chat_history_task],
-        expected_output=f"The output should follow the schema below: {CrewOutput.model_json_schema()}.",
-        memory=True,
-        output_pydantic=CrewOutput
-    )
-    choreo_crew = Crew(
-    agents=[hotel_agent],
-    tasks=[chat_history_task, agent_task],
-    process=Process.sequential
-    )
-    return choreo_crew.kickoff()
+
+def register_event_handlers():
+    """Forward crew events to the event stream of the turn that produced them"""
+
+    @crewai_event_bus.on(LLMStreamChunkEvent)
+    def on_llm_stream_chunk(source, event):
+        emit_event("token", {"text": event.chunk})
+
+    @crewai_event_bus.on(ToolUsageStartedEvent)
+    def on_tool_started(source, event):
+        note_tool_use(event.tool_name)
+        emit_event("tool_start", {"tool": event.tool_name, "args": event.tool_args})
+
+    @crewai_event_bus.on(ToolUsageFinishedEvent)
+    def on_tool_finished(source, event):
+        emit_event("tool_end", {"tool": event.tool_name})
+
+    @crewai_event_bus.on(ToolUsageErrorEvent)
+    def on_tool_error(source, event):
+        emit_event("tool_error", {"tool": event.tool_name, "error": str(event.error)})
+
+    # Tasks and LLM calls are only observable through events, so their spans
+    # are opened and closed by the handlers (on the thread running the crew)
+    @crewai_event_bus.on(TaskStartedEvent)
+    def on_task_started(source, event):
+        tracer.start_span(("task", id(source)), "crew.task", task=getattr(source, 'name', None))
+
+    @crewai_event_bus.on(TaskCompletedEvent)
+    def on_task_completed(source, event):
+        tracer.end_span(("task", id(source)))
+
+    @crewai_event_bus.on(TaskFailedEvent)
+    def on_task_failed(source, event):
+        tracer.end_span(("task", id(source)), error=Exception(event.error))
+
+    @crewai_event_bus.on(LLMCallStartedEvent)
+    def on_llm_call_started(source, event):
+        tracer.start_span(("llm", id(source)), "llm.call", SPAN_KIND_CLIENT, model=getattr(source, 'model', None))
+        if tracer.enabled:
+            _llm_usage_before.__dict__[id(source)] = _llm_token_usage(source)
+
+    @crewai_event_bus.on(LLMCallCompletedEvent)
+    def on_llm_call_completed(source, event):
+        before = _llm_usage_before.__dict__.pop(id(source), {})
+        after = _llm_token_usage(source)
+        tracer.end_span(("llm", id(source)), **{
+            f"llm.usage.{key}": after[key] - before.get(key, 0)
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens")
+            if key in after
+        })
+
+    @crewai_event_bus.on(LLMCallFailedEvent)
+    def on_llm_call_failed(source, event):
+        _llm_usage_before.__dict__.pop(id(source), None)
+        tracer.end_span(("llm", id(source)), error=Exception(event.error))
+
+# Token counters of each LLM at the start of its current call, per crew worker thread
+_llm_usage_before = threading.local()
+
+def _llm_token_usage(llm) -> dict:
+    """Running token counters of an LLM, when crewai tracks them on the instance"""
+    return dict(getattr(llm, '_token_usage', None) or {})
+
+class CrewFactory:
+    """
+    Builds the static parts of the crew once and only binds the per-request
+    inputs (thread_id, user message and flow state) on each kickoff.
+
+    The prompt templates and output schema are shared by all requests.
+    Agents and LLMs hold per-execution state in crewai, so each crew worker
+    thread gets its own long-lived agent, LLM and tool set instead of sharing one.
+    """
+
+    def __init__(self):
+        # Streaming lets /chat/stream forward tokens as they are generated
+        self.llm_stream = os.environ.get('LLM_STREAM', 'true').lower() == 'true'
+        # Builds each worker thread's LLM; replaceable, e.g. by the benchmark's fake LLM
+        self.llm_factory: Callable[[], LLM] = lambda: LLM(model='azure/gpt4-o', stream=self.llm_stream)
+        self.agent_task_expected_output = f"The output should be a JSON object following the schema below: {structured_output_parser.schema_json}"
+        self._local = threading.local()
+        register_event_handlers()
+
+    def _build_agent(self) -> Agent:
+        self._local.tools = [tool_class() for tool_class in TOOL_CLASSES]
+        # One LLM per worker thread as well, so its token counters describe a single turn's calls
+        self._local.llm = self.llm_factory()
+        return Agent(
+            role=AGENT_ROLE,
+            goal=AGENT_GOAL,
+            backstory=AGENT_BACKSTORY,
+            verbose=True,
+            llm=self._local.llm,
+            logging_level=logging.INFO,
+            tools=self._local.tools
+        )
+
+    def get_agent(self, thread_id: str = None) -> Agent:
+        """Return the agent owned by the calling worker thread, bound to thread_id"""
+        agent = getattr(self._local, 'agent', None)
+        if agent is None:
+            agent = self._build_agent()
+            self._local.agent = agent
+        for tool in self._local.tools:
+            tool.thread_id = thread_id
+        return agent
+
+    def route(self, question, thread_id: str = None) -> RouteDecision:
+        messages = chat_history_manager.get_chat_history(thread_id).messages
+        return route_message(question, messages)
+
+    def _previous_reply(self, thread_id: str = None) -> str:
+        """Compact digest of the last assistant message, used by the fast path"""
+        for msg in reversed(chat_history_manager.get_chat_history(thread_id).messages):
+            if msg.role == "assistant":
+                return msg.content[-FAST_PATH_PREVIOUS_REPLY_CHARS:]
+        return "None"
+
+    def build(self, question, thread_id: str = None, aggregate: bool = True) -> Crew:
+        hotel_agent = self.get_agent(thread_id)
+        flow_state = state_manager.get_states_as_string(thread_id)
+        today = date.today().isoformat()
+        agent_task_description = AGENT_TASK_TEMPLATE.format(flow_state=flow_state, today=today)
+        tasks = []
+        if aggregate:
+            chat_history_task = Task(
+                name="aggregate_message",
+                description=CHAT_HISTORY_TASK_TEMPLATE.format(question=question, flow_state=flow_state, today=today),
+                agent=hotel_agent,
+                expected_output=CHAT_HISTORY_EXPECTED_OUTPUT,
+            )
+            tasks.append(chat_history_task)
+        else:
+            agent_task_description = FAST_PATH_CONTEXT_TEMPLATE.format(
+                question=question,
+                previous_reply=self._previous_reply(thread_id)
+            ) + agent_task_description
+        # No output_pydantic on purpose: crewai's converter would re-ask the LLM to fix a
+        # malformed answer, kickoff() validates and repairs it locally instead. JSON mode
+        # (response_format) stays off as well, the agent's text ReAct tool calls break under it.
+        agent_task = Task(
+            name="hotel_assistant",
+            description=agent_task_description,
+            agent=hotel_agent,
+            context=list(tasks),
+            expected_output=self.agent_task_expected_output,
+            memory=True
+        )
+        tasks.append(agent_task)
+        return Crew(
+            agents=[hotel_agent],
+            tasks=tasks,
+            process=Process.sequential
+        )
+
+    def kickoff(self, question, thread_id: str = None):
+        decision = self.route(question, thread_id)
+        metrics.increment("crew_turns_total", path=decision.path, reason=decision.reason)
+        with metrics.timer("crew_turn_seconds", path=decision.path), \
+                tracer.span("crew.kickoff", path=decision.path, reason=decision.reason, thread_id=thread_id) as span:
+            with collect_tool_results() as tool_results:
+                result = self.build(question, thread_id, aggregate=decision.aggregate).kickoff()
+            # Parsed and repaired locally instead of by crewai's converter, which re-asks the LLM
+            result.pydantic = structured_output_parser.finalize(result.raw, tool_results)
+            token_usage = getattr(result, 'token_usage', None)
+            if token_usage is not None:
+                metrics.increment("llm_tokens_total", token_usage.total_tokens, path=decision.path)
+                metrics.increment("llm_requests_total", token_usage.successful_requests, path=decision.path)
+                span.set_attributes({
+                    "llm.usage.prompt_tokens": token_usage.prompt_tokens,
+                    "llm.usage.completion_tokens": token_usage.completion_tokens,
+                    "llm.usage.total_tokens": token_usage.total_tokens,
+                    "llm.requests": token_usage.successful_requests,
+                })
+        return result
+
+# Single instance for application-wide use
+crew_factory = CrewFactory()
+
+def create_crew(question, thread_id: str = None):
+    return crew_factory.kickoff(question, thread_id)
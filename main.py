@@ -1,31 +1,62 @@
+import asyncio
+import copy
+import hmac
 import logging
+import logging.config
 import os
+from contextlib import asynccontextmanager
 from typing import List, Optional
-from dotenv import load_dotenv
-from langchain_openai import AzureChatOpenAI
-from crew import create_crew
 from fastapi import FastAPI, HTTPException, Depends, Header, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-import jwt
-from jwt.exceptions import InvalidTokenError
+from jwt.exceptions import InvalidTokenError, PyJWKClientError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from utils.constants import FlowState
 from utils.state_manager import state_manager
-from utils.asgardeo_manager import AuthCode, asgardeo_manager
+from utils.asgardeo_manager import asgardeo_manager
 from utils.chat_history import ChatHistory, chat_history_manager
-from fastapi.responses import JSONResponse
+from utils.session_store import ModelCodec, session_store
+from utils.job_scheduler import ciba_scheduler
+from utils.crew_executor import CrewExecutorBusy, crew_executor
+from utils.idempotency import IdempotencyConflict, idempotency_cache, request_fingerprint
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from utils.metrics import metrics
+from utils.event_stream import TurnEventStream, emit_event, format_sse
+from utils.tool_output import tool_output_shaper
+from utils.response_cache import CachedResponse, response_cache
+from utils.jwt_verifier import jwt_verifier
+from utils.background_loop import background_loop
+from utils.idp_client import idp_client
+from utils.tracing import SPAN_KIND_SERVER, tracer
+from utils.lazy_import import LazyModule
 import urllib3
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-load_dotenv(override=True)
-
 os.makedirs('logs', exist_ok=True)
 logging.config.fileConfig('logging.conf', disable_existing_loggers=False)
 
-app = FastAPI(title="LLM Chat API")
+# crewai and the tools are the bulk of the import graph, keep them off the cold-start path
+crew_module = LazyModule("crew")
+metrics.register_collector("crew_import", crew_module.stats)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Imported in the background so the server accepts connections right away,
+    # CREW_PRELOAD=false defers it to the first chat turn (e.g. for --reload)
+    if os.environ.get('CREW_PRELOAD', 'true').lower() == 'true':
+        crew_module.preload()
+    # Resume CIBA polling jobs persisted by a previous process. Jobs whose handler
+    # registers with a tool module are picked up by the first recovery pass after crew is imported
+    ciba_scheduler.start()
+    try:
+        yield
+    finally:
+        crew_executor.shutdown()
+        await asyncio.wrap_future(background_loop.submit(idp_client.aclose()))
+
+app = FastAPI(title="LLM Chat API", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -38,18 +69,37 @@ app.add_middleware(
 
 security = HTTPBearer()
 
+# Forward flow state transitions to the streaming turn of the same thread
+state_manager.add_listener(lambda thread_id, state: emit_event("state", {"state": state.name}, thread_id))
+
 def get_user_from_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         token = credentials.credentials
-        payload = jwt.decode(token, options={"verify_signature": False})
+        payload, decoded = jwt_verifier.verify(token)
         user_id = payload.get("sub")
-        asgardeo_manager.store_user_claims(user_id, payload)
+        # Claims only change with a new token, cache hits skip the store entirely
+        if decoded:
+            asgardeo_manager.store_user_claims(user_id, payload)
         return user_id
     except InvalidTokenError:
         raise HTTPException(
             status_code=401,
             detail="Invalid authentication token"
         )
+    except PyJWKClientError:
+        raise HTTPException(
+            status_code=503,
+            detail="Unable to verify authentication token"
+        )
+
+def require_ops_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # Metrics and traces carry thread IDs, so they are only served to holders of OPS_TOKEN
+    ops_token = os.environ.get('OPS_TOKEN')
+    if not ops_token:
+        raise HTTPException(status_code=403, detail="Operational endpoints are disabled, set OPS_TOKEN")
+    if not hmac.compare_digest(credentials.credentials.encode(), ops_token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid ops token")
+
 class ChatMessage(BaseModel):
     message: str
 
@@ -66,10 +116,117 @@ class ChatResponse(BaseModel):
     frontend_state: str
     message_states: List[str]
 
+def process_chat(user_message: str, thread_id: Optional[str]) -> ChatResponse:
+    """Run a single chat turn through the crew. Blocking, runs on the crew executor."""
+    # Session state reads are memoized and writes flushed once at the end of the turn.
+    # Flow states bypass the batch, so callbacks and /state see transitions as they happen
+    with tracer.span("chat.turn", SPAN_KIND_SERVER, thread_id=thread_id) as span, \
+            session_store.batch(), state_manager.collect_message_states(thread_id) as turn_states:
+        flow_digest = state_manager.get_states_as_string(thread_id)
+        chat_history_manager.add_user_message(thread_id, user_message)
+        cached = response_cache.lookup(user_message, flow_digest)
+        span.set_attribute("response_cache.hit", cached is not None)
+        if cached:
+            # Replay the cached turn as if the crew had run it: same states, same history entry,
+            # with its tool output handles re-issued for this thread so later turns can resolve them
+            for state in cached.states:
+                state_manager.add_state(thread_id, state)
+            crew_dict = cached.crew_dict
+            history = str(tool_output_shaper.rebind(cached.history_dict, cached.payloads, thread_id))
+        else:
+            with response_cache.record_tools() as tools_used:
+                crew_response = crew_module.create_crew(user_message, thread_id)
+            crew_dict = crew_response.to_dict()
+            history_dict = copy.deepcopy(crew_dict)
+            history = str(history_dict)
+            chat_response = crew_dict.setdefault('response', {})
+            tool_response = chat_response.get("tool_response", {})
+            tool_response_dict = tool_response.to_dict() if hasattr(tool_response, 'to_dict') else tool_response
+            # The LLM only saw shaped tool outputs; hand the frontend the full payloads
+            chat_response["tool_response"] = tool_output_shaper.resolve(tool_response_dict, thread_id)
+        chat_history_manager.add_assistant_message(thread_id, history)
+
+        chat_response = crew_dict.get('response', {})
+        frontend_state = crew_dict.get('frontend_state', {})
+        response = Response(
+            chat_response=chat_response.get("chat_response", ""),
+            tool_response=chat_response.get("tool_response")
+        )
+        states = turn_states.drain()
+        if not cached:
+            payloads = tool_output_shaper.collect(history_dict, thread_id)
+            response_cache.store(user_message, flow_digest, CachedResponse(crew_dict, history_dict, payloads, states), tools_used)
+        message_states = [state.name for state in states]
+        return ChatResponse(response=response, frontend_state=frontend_state, message_states=message_states)
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest, 
     user_id: str = Depends(get_user_from_token),
+    ThreadID: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
+):
+    try:
+        user_message = request.message
+        thread_id = ThreadID or request.threadId
+        if not asgardeo_manager.get_user_id_from_thread_id(thread_id):
+            asgardeo_manager.store_user_id_against_thread_id(thread_id, user_id)
+
+        def run_turn():
+            # Turns of one thread run one at a time: in arrival order on this worker, under a lease across workers
+            return crew_executor.run(user_id, process_chat, user_message, thread_id, key=thread_id)
+
+        if idempotency_key:
+            # A retried request gets the first attempt's response instead of another crew run
+            fingerprint = request_fingerprint(thread_id, user_message)
+            return await idempotency_cache.run(user_id, idempotency_key, fingerprint, run_turn, ModelCodec(ChatResponse))
+        return await run_turn()
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except CrewExecutorBusy as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def stream_chat(stream: TurnEventStream, user_message: str, thread_id: Optional[str]) -> None:
+    """Run a chat turn, emitting its events and the final ChatResponse to stream."""
+    try:
+        with stream.bind():
+            chat_response = process_chat(user_message, thread_id)
+        stream.emit("final", chat_response.model_dump(mode="json"))
+    except Exception as e:
+        print(e)
+        stream.emit("error", {"detail": str(e)})
+    finally:
+        stream.close()
+
+def close_unstarted_stream(stream: TurnEventStream, job: "asyncio.Future") -> None:
+    """
+    Done callback of a streamed turn. stream_chat reports its own errors and closes the
+    stream, so a failed job never ran: its lease wait timed out, it was cancelled or the
+    executor shut down. Report that and close the stream, or the client would wait forever.
+    """
+    if job.cancelled():
+        stream.emit("error", {"detail": "The chat turn was cancelled"})
+        return stream.close()
+    error = job.exception()
+    if error is None:
+        return
+    data = {"detail": str(error)}
+    if isinstance(error, CrewExecutorBusy):
+        data.update(status_code=error.status_code, retry_after=error.retry_after)
+    stream.emit("error", data)
+    stream.close()
+
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    user_id: str = Depends(get_user_from_token),
     ThreadID: Optional[str] = Header(None)
 ):
     try:
@@ -77,42 +234,47 @@ async def chat(
         thread_id = ThreadID or request.threadId
         if not asgardeo_manager.get_user_id_from_thread_id(thread_id):
             asgardeo_manager.store_user_id_against_thread_id(thread_id, user_id)
-        
-        chat_history_manager.add_user_message(thread_id, user_message)
-        crew_response = create_crew(user_message, thread_id)
-        crew_dict = crew_response.to_dict()
-        chat_history_manager.add_assistant_message(thread_id, str(crew_dict))
 
-        chat_response = crew_dict.get('response', {})
-        frontend_state = crew_dict.get('frontend_state', {})
-        tool_response = chat_response.get("tool_response", {})
-        tool_response_dict = tool_response.to_dict() if hasattr(tool_response, 'to_dict') else tool_response
-        response = Response(
-            chat_response=chat_response.get("chat_response", ""),
-            tool_response=tool_response_dict
+        stream = TurnEventStream(thread_id)
+        job = crew_executor.submit(user_id, stream_chat, stream, user_message, thread_id, key=thread_id)
+        job.add_done_callback(lambda done: close_unstarted_stream(stream, done))
+    except CrewExecutorBusy as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
         )
-        message_states = [state.name for state in state_manager.get_message_states(thread_id)]
-        state_manager.clear_message_states(thread_id)
-        return ChatResponse(response=response, frontend_state=frontend_state, message_states=message_states)
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def event_generator():
+        async for event, data in stream.events():
+            yield format_sse(event, data)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/callback")
 async def callback(
     code: str,
     state: str,
 ):
     try:
-        auth_code: AuthCode = asgardeo_manager.state_mapping.get(state)
-        if not auth_code:
+        # Single use: a replayed or expired state is rejected
+        pending = asgardeo_manager.consume_pending_authorization(state)
+        if not pending:
             raise HTTPException(status_code=400, detail="Invalid state")
-        auth_code.code = code
-        asgardeo_manager.state_mapping[state] = auth_code
-        token = asgardeo_manager.fetch_user_token(state)
-        thread_id = asgardeo_manager.get_thread_id_from_state(state)
+        # Awaited on the IdP client loop, so the exchange does not block chat traffic
+        token = await asgardeo_manager.exchange_code(pending, code)
+        thread_id = pending.thread_id
         state_manager.add_state(thread_id, FlowState.BOOKING_AUTORIZED)
         return HTMLResponse(content=f"<html><body><script>window.location.href = '{os.environ['WEBSITE_URL']}/auth_success';</script></body></html>", status_code=200)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -122,31 +284,48 @@ async def callback(
     state: str,
 ):
     try:
-        auth_code: AuthCode = asgardeo_manager.state_mapping.get(state)
-        if not auth_code:
+        # Single use: a replayed or expired state is rejected
+        pending = asgardeo_manager.consume_pending_authorization(state)
+        if not pending:
             raise HTTPException(status_code=400, detail="Invalid state")
-        auth_code.code = code
-        asgardeo_manager.state_mapping[state] = auth_code
-        token = asgardeo_manager.fetch_google_token(state)
-        thread_id = asgardeo_manager.get_thread_id_from_state(state)
+        # Awaited on the IdP client loop, so the exchange does not block chat traffic
+        token = await asgardeo_manager.exchange_code(pending, code)
+        thread_id = pending.thread_id
         state_manager.add_state(thread_id, FlowState.CALENDAR_AUTORIZED)
         return HTMLResponse(content=f"<html><body><script>window.location.href = '{os.environ['WEBSITE_URL']}/auth_success';</script></body></html>", status_code=200)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))    
     
 @app.get("/state/{thread_id}")
 async def callback(
-    thread_id: str
+    thread_id: str,
+    cursor: int = 0
 ):
     try:
+        transitions, next_cursor, truncated = state_manager.get_transitions_since(thread_id, cursor)
         states = {
-            "states": [state.name for state in state_manager.get_states(thread_id)]
+            "states": [state.name for state in state_manager.get_states(thread_id)],
+            "transitions": [state.name for state in transitions],
+            "cursor": next_cursor,
+            "truncated": truncated
         }
         return JSONResponse(content=states)
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))    
 
+@app.get("/metrics", dependencies=[Depends(require_ops_token)])
+async def get_metrics(format: str = "prometheus"):
+    if format == "json":
+        return JSONResponse(content=metrics.snapshot())
+    return PlainTextResponse(content=metrics.prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces", dependencies=[Depends(require_ops_token)])
+async def get_traces(trace_id: Optional[str] = None, limit: Optional[int] = None):
+    return JSONResponse(content=tracer.export(trace_id, limit))
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -0,0 +1,15 @@
+import os
+import sys
+
+# Module-level singletons read their configuration at import time
+os.environ.setdefault("CLIENT_ID", "test-client")
+os.environ.setdefault("CLIENT_SECRET", "test-secret")
+os.environ.setdefault("TOKEN_URL", "http://127.0.0.1/oauth2/token")
+os.environ.setdefault("CIBA_URL", "http://127.0.0.1/oauth2/ciba")
+os.environ.setdefault("AUTHORIZE_URL", "http://127.0.0.1/oauth2/authorize")
+os.environ.setdefault("REDIRECT_URI", "http://127.0.0.1/callback")
+os.environ.setdefault("GOOGLE_REDIRECT_URI", "http://127.0.0.1/google_callback")
+os.environ.setdefault("SESSION_STORE_BACKEND", "memory")
+os.environ.setdefault("CHAT_HISTORY_CLEANUP_INTERVAL_SECONDS", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
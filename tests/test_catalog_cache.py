@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+from utils.catalog_cache import CatalogCache
+
+class Loader:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+            count = self.calls
+        time.sleep(self.delay)
+        return f"value-{count}"
+
+def test_fresh_entry_is_served_from_the_cache():
+    loader = Loader()
+    cache = CatalogCache(ttl=60, stale_ttl=60)
+    assert cache.get_or_load("/hotels", loader) == cache.get_or_load("/hotels", loader) == "value-1"
+    assert loader.calls == 1
+    assert cache.stats()["hits"] == 1
+
+def test_concurrent_misses_share_one_load():
+    loader = Loader(delay=0.1)
+    cache = CatalogCache(ttl=60, stale_ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("/hotels", loader))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["value-1"] * 8
+    assert loader.calls == 1
+
+def test_stale_entry_is_served_while_one_background_load_revalidates():
+    loader = Loader(delay=0.05)
+    cache = CatalogCache(ttl=0.05, stale_ttl=5)
+    cache.get_or_load("/hotels", loader)
+    time.sleep(0.1)
+    assert cache.get_or_load("/hotels", loader) == "value-1"
+    assert cache.get_or_load("/hotels", loader) == "value-1"
+    time.sleep(0.15)
+    assert loader.calls == 2
+    assert cache.entries["/hotels"].value == "value-2"
+    assert cache.stats()["stale_hits"] == 2
+
+def test_entry_past_its_stale_window_is_loaded_again():
+    loader = Loader()
+    cache = CatalogCache(ttl=0.02, stale_ttl=0.02)
+    cache.get_or_load("/hotels", loader)
+    time.sleep(0.06)
+    assert cache.get_or_load("/hotels", loader) == "value-2"
+
+def test_least_recently_used_entry_is_evicted():
+    cache = CatalogCache(max_entries=2, ttl=60, stale_ttl=60)
+    cache.set("/hotels/1", 1)
+    cache.set("/hotels/2", 2)
+    cache.get_or_load("/hotels/1", Loader())
+    cache.set("/hotels/3", 3)
+    assert list(cache.entries) == ["/hotels/1", "/hotels/3"]
+    assert cache.stats()["evictions"] == 1
+
+def test_loader_errors_are_not_cached():
+    cache = CatalogCache(ttl=60, stale_ttl=60)
+
+    def failing():
+        raise RuntimeError("api down")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load("/hotels", failing)
+    assert cache.get_or_load("/hotels", Loader()) == "value-1"
+
+def test_invalidate_and_invalidate_prefix():
+    cache = CatalogCache(ttl=60, stale_ttl=60)
+    for key in ("/hotels", "/hotels/1", "/rooms/1"):
+        cache.set(key, key)
+    cache.invalidate("/rooms/1")
+    cache.invalidate_prefix("/hotels/")
+    assert list(cache.entries) == ["/hotels"]
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from utils.chat_history import ChatHistory, ChatHistoryManager, ShardedChatHistoryManager
+from utils.session_store import SQLiteSessionStore
+
+def test_history_keeps_the_most_recent_messages():
+    history = ChatHistory(max_messages=3)
+    for index in range(5):
+        history.add_user_message(f"message {index}")
+    assert [msg["content"] for msg in history.get_messages()] == ["message 2", "message 3", "message 4"]
+
+def test_empty_messages_are_rejected():
+    with pytest.raises(ValueError):
+        ChatHistory().add_user_message("  ")
+
+def test_render_is_cached_per_budget_until_the_next_message():
+    history = ChatHistory()
+    history.add_user_message("a" * 40)
+    history.add_assistant_message("b" * 40)
+    assert history.get_messages_as_string() == f"User: {'a' * 40}\nAssistant: {'b' * 40}"
+    # Only the newest message fits the budget
+    assert history.get_messages_as_string(max_tokens=15) == f"Assistant: {'b' * 40}"
+    assert history._rendered == (15, f"Assistant: {'b' * 40}")
+    history.add_user_message("c")
+    assert history._rendered is None
+    assert history.get_messages_as_string(max_tokens=15).endswith("User: c")
+
+def test_least_recently_used_thread_is_evicted():
+    manager = ChatHistoryManager(max_threads=2, cleanup_interval_seconds=0)
+    manager.add_user_message("t1", "hi")
+    manager.add_user_message("t2", "hi")
+    manager.get_chat_history("t1")
+    manager.add_user_message("t3", "hi")
+    assert list(manager.chat_histories) == ["t1", "t3"]
+    assert set(manager.last_access) == {"t1", "t3"}
+
+def test_cleanup_expires_idle_threads_only():
+    manager = ChatHistoryManager(thread_timeout_hours=1, cleanup_interval_seconds=0)
+    manager.add_user_message("idle", "hi")
+    manager.add_user_message("active", "hi")
+    manager.last_access["idle"] -= 2 * 3600
+    # Expired threads sit at the front of the LRU order
+    manager.chat_histories.move_to_end("active")
+    assert manager.cleanup_expired() == 1
+    assert list(manager.chat_histories) == ["active"]
+
+def test_transcript_of_an_unknown_thread_is_empty():
+    manager = ChatHistoryManager(cleanup_interval_seconds=0)
+    assert manager.get_thread_messages_as_string("missing") == ""
+
+def test_sharded_manager_spreads_threads_and_expires_them():
+    manager = ShardedChatHistoryManager(shards=4, max_threads=100, cleanup_interval_seconds=0)
+    for index in range(20):
+        manager.add_user_message(f"t{index}", f"message {index}")
+    assert manager.get_thread_messages_as_string("t7") == "User: message 7"
+    assert sum(len(shard.chat_histories) for shard in manager.shards) == 20
+    manager.remove_thread("t7")
+    assert manager.get_thread_messages_as_string("t7") == ""
+
+def test_shared_store_histories_are_visible_to_every_manager(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first = ChatHistoryManager(cleanup_interval_seconds=0, store=SQLiteSessionStore(path))
+    second = ChatHistoryManager(cleanup_interval_seconds=0, store=SQLiteSessionStore(path))
+    first.add_user_message("t1", "hello")
+    second.add_assistant_message("t1", "hi there")
+    assert first.get_thread_messages_as_string("t1") == "User: hello\nAssistant: hi there"
+
+def test_unchanged_stored_history_keeps_the_local_render(tmp_path):
+    manager = ChatHistoryManager(cleanup_interval_seconds=0, store=SQLiteSessionStore(str(tmp_path / "sessions.db")))
+    manager.add_user_message("t1", "hello")
+    local = manager.get_chat_history("t1")
+    local.get_messages_as_string(max_tokens=100)
+    assert manager.get_chat_history("t1") is local
+    assert local._rendered is not None
@@ -0,0 +1,29 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from utils.crew_executor import CrewExecutor
+from utils.session_store import Lease, SQLiteSessionStore
+
+@pytest.fixture
+def client():
+    main.app.dependency_overrides[main.get_user_from_token] = lambda: "user-1"
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+def test_stream_closes_when_the_turn_lease_wait_times_out(client, tmp_path, monkeypatch):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    executor = CrewExecutor(max_workers=1, store=store, lease_seconds=5, lease_wait=0.2, lease_poll_interval=0.05)
+    monkeypatch.setattr(main, "crew_executor", executor)
+    # A turn of the thread is running on another worker process
+    holder = Lease(store, "crew_turn_lease", "thread-1", 5)
+    assert holder.try_acquire()[0]
+
+    response = client.post("/chat/stream", json={"message": "hello"}, headers={"ThreadID": "thread-1"})
+
+    assert response.status_code == 200
+    events = [frame.split("\n")[0] for frame in response.text.strip().split("\n\n")]
+    assert events == ["event: error"]
+    assert '"status_code": 503' in response.text
+    holder.release()
+    executor.shutdown()
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utils.crew_executor import CrewExecutor, CrewExecutorBusy
+from utils.session_store import Lease, SQLiteSessionStore
+
+class Recorder:
+    """Records when each run starts and ends"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []
+
+    def run(self, name, delay=0.02):
+        with self.lock:
+            self.events.append(("start", name))
+        time.sleep(delay)
+        with self.lock:
+            self.events.append(("end", name))
+        return name
+
+    def overlapped(self):
+        active = 0
+        for kind, _ in self.events:
+            active += 1 if kind == "start" else -1
+            if active > 1:
+                return True
+        return False
+
+def test_runs_with_the_same_key_execute_in_submission_order():
+    executor = CrewExecutor(max_workers=4, max_queue=8, max_per_user=8)
+    recorder = Recorder()
+
+    async def scenario():
+        futures = [executor.submit("user", recorder.run, name, key="thread") for name in "abcd"]
+        return await asyncio.gather(*futures)
+
+    assert asyncio.run(scenario()) == list("abcd")
+    assert recorder.events == [(kind, name) for name in "abcd" for kind in ("start", "end")]
+    assert executor.stats()["serialized_keys"] == 0
+    executor.shutdown()
+
+def test_runs_with_different_keys_execute_concurrently():
+    executor = CrewExecutor(max_workers=2, max_queue=8, max_per_user=8)
+    recorder = Recorder()
+
+    async def scenario():
+        await asyncio.gather(
+            executor.submit("user", recorder.run, "a", 0.1, key="first"),
+            executor.submit("user", recorder.run, "b", 0.1, key="second"),
+        )
+
+    asyncio.run(scenario())
+    assert recorder.overlapped()
+    executor.shutdown()
+
+def test_a_failed_run_releases_its_key():
+    executor = CrewExecutor(max_workers=2, max_queue=8, max_per_user=8)
+
+    def fail():
+        raise RuntimeError("boom")
+
+    async def scenario():
+        failed = executor.submit("user", fail, key="thread")
+        after = executor.submit("user", lambda: "next", key="thread")
+        with pytest.raises(RuntimeError):
+            await failed
+        return await after
+
+    assert asyncio.run(scenario()) == "next"
+    executor.shutdown()
+
+def test_admission_is_limited_per_user():
+    executor = CrewExecutor(max_workers=1, max_queue=8, max_per_user=1)
+    release = threading.Event()
+
+    async def scenario():
+        running = executor.submit("user", release.wait, key="thread")
+        with pytest.raises(CrewExecutorBusy) as busy:
+            executor.submit("user", lambda: None, key="thread")
+        release.set()
+        await running
+        return busy.value.status_code
+
+    assert asyncio.run(scenario()) == 429
+    executor.shutdown()
+
+def test_runs_with_the_same_key_do_not_overlap_across_workers(tmp_path):
+    # Two executors over one SQLite file stand in for two worker processes
+    path = str(tmp_path / "sessions.db")
+    executors = [
+        CrewExecutor(max_workers=2, max_queue=8, max_per_user=8, store=SQLiteSessionStore(path), lease_seconds=5)
+        for _ in range(2)
+    ]
+    recorder = Recorder()
+
+    async def scenario():
+        await asyncio.gather(*(
+            executors[index % 2].submit("user", recorder.run, str(index), 0.05, key="thread")
+            for index in range(4)
+        ))
+
+    asyncio.run(scenario())
+    assert len(recorder.events) == 8
+    assert not recorder.overlapped()
+    for executor in executors:
+        executor.shutdown()
+
+def test_lease_wait_times_out_without_holding_a_worker(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    # Another worker process runs a turn of the thread and does not let go
+    holder = Lease(store, "crew_turn_lease", "thread", 5)
+    assert holder.try_acquire()[0]
+    executor = CrewExecutor(
+        max_workers=1, max_queue=8, max_per_user=8, store=store, lease_seconds=5, lease_wait=0.3, lease_poll_interval=0.05
+    )
+    recorder = Recorder()
+
+    async def scenario():
+        leased = executor.submit("user", recorder.run, "leased", key="thread")
+        # The only worker stays free for other runs while the leased one waits
+        assert await executor.submit("user", recorder.run, "other") == "other"
+        assert not leased.done()
+        with pytest.raises(CrewExecutorBusy) as busy:
+            await leased
+        return busy.value.status_code
+
+    assert asyncio.run(scenario()) == 503
+    assert recorder.events == [("start", "other"), ("end", "other")]
+    assert executor.stats()["serialized_keys"] == 0
+    holder.release()
+    executor.shutdown()
+
+def test_leased_run_starts_once_the_lease_is_released(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    holder = Lease(store, "crew_turn_lease", "thread", 5)
+    assert holder.try_acquire()[0]
+    executor = CrewExecutor(
+        max_workers=1, max_queue=8, max_per_user=8, store=store, lease_seconds=5, lease_wait=5, lease_poll_interval=0.05
+    )
+
+    async def scenario():
+        leased = executor.submit("user", lambda: "ran", key="thread")
+        await asyncio.sleep(0.1)
+        holder.release()
+        return await leased
+
+    assert asyncio.run(scenario()) == "ran"
+    # The run gave its lease back
+    assert Lease(store, "crew_turn_lease", "thread", 5).try_acquire()[0]
+    executor.shutdown()
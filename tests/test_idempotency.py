@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from utils.idempotency import IdempotencyCache, IdempotencyConflict
+from utils.session_store import InMemorySessionStore, SQLiteSessionStore
+
+def make_cache(store=None):
+    return IdempotencyCache(store=store or InMemorySessionStore(), lease_seconds=5, poll_interval=0.01)
+
+def counting(result="ok", delay=0.0):
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result
+
+    return fn, calls
+
+def test_first_request_claims_the_key():
+    cache = make_cache()
+    future, owner = cache.claim("user", "key", "fp")
+    assert owner and not future.done()
+    assert cache.stats()["misses"] == 1
+
+def test_retry_replays_the_stored_result():
+    cache = make_cache()
+    fn, calls = counting({"answer": 42})
+
+    async def scenario():
+        first = await cache.run("user", "key", "fp", fn)
+        second = await cache.run("user", "key", "fp", fn)
+        return first, second
+
+    assert asyncio.run(scenario()) == ({"answer": 42}, {"answer": 42})
+    assert len(calls) == 1
+    assert cache.stats()["replayed"] == 1
+
+def test_concurrent_retry_joins_the_running_request():
+    cache = make_cache()
+    fn, calls = counting("done", delay=0.05)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.run("user", "key", "fp", fn) for _ in range(3)))
+
+    assert asyncio.run(scenario()) == ["done"] * 3
+    assert len(calls) == 1
+    assert cache.stats()["joined"] == 2
+
+def test_key_reused_for_another_payload_conflicts():
+    cache = make_cache()
+    fn, _ = counting()
+
+    async def scenario():
+        await cache.run("user", "key", "fp", fn)
+        await cache.run("user", "key", "other", fn)
+
+    with pytest.raises(IdempotencyConflict):
+        asyncio.run(scenario())
+    assert cache.stats()["conflicts"] == 1
+
+def test_keys_are_scoped_per_user():
+    cache = make_cache()
+    fn, calls = counting()
+
+    async def scenario():
+        await cache.run("alice", "key", "fp", fn)
+        await cache.run("bob", "key", "other", fn)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+def test_failed_run_is_forgotten():
+    cache = make_cache()
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("boom")
+        return "recovered"
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await cache.run("user", "key", "fp", flaky)
+        return await cache.run("user", "key", "fp", flaky)
+
+    assert asyncio.run(scenario()) == "recovered"
+    assert len(attempts) == 2
+
+def test_retry_on_another_worker_waits_for_the_result(tmp_path):
+    # Two caches over one SQLite file stand in for two worker processes
+    path = str(tmp_path / "sessions.db")
+    first, second = make_cache(SQLiteSessionStore(path)), make_cache(SQLiteSessionStore(path))
+    fn, calls = counting({"answer": 42}, delay=0.1)
+
+    async def scenario():
+        running = asyncio.ensure_future(first.run("user", "key", "fp", fn))
+        await asyncio.sleep(0.02)
+        waiting = await second.run("user", "key", "fp", fn)
+        return await running, waiting
+
+    assert asyncio.run(scenario()) == ({"answer": 42}, {"answer": 42})
+    assert len(calls) == 1
+    assert second.stats()["joined"] == 1
+
+def test_conflict_is_detected_on_another_worker(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first, second = make_cache(SQLiteSessionStore(path)), make_cache(SQLiteSessionStore(path))
+    first.claim("user", "key", "fp")
+    with pytest.raises(IdempotencyConflict):
+        second.claim("user", "key", "other")
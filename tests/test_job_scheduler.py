@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+
+import utils.job_scheduler as job_scheduler
+from utils.background_loop import BackgroundLoop
+from utils.session_store import InMemorySessionStore, SQLiteSessionStore
+
+class FakeAsgardeo:
+    def __init__(self):
+        self.initiated = 0
+
+    def initiate_ciba_request(self, thread_id, scopes):
+        self.initiated += 1
+        return {"auth_req_id": "req-1", "interval": 0.01}
+
+    def get_ciba_token(self, auth_req_id):
+        return {"state": "success", "token": "token"}
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, monkeypatch):
+    store = InMemorySessionStore() if request.param == "memory" else SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    monkeypatch.setattr(job_scheduler, "session_store", store)
+    return store
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+def test_job_scheduled_inside_a_batch_runs_once(store, monkeypatch):
+    idp = FakeAsgardeo()
+    monkeypatch.setattr(job_scheduler, "asgardeo_manager", idp)
+    scheduler = job_scheduler.CibaJobScheduler(
+        loop=BackgroundLoop("test-scheduler"),
+        initial_delay=0.05,
+        default_interval=0.01,
+        lease_grace=0.01,
+        recover_interval=0.05,
+    )
+    calls = []
+    done = threading.Event()
+
+    def handler(job, token):
+        calls.append(job.id)
+        done.set()
+
+    scheduler.register_handler("upgrade", handler)
+    # A tool schedules the job while its chat turn holds a session store batch
+    with store.batch():
+        job = scheduler.schedule("upgrade", "thread-1", ["openid"], {"room": 1})
+
+    assert done.wait(2.0)
+    assert wait_for(lambda: not scheduler.jobs.keys())
+    # Give the recovery sweep a few passes to pick up a job that never looked finished
+    time.sleep(0.3)
+    assert calls == [job.id]
+    assert idp.initiated == 1
+    assert scheduler.jobs.get(job.id) is None
+
+def test_jobs_are_listed_by_key(store, monkeypatch):
+    scheduler = job_scheduler.CibaJobScheduler(loop=BackgroundLoop("test-scheduler"), initial_delay=60)
+    scheduler.start = lambda: None
+    scheduler.loop.call_soon = lambda *args: None
+    first = scheduler.schedule("upgrade", "thread-1", [], {})
+    second = scheduler.schedule("upgrade", "thread-2", [], {})
+    assert sorted(scheduler.jobs.keys()) == sorted([first.id, second.id])
+
+    scheduler._finish(first)
+    assert scheduler.jobs.keys() == [second.id]
+
+def test_recovery_claim_is_taken_by_one_scheduler(store):
+    schedulers = []
+    for _ in range(4):
+        scheduler = job_scheduler.CibaJobScheduler(loop=BackgroundLoop("test-scheduler"), initial_delay=0, lease_grace=60)
+        scheduler.register_handler("upgrade", lambda job, token: None)
+        schedulers.append(scheduler)
+    now = time.time()
+    # A job whose owner died: its lease ran out
+    job = job_scheduler.CibaJob(
+        id="job-1",
+        kind="upgrade",
+        thread_id="thread-1",
+        scopes=[],
+        payload={},
+        interval=1,
+        next_run_at=now - 10,
+        deadline=now + 600,
+        lease_until=now - 1,
+    )
+    schedulers[0]._save(job)
+
+    claimed = []
+    barrier = threading.Barrier(len(schedulers))
+
+    def sweep(scheduler):
+        barrier.wait()
+        claimed.append(scheduler._claim(job.id, time.time()))
+
+    threads = [threading.Thread(target=sweep, args=(scheduler,)) for scheduler in schedulers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len([job for job in claimed if job is not None]) == 1
+    assert schedulers[0].jobs.get(job.id).lease_until > time.time()
+
+class FlakyAsgardeo(FakeAsgardeo):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.polls = 0
+
+    def get_ciba_token(self, auth_req_id):
+        self.polls += 1
+        if self.polls <= self.failures:
+            raise ConnectionError("IdP unreachable")
+        return super().get_ciba_token(auth_req_id)
+
+def run_flaky_job(monkeypatch, failures, max_attempts):
+    idp = FlakyAsgardeo(failures)
+    monkeypatch.setattr(job_scheduler, "asgardeo_manager", idp)
+    scheduler = job_scheduler.CibaJobScheduler(
+        loop=BackgroundLoop("test-scheduler"),
+        initial_delay=0.01,
+        default_interval=0.01,
+        max_attempts=max_attempts,
+        retry_backoff=0.01,
+    )
+    calls = []
+    scheduler.register_handler("upgrade", lambda job, token: calls.append(token))
+    job = scheduler.schedule("upgrade", "thread-1", ["openid"], {})
+    assert wait_for(lambda: scheduler.jobs.get(job.id) is None)
+    return idp, calls
+
+def test_transient_failures_are_retried(store, monkeypatch):
+    idp, calls = run_flaky_job(monkeypatch, failures=2, max_attempts=3)
+
+    assert calls == ["token"]
+    assert idp.polls == 3
+
+def test_job_is_dropped_after_max_attempts(store, monkeypatch):
+    idp, calls = run_flaky_job(monkeypatch, failures=10, max_attempts=3)
+
+    assert calls == []
+    assert idp.polls == 3
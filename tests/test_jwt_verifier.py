@@ -0,0 +1,124 @@
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+from jwt.exceptions import ExpiredSignatureError, InvalidAudienceError, InvalidSignatureError, InvalidTokenError
+
+from utils.jwt_verifier import JwksCache, JwtVerifier
+
+def new_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+def jwk(key, kid):
+    return {**RSAAlgorithm.to_jwk(key.public_key(), as_dict=True), "kid": kid, "alg": "RS256", "use": "sig"}
+
+def token(key, kid, **claims):
+    claims = {"sub": "user-1", "exp": time.time() + 300, **claims}
+    return jwt.encode(claims, key, algorithm="RS256", headers={"kid": kid})
+
+class FakeJwks(JwksCache):
+    """Serves a key set the test can rotate, and counts fetches"""
+
+    def __init__(self, keys, min_refresh_interval=60):
+        super().__init__(url="https://idp.test/jwks", max_age=3600, min_refresh_interval=min_refresh_interval)
+        self.served = keys
+        self.fetches = 0
+        self.fail = False
+
+    def _fetch(self):
+        self.fetches += 1
+        if self.fail:
+            raise ConnectionError("IdP unreachable")
+        return {"keys": list(self.served)}
+
+@pytest.fixture(scope="module")
+def keys():
+    return {"old": new_key(), "new": new_key(), "other": new_key()}
+
+@pytest.fixture
+def jwks(keys):
+    return FakeJwks([jwk(keys["old"], "old")])
+
+@pytest.fixture
+def verifier(jwks):
+    verifier = JwtVerifier(jwks)
+    verifier.verify_signature = True
+    verifier.algorithms = ["RS256"]
+    verifier.audience = None
+    verifier.issuer = None
+    verifier.leeway = 0
+    return verifier
+
+def test_verified_claims_are_cached(verifier, jwks, keys):
+    issued = token(keys["old"], "old")
+
+    claims, decoded = verifier.verify(issued)
+    assert claims["sub"] == "user-1" and decoded
+    claims, decoded = verifier.verify(issued)
+    assert claims["sub"] == "user-1" and not decoded
+    assert verifier.stats() == {"entries": 1, "hits": 1, "misses": 1}
+    assert jwks.fetches == 1
+
+def test_unknown_kid_refetches_the_key_set(verifier, jwks, keys):
+    verifier.verify(token(keys["old"], "old"))
+    jwks.attempted_at -= jwks.min_refresh_interval
+    # The IdP rotated its signing key
+    jwks.served.append(jwk(keys["new"], "new"))
+
+    claims, _ = verifier.verify(token(keys["new"], "new"))
+
+    assert claims["sub"] == "user-1"
+    assert jwks.fetches == 2
+
+def test_unknown_kid_refetch_is_rate_limited(verifier, jwks, keys):
+    verifier.verify(token(keys["old"], "old"))
+
+    for attempt in range(3):
+        with pytest.raises(InvalidTokenError, match="Unknown signing key"):
+            verifier.verify(token(keys["other"], f"garbage-{attempt}"))
+
+    assert jwks.fetches == 1
+
+def test_failed_refetch_keeps_cached_keys(verifier, jwks, keys):
+    verifier.verify(token(keys["old"], "old"))
+    jwks.attempted_at -= jwks.min_refresh_interval
+    jwks.fail = True
+
+    with pytest.raises(InvalidTokenError):
+        verifier.verify(token(keys["new"], "new"))
+    claims, _ = verifier.verify(token(keys["old"], "old", sub="user-2"))
+
+    assert claims["sub"] == "user-2"
+    assert jwks.fetches == 2
+
+def test_expired_token_is_rejected(verifier, keys):
+    with pytest.raises(ExpiredSignatureError):
+        verifier.verify(token(keys["old"], "old", exp=time.time() - 10))
+
+def test_cached_claims_expire_with_the_token(verifier, keys):
+    issued = token(keys["old"], "old", exp=time.time() + 1)
+    verifier.verify(issued)
+    time.sleep(1.1)
+
+    with pytest.raises(ExpiredSignatureError):
+        verifier.verify(issued)
+
+def test_bad_signature_is_rejected(verifier, keys):
+    # Signed by another key under a kid the verifier trusts
+    with pytest.raises(InvalidSignatureError):
+        verifier.verify(token(keys["other"], "old"))
+
+def test_wrong_audience_is_rejected(verifier, keys):
+    verifier.audience = "hotel-agent"
+
+    assert verifier.verify(token(keys["old"], "old", aud="hotel-agent"))[0]["aud"] == "hotel-agent"
+    with pytest.raises(InvalidAudienceError):
+        verifier.verify(token(keys["old"], "old", aud="another-app"))
+
+def test_token_without_subject_is_rejected(verifier, keys):
+    issued = jwt.encode({"exp": time.time() + 300}, keys["old"], algorithm="RS256", headers={"kid": "old"})
+
+    with pytest.raises(InvalidTokenError):
+        verifier.verify(issued)
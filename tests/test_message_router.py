@@ -0,0 +1,37 @@
+import pytest
+
+from utils.chat_history import Message
+from utils.message_router import route_message
+
+def history(*user_messages):
+    messages = []
+    for text in user_messages:
+        messages.append(Message(role="user", content=text))
+        messages.append(Message(role="assistant", content="reply"))
+    return messages
+
+@pytest.mark.parametrize("message, earlier, aggregate, reason", [
+    ("Show me hotels in Kandy", (), False, "first_message"),
+    ("yes", ("Book room 101",), False, "confirmation"),
+    ("Yes please, go ahead!", ("Book room 101",), False, "confirmation"),
+    ("no thanks", ("Book room 101",), False, "confirmation"),
+    ("Book room 101 at hotel 3 from 2025-03-01 to 2025-03-04", ("hi",), False, "self_contained"),
+    ("Book hotel id: 3 on 5th of March", ("hi",), False, "self_contained"),
+    ("book room #12 for March 5", ("hi",), False, "self_contained"),
+    # An ID without dates, or dates without an ID, still needs the earlier turns
+    ("Book room 101", ("hi",), True, "needs_context"),
+    ("Book it for 2025-03-01", ("hi",), True, "needs_context"),
+    ("What about the other one?", ("hi",), True, "needs_context"),
+    # A confirmation word opening a long, new request is not a confirmation
+    ("yes and also show me all the hotels in Galle with a pool and a spa please", ("hi",), True, "needs_context"),
+])
+def test_route_message(message, earlier, aggregate, reason):
+    messages = history(*earlier) + [Message(role="user", content=message)]
+    decision = route_message(message, messages)
+    assert (decision.aggregate, decision.reason) == (aggregate, reason)
+    assert decision.path == ("aggregated" if aggregate else "fast")
+
+def test_fast_path_can_be_disabled(monkeypatch):
+    monkeypatch.setenv("CREW_FAST_PATH", "false")
+    decision = route_message("yes", [Message(role="user", content="yes")])
+    assert (decision.aggregate, decision.reason) == (True, "disabled")
@@ -0,0 +1,86 @@
+import time
+import uuid
+
+import pytest
+
+from utils.pending_auth import PendingAuthorizationStore, pkce_challenge
+
+def build_url(state, code_challenge):
+    return f"https://idp.test/authorize?state={state}&code_challenge={code_challenge}"
+
+def create(store, thread_id, user_id="user-1", scopes=("openid", "booking")):
+    return store.get_or_create("booking", thread_id, user_id, list(scopes), "https://app.test/callback", build_url)
+
+@pytest.fixture
+def thread_id():
+    # The stores share the process-wide session store, keep threads apart between tests
+    return str(uuid.uuid4())
+
+def test_state_is_consumed_once(thread_id):
+    store = PendingAuthorizationStore(ttl=60, min_remaining=0)
+    pending = create(store, thread_id)
+
+    consumed = store.consume(pending.state)
+    assert consumed.thread_id == thread_id
+    assert consumed.authorization_url == build_url(pending.state, None)
+    assert store.consume(pending.state) is None
+    assert store.consume("unknown-state") is None
+
+def test_state_expires_after_ttl(thread_id):
+    store = PendingAuthorizationStore(ttl=0.2, min_remaining=0)
+    pending = create(store, thread_id)
+    time.sleep(0.3)
+
+    assert store.consume(pending.state) is None
+
+def test_pending_request_is_reused(thread_id):
+    store = PendingAuthorizationStore(ttl=60, min_remaining=0)
+    pending = create(store, thread_id)
+
+    # Same kind, thread, user and scopes, in any order
+    assert create(store, thread_id, scopes=("booking", "openid", "openid")).state == pending.state
+    assert create(store, thread_id, user_id="user-2").state != pending.state
+    assert create(store, thread_id, scopes=("openid",)).state != pending.state
+
+def test_consumed_request_is_not_reused(thread_id):
+    store = PendingAuthorizationStore(ttl=60, min_remaining=0)
+    pending = create(store, thread_id)
+    store.consume(pending.state)
+
+    assert create(store, thread_id).state != pending.state
+
+def test_request_close_to_expiry_is_not_reused(thread_id):
+    store = PendingAuthorizationStore(ttl=60, min_remaining=120)
+    pending = create(store, thread_id)
+
+    assert create(store, thread_id).state != pending.state
+    # The old state still works until it expires
+    assert store.consume(pending.state) is not None
+
+def test_oldest_requests_are_dropped_beyond_max_entries(thread_id):
+    store = PendingAuthorizationStore(ttl=60, max_entries=2, min_remaining=0)
+    states = [create(store, f"{thread_id}-{index}").state for index in range(3)]
+
+    assert store.stats() == {"issued": 2}
+    assert store.consume(states[0]) is None
+    assert store.consume(states[1]) is not None
+    assert store.consume(states[2]) is not None
+
+def test_pkce_verifier_matches_challenge(thread_id):
+    store = PendingAuthorizationStore(ttl=60, min_remaining=0)
+    store.use_pkce = True
+    pending = create(store, thread_id)
+
+    assert pending.code_verifier
+    assert pending.authorization_url == build_url(pending.state, pkce_challenge(pending.code_verifier))
+
+@pytest.mark.parametrize("path", ["/callback", "/google_callback"])
+def test_callback_rejects_unknown_state(path):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    response = TestClient(main.app).get(path, params={"code": "code", "state": "unknown-state"})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid state"}
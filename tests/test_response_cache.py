@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+from utils.constants import FlowState
+from utils.response_cache import CachedResponse, ResponseCache
+from utils.tool_output import ToolOutputShaper
+
+DIGEST = "FETCHED_HOTELS"
+
+def cached(text="We have 3 hotels", payloads=None, states=(FlowState.FETCHED_HOTELS,)):
+    crew_dict = {"response": {"chat_response": text}}
+    return CachedResponse(crew_dict, crew_dict, payloads if payloads is not None else {}, list(states))
+
+@pytest.fixture
+def cache():
+    return ResponseCache(enabled=True, threshold=0.8, ttl=60, max_entries=16)
+
+@pytest.mark.parametrize("stored, asked, hit", [
+    # Same question, different wording or filler words
+    ("What hotels do you have?", "what hotels do you have", True),
+    ("What hotels do you have?", "Show me your hotels", True),
+    ("Show me rooms in Kandy", "rooms in kandy please", True),
+    ("Which hotels have a pool?", "which hotels have pools", True),
+    # A different subject
+    ("Show me rooms in Kandy", "Show me rooms in Galle", False),
+    ("What hotels do you have?", "What suites do you have?", False),
+    # Trigrams barely tell numbers apart, they must match exactly
+    ("Tell me about room 101", "Tell me about room 102", False),
+])
+def test_similar_messages(cache, stored, asked, hit):
+    assert cache.store(stored, DIGEST, cached(), {"FetchHotelsTool"})
+
+    assert (cache.lookup(asked, DIGEST) is not None) == hit
+
+@pytest.mark.parametrize("message", [
+    "Book a room in Kandy",
+    "Show me my bookings",
+    "What rooms does it have?",
+    "Rooms for 2024-05-01",
+    "Hello there",
+])
+def test_non_catalog_messages_bypass_the_cache(cache, message):
+    assert not cache.store(message, DIGEST, cached(), {"FetchHotelsTool"})
+    assert cache.lookup(message, DIGEST) is None
+    assert cache.stats()["bypassed"] == 1
+
+def test_near_duplicate_misses_when_flow_state_differs(cache):
+    cache.store("What hotels do you have?", DIGEST, cached(), {"FetchHotelsTool"})
+
+    assert cache.lookup("What hotels do you have?", "FETCHED_HOTELS,FETCHED_ROOM") is None
+    assert cache.lookup("Show me your hotels", "FETCHED_HOTELS,FETCHED_ROOM") is None
+    assert cache.lookup("Show me your hotels", DIGEST) is not None
+
+@pytest.mark.parametrize("tools, states, payloads", [
+    ({"FetchHotelsTool", "CreateBookingTool"}, [FlowState.FETCHED_HOTELS], {}),
+    ({"FetchHotelsTool"}, [FlowState.BOOKING_PREVIEW_INITIATED], {}),
+    ({"FetchHotelsTool"}, [FlowState.FETCHED_HOTELS], None),
+])
+def test_turns_with_side_effects_are_not_stored(cache, tools, states, payloads):
+    response = CachedResponse({}, {}, payloads, states)
+
+    assert not cache.store("What hotels do you have?", DIGEST, response, tools)
+    assert cache.lookup("What hotels do you have?", DIGEST) is None
+    assert cache.stats()["rejected"] == 1
+
+def test_entries_expire_after_ttl():
+    cache = ResponseCache(enabled=True, ttl=0.2)
+    cache.store("What hotels do you have?", DIGEST, cached(), {"FetchHotelsTool"})
+    assert cache.lookup("Show me your hotels", DIGEST) is not None
+    time.sleep(0.3)
+
+    assert cache.lookup("What hotels do you have?", DIGEST) is None
+    assert cache.lookup("Show me your hotels", DIGEST) is None
+    assert cache.stats()["entries"] == 0
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(enabled=True, max_entries=2)
+    cache.store("Show me rooms in Kandy", DIGEST, cached("kandy"), set())
+    cache.store("Show me rooms in Galle", DIGEST, cached("galle"), set())
+    cache.lookup("Show me rooms in Kandy", DIGEST)
+    cache.store("Show me rooms in Colombo", DIGEST, cached("colombo"), set())
+
+    assert cache.lookup("Show me rooms in Galle", DIGEST) is None
+    assert cache.lookup("Show me rooms in Kandy", DIGEST).crew_dict["response"]["chat_response"] == "kandy"
+    assert cache.stats()["evictions"] == 1
+
+def test_lookup_returns_a_copy(cache):
+    cache.store("What hotels do you have?", DIGEST, cached(), {"FetchHotelsTool"})
+    cache.lookup("What hotels do you have?", DIGEST).crew_dict["response"]["chat_response"] = "changed"
+
+    assert cache.lookup("What hotels do you have?", DIGEST).crew_dict["response"]["chat_response"] == "We have 3 hotels"
+
+def test_replay_reissues_tool_output_handles(cache):
+    shaper = ToolOutputShaper(inline_chars=0)
+    hotels = [{"id": 1, "name": "Hotel Kandy"}]
+    shaped = shaper.shape("hotels", hotels, "thread-1")
+    history_dict = {"response": {"tool_response": shaped}}
+    payloads = shaper.collect(history_dict, "thread-1")
+    cache.store("What hotels do you have?", DIGEST, CachedResponse({}, history_dict, payloads, []), {"FetchHotelsTool"})
+
+    # Another thread asks the same question and gets handles of its own
+    hit = cache.lookup("Show me your hotels", DIGEST)
+    replayed = shaper.rebind(hit.history_dict, hit.payloads, "thread-2")
+    handle = replayed["response"]["tool_response"]["handle"]
+
+    assert handle != shaped["handle"]
+    assert shaper.get(handle, "thread-2") == hotels
+    assert shaper.get(handle, "thread-1") is None
+    assert shaper.resolve(replayed, "thread-2") == {"response": {"tool_response": hotels}}
+
+def test_disabled_cache_stores_nothing():
+    cache = ResponseCache(enabled=False)
+
+    assert not cache.store("What hotels do you have?", DIGEST, cached(), {"FetchHotelsTool"})
+    assert cache.lookup("What hotels do you have?", DIGEST) is None
@@ -0,0 +1,168 @@
+import threading
+import time
+
+import pytest
+from pydantic import BaseModel
+
+from utils.session_store import InMemorySessionStore, Lease, ModelCodec, RedisSessionStore, SQLiteSessionStore
+
+class ChatResponse(BaseModel):
+    chat_response: str
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemorySessionStore()
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisSessionStore(client=fakeredis.FakeRedis(), prefix="test")
+
+def test_set_get_delete_and_pop(store):
+    store.set("ns", "a", {"value": 1})
+    store.set("ns", "b", [1, 2])
+
+    assert store.get("ns", "a") == {"value": 1}
+    assert store.get_many("ns", ["a", "b", "missing"]) == {"a": {"value": 1}, "b": [1, 2]}
+    assert store.get("other", "a", "default") == "default"
+
+    store.delete("ns", "a")
+    assert store.get("ns", "a") is None
+    assert store.pop("ns", "b") == [1, 2]
+    assert store.pop("ns", "b", "gone") == "gone"
+
+def test_sub_second_ttl_expires(store):
+    store.set("ns", "short", "value", ttl=0.2)
+    store.set("ns", "long", "value", ttl=60)
+
+    assert store.get("ns", "short") == "value"
+    time.sleep(0.35)
+    assert store.get("ns", "short") is None
+    assert store.get("ns", "long") == "value"
+    assert store.keys("ns") == ["long"]
+
+def test_update_ttl_below_one_second_expires(store):
+    store.update("ns", "counter", lambda current: 1, ttl=0.2)
+
+    assert store.get("ns", "counter") == 1
+    time.sleep(0.35)
+    assert store.get("ns", "counter") is None
+
+def test_keys_include_batched_writes_and_deletes(store):
+    store.set("ns", "kept", 1)
+    store.set("ns", "deleted", 2)
+
+    with store.batch():
+        store.set("ns", "added", 3)
+        store.delete("ns", "deleted")
+        assert sorted(store.keys("ns")) == ["added", "kept"]
+
+    assert sorted(store.keys("ns")) == ["added", "kept"]
+
+def test_batch_buffers_writes_until_exit(store):
+    seen = {}
+    with store.batch():
+        store.set("ns", "a", 1)
+        store.set("ns", "b", 2, ttl=60)
+        assert store.get("ns", "a") == 1
+        # Other threads run outside the batch and see the backend only
+        thread = threading.Thread(target=lambda: seen.update(store.get_many("ns", ["a", "b"])))
+        thread.start()
+        thread.join()
+
+    assert seen == {}
+    assert store.get_many("ns", ["a", "b"]) == {"a": 1, "b": 2}
+
+def test_batch_memoizes_reads(store):
+    store.set("ns", "a", 1)
+    with store.batch():
+        assert store.get("ns", "a") == 1
+        with store.direct():
+            store.set("ns", "a", 2)
+        assert store.get("ns", "a") == 1
+
+    assert store.get("ns", "a") == 2
+
+def test_direct_bypasses_batch(store):
+    seen = {}
+    with store.batch():
+        with store.direct():
+            store.set("ns", "a", 1)
+        thread = threading.Thread(target=lambda: seen.update(store.get_many("ns", ["a"])))
+        thread.start()
+        thread.join()
+
+    assert seen == {"a": 1}
+
+def test_update_is_not_buffered(store):
+    store.set("ns", "counter", 5)
+    with store.batch():
+        store.set("ns", "counter", 10)
+        # update drops the buffered write and applies fn to the backend value
+        assert store.update("ns", "counter", lambda current: current + 1) == 6
+        assert store.get("ns", "counter") == 6
+
+    assert store.get("ns", "counter") == 6
+
+def test_concurrent_updates_are_atomic(store):
+    store.set("ns", "counter", 0)
+
+    def increment():
+        for _ in range(20):
+            store.update("ns", "counter", lambda current: current + 1)
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.get("ns", "counter") == 80
+
+def test_unbatched_mapping_with_codec(store):
+    responses = store.mapping("responses", ModelCodec(ChatResponse), batched=False)
+    response = ChatResponse(chat_response="hello")
+
+    with store.batch():
+        responses["thread-1"] = response
+        seen = {}
+        thread = threading.Thread(target=lambda: seen.update(responses.get_many(["thread-1"])))
+        thread.start()
+        thread.join()
+
+    assert seen == {"thread-1": response}
+    assert "thread-1" in responses
+    assert responses.update("thread-1", lambda value: value.model_copy(update={"chat_response": "bye"})).chat_response == "bye"
+    assert responses.pop("thread-1").chat_response == "bye"
+    assert "thread-1" not in responses
+
+def test_lease_is_exclusive_until_released(store):
+    first = Lease(store, "lease", "key", 5, {"holder": 1})
+    second = Lease(store, "lease", "key", 5, {"holder": 2})
+
+    assert first.try_acquire() == (True, {"holder": 1})
+    assert second.try_acquire() == (False, {"holder": 1})
+    assert not second.acquire(timeout=0.1)
+
+    first.release()
+    assert second.acquire(timeout=0.1)
+    second.release()
+
+def test_lease_of_a_dead_holder_expires(store):
+    dead = Lease(store, "lease", "key", 0.3)
+    assert dead.try_acquire()[0]
+    # Stop renewing without releasing, as a crashed worker would
+    dead.stopped.set()
+
+    waiting = Lease(store, "lease", "key", 5)
+    assert not waiting.try_acquire()[0]
+    assert waiting.acquire(timeout=2.0)
+    waiting.release()
+
+def test_held_lease_is_renewed(store):
+    lease = Lease(store, "lease", "key", 0.3)
+    assert lease.try_acquire()[0]
+    time.sleep(0.6)
+
+    assert not Lease(store, "lease", "key", 0.3).try_acquire()[0]
+    lease.release()
@@ -0,0 +1,137 @@
+import pytest
+
+from schemas import CrewOutput, Response
+from utils.constants import FrontendState
+from utils.structured_output import StructuredOutputParser, ToolResult, collect_tool_results, repair_json, tool_result
+
+VALID = '{"response": {"chat_response": "Hi", "tool_response": null}, "frontend_state": "NO_STATE"}'
+EXPECTED = {"response": {"chat_response": "Hi", "tool_response": None}, "frontend_state": "NO_STATE"}
+
+@pytest.mark.parametrize("text, expected", [
+    # Valid JSON, as is or surrounded by whitespace
+    (VALID, EXPECTED),
+    (f"\n  {VALID}  \n", EXPECTED),
+    # ReAct prefix
+    (f"Thought: I know the answer\nFinal Answer: {VALID}", EXPECTED),
+    # Fenced, with or without a language tag
+    (f"```json\n{VALID}\n```", EXPECTED),
+    (f"Here you go:\n```\n{VALID}\n```\nAnything else?", EXPECTED),
+    (f"Final Answer: ```json\n{VALID}\n```", EXPECTED),
+    # Single-quoted strings and Python literals
+    ("{'response': {'chat_response': 'Hi', 'tool_response': None}, 'frontend_state': 'NO_STATE'}", EXPECTED),
+    ("{'ok': True, 'done': False, 'value': None}", {"ok": True, "done": False, "value": None}),
+    ("{'chat_response': \"it's here\"}", {"chat_response": "it's here"}),
+    ("{'chat_response': 'say \"hi\"'}", {"chat_response": 'say "hi"'}),
+    # Truncated objects
+    ('{"response": {"chat_response": "Hi", "tool_response": null}, "frontend_state": "NO_ST',
+     {"response": {"chat_response": "Hi", "tool_response": None}, "frontend_state": "NO_ST"}),
+    ('{"response": {"chat_response": "Hi"', {"response": {"chat_response": "Hi"}}),
+    ('{"response": {"chat_response": "Hi",', {"response": {"chat_response": "Hi"}}),
+    ('{"items": [1, 2', {"items": [1, 2]}),
+    ('{"a": 1, "b":', {"a": 1}),
+    ('{"a": 1, "b"', {"a": 1}),
+    ('{"a": {"b": 1, "c', {"a": {"b": 1}}),
+    ('{"a": ["x", "y', {"a": ["x", "y"]}),
+    # Trailing commas and raw newlines in strings
+    ('{"a": [1, 2,], "b": 3,}', {"a": [1, 2], "b": 3}),
+    ('{"chat_response": "line one\nline two"}', {"chat_response": "line one\nline two"}),
+    # Trailing prose after the object
+    (f"{VALID}\nLet me know if you need anything else.", EXPECTED),
+    (f"{VALID} I hope this {{helps}}", EXPECTED),
+    ("{'a': 1} and that is {'b': 2}", {"a": 1}),
+    # Non-ASCII text
+    ("{'chat_response': 'Café in Galle', 'ok': True}", {"chat_response": "Café in Galle", "ok": True}),
+    ('{"chat_response": "Ayubowan, කොහොමද', {"chat_response": "Ayubowan, කොහොමද"}),
+])
+def test_repair_json(text, expected):
+    assert repair_json(text) == expected
+
+@pytest.mark.parametrize("text", [
+    "",
+    "Sure, which city are you travelling to?",
+    "Final Answer: I could not find any hotels.",
+    # Bare non-ASCII words cannot be repaired
+    '{"response": {"chat_response": "ok"}, é}',
+    '{"chat_response": café}',
+])
+def test_repair_json_without_an_object(text):
+    assert not isinstance(repair_json(text), dict)
+
+@pytest.fixture
+def parser():
+    return StructuredOutputParser()
+
+def output(chat_response=None, tool_response=None, state=FrontendState.NO_STATE):
+    return CrewOutput(response=Response(chat_response=chat_response, tool_response=tool_response), frontend_state=state)
+
+def test_parse_valid_answer(parser):
+    assert parser.parse(VALID) == output("Hi")
+    assert parser.stats()["valid"] == 1
+
+def test_parse_repaired_answer_defaults_the_frontend_state(parser):
+    parsed = parser.parse('Final Answer: {"response": {"chat_response": "Hi"')
+    assert parsed == output("Hi")
+    assert parser.stats()["repaired"] == 1
+
+def test_parse_replaces_a_cut_off_frontend_state(parser):
+    parsed = parser.parse('{"response": {"chat_response": "Hi"}, "frontend_state": "BOOKING_PREV')
+    assert parsed == output("Hi")
+
+def test_parse_rejects_objects_that_do_not_match_the_schema(parser):
+    assert parser.parse('{"response": "Hi", "frontend_state": "NO_STATE"}') is None
+
+@pytest.mark.parametrize("text", ["Which dates work for you?", "Final Answer: {not json at all", ""])
+def test_finalize_falls_back_to_plain_text(parser, text):
+    result = parser.finalize(text, [])
+    assert result.frontend_state == FrontendState.NO_STATE
+    assert result.response.tool_response is None
+    assert parser.stats()["fallback"] == 1
+
+def test_finalize_fills_tool_response_from_the_latest_tool_result(parser):
+    results = [
+        ToolResult(output(tool_response={"hotels": [1]})),
+        ToolResult(output(tool_response={"hotel": 1})),
+        ToolResult(output(chat_response="no payload")),
+    ]
+    result = parser.finalize(VALID, results)
+    assert result.response.chat_response == "Hi"
+    assert result.response.tool_response == {"hotel": 1}
+    assert parser.stats()["merged_tool_results"] == 1
+
+def test_finalize_keeps_the_answers_own_tool_response(parser):
+    answer = '{"response": {"chat_response": "Hi", "tool_response": {"room": 7}}, "frontend_state": "NO_STATE"}'
+    result = parser.finalize(answer, [ToolResult(output(tool_response={"hotel": 1}))])
+    assert result.response.tool_response == {"room": 7}
+
+def test_finalize_takes_the_frontend_state_of_the_last_tool_when_the_answer_has_none(parser):
+    results = [
+        ToolResult(output(state=FrontendState.BOOKING_PREVIEW)),
+        ToolResult(output(state=FrontendState.BOOKING_COMPLETED)),
+    ]
+    assert parser.finalize(VALID, results).frontend_state == FrontendState.BOOKING_COMPLETED
+
+def test_finalize_keeps_the_answers_own_frontend_state(parser):
+    answer = '{"response": {"chat_response": "Hi"}, "frontend_state": "UNAUTHORIZED"}'
+    results = [ToolResult(output(state=FrontendState.BOOKING_PREVIEW))]
+    assert parser.finalize(answer, results).frontend_state == FrontendState.UNAUTHORIZED
+
+def test_finalize_without_tool_results_keeps_no_state(parser):
+    assert parser.finalize(VALID, []).frontend_state == FrontendState.NO_STATE
+
+def test_finalize_returns_the_last_final_tool_result_unchanged(parser):
+    booked = output("Booked", {"booking_id": 1}, FrontendState.BOOKING_COMPLETED)
+    results = [ToolResult(output(tool_response={"hotel": 1})), ToolResult(booked, final=True)]
+    result = parser.finalize("Final Answer: something else entirely", results)
+    assert result == booked
+    assert result is not booked
+    assert parser.stats()["tool_answers"] == 1
+
+def test_tool_result_publishes_to_the_running_turn():
+    booked = output("Booked", state=FrontendState.BOOKING_COMPLETED)
+    with collect_tool_results() as results:
+        text = tool_result(booked, final=True)
+    assert CrewOutput.model_validate_json(text) == booked
+    assert results == [ToolResult(booked, final=True)]
+    # Outside a turn the result is only returned
+    tool_result(booked)
+    assert len(results) == 1
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+from utils.token_cache import TokenCache
+
+class Fetcher:
+    def __init__(self, expires_in=3600, delay=0.0):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, scopes):
+        with self.lock:
+            self.calls.append(scopes)
+            count = len(self.calls)
+        time.sleep(self.delay)
+        return f"token-{count}", self.expires_in
+
+def test_scopes_are_normalized():
+    fetcher = Fetcher()
+    cache = TokenCache(fetcher)
+    assert cache.get(["b", "a", "a"]) == cache.get(["a", "b"]) == "token-1"
+    assert fetcher.calls == [["a", "b"]]
+
+def test_concurrent_misses_share_one_fetch():
+    fetcher = Fetcher(delay=0.1)
+    cache = TokenCache(fetcher)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(["openid"]))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["token-1"] * 8
+    assert len(fetcher.calls) == 1
+
+def test_refresh_margin_is_capped_at_half_the_lifetime():
+    cache = TokenCache(Fetcher(expires_in=60), refresh_margin=300)
+    cache.get(["openid"])
+    entry = cache.entries[("openid",)]
+    assert entry.expires_at - entry.refresh_at == pytest.approx(30, abs=0.1)
+
+def test_token_in_refresh_window_is_served_while_it_refreshes():
+    fetcher = Fetcher(expires_in=1.0, delay=0.05)
+    cache = TokenCache(fetcher, refresh_margin=0.4)
+    assert cache.get(["openid"]) == "token-1"
+    time.sleep(0.65)
+    # Inside the refresh window but not expired: the old token, and one background refresh
+    assert cache.get(["openid"]) == "token-1"
+    assert cache.get(["openid"]) == "token-1"
+    time.sleep(0.1)
+    assert cache.get(["openid"]) == "token-2"
+    assert len(fetcher.calls) == 2
+
+def test_expired_token_is_fetched_again():
+    fetcher = Fetcher(expires_in=0.05)
+    cache = TokenCache(fetcher)
+    assert cache.get(["openid"]) == "token-1"
+    time.sleep(0.1)
+    assert cache.get(["openid"]) == "token-2"
+
+def test_missing_expiry_uses_the_default_ttl():
+    cache = TokenCache(Fetcher(expires_in=None), default_ttl=120, refresh_margin=10)
+    cache.get(["openid"])
+    entry = cache.entries[("openid",)]
+    assert entry.expires_at - time.monotonic() == pytest.approx(120, abs=1)
+
+def test_failed_fetch_is_raised_and_not_cached():
+    attempts = []
+
+    def flaky(scopes):
+        attempts.append(scopes)
+        if len(attempts) == 1:
+            raise RuntimeError("idp down")
+        return "token", 3600
+
+    cache = TokenCache(flaky)
+    with pytest.raises(RuntimeError):
+        cache.get(["openid"])
+    assert cache.get(["openid"]) == "token"
+    assert not cache.inflight
+
+def test_invalidate_forces_a_fetch():
+    fetcher = Fetcher()
+    cache = TokenCache(fetcher)
+    cache.get(["openid"])
+    cache.invalidate(["openid"])
+    assert cache.get(["openid"]) == "token-2"
@@ -6,6 +6,7 @@ from pydantic import BaseModel, Field
 import requests
 
 from schemas import CrewOutput, Response
+from utils.structured_output import tool_result
 from utils.state_manager import state_manager
 from utils.asgardeo_manager import asgardeo_manager
 from utils.constants import FlowState, FrontendState
@@ -21,6 +22,8 @@ class AddCalanderTool(BaseTool):
     description: str = "Adds a booking to the calander."
     args_schema: Type[BaseModel] = AddCalanderToolInput
     thread_id: Optional[str] = None
+    # A successful result is the reply, the agent does not rephrase it. Failures go back to the agent.
+    result_as_answer: bool = True
 
     def __init__(self, thread_id: str = None):
         super().__init__()
@@ -62,27 +65,30 @@ class AddCalanderTool(BaseTool):
                 message = f"Event created successfully in your calendar"
                 frontend_state = FrontendState.ADDED_TO_CALENDAR
                 state_manager.add_state(self.thread_id, FlowState.ADDED_TO_CALENDAR)
+                final = self.result_as_answer
             else:
                 message = "An error occurred while adding the event to the calendar. Please try the Add to Calendar tool again."
                 frontend_state = FrontendState.CALENDAR_ERROR
+                # Failures go back to the agent, which can recover or explain them
+                final = False
                 
             response = Response(
                 chat_response=message,
                 tool_response={}
             )
-            return CrewOutput(response=response, frontend_state=frontend_state).model_dump_json()
+            return tool_result(CrewOutput(response=response, frontend_state=frontend_state), final=final)
 
         except requests.exceptions.RequestException as e:
             error_response = Response(
                 chat_response=f"An error occurred while adding the event to the calendar, please try again.",
                 tool_response={}
             )
-            return CrewOutput(response=error_response, frontend_state=FrontendState.CALENDAR_ERROR).model_dump_json()
+            return tool_result(CrewOutput(response=error_response, frontend_state=FrontendState.CALENDAR_ERROR))
         except Exception as e:
             error_response = Response(
                 chat_response=f"An error occurred while adding the event to the calendar, please try again.",
                 tool_response={}
             )
-            return CrewOutput(response=error_response, frontend_state=FrontendState.CALENDAR_ERROR).model_dump_json()
+            return tool_result(CrewOutput(response=error_response, frontend_state=FrontendState.CALENDAR_ERROR))
 
 
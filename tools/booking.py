@@ -3,11 +3,13 @@ import os
 from typing import Type, Optional
 from crewai.tools import BaseTool
 from pydantic import BaseModel, Field
-import requests
 
 from schemas import CrewOutput, Response
+from utils.structured_output import tool_result
 from utils.state_manager import state_manager
 from utils.asgardeo_manager import asgardeo_manager
+from utils.http_client import hotel_api_client
+from utils.catalog_cache import catalog_cache
 from utils.constants import FlowState, FrontendState
 
 class BookingToolInput(BaseModel):
@@ -23,6 +25,8 @@ class BookingTool(BaseTool):
     description: str = "Books a hotel room for specified room and dates."
     args_schema: Type[BaseModel] = BookingToolInput
     thread_id: Optional[str] = None
+    # A successful result is the reply, the agent does not rephrase it. Failures go back to the agent.
+    result_as_answer: bool = True
 
     def __init__(self, thread_id: str = None):
         super().__init__()
@@ -31,7 +35,7 @@ class BookingTool(BaseTool):
     def _run(self, room_id: int, hotel_id:int, check_in: date, check_out: date) -> str:
         try:
 
-            if FlowState.BOOKING_PREVIEW_INITIATED not in state_manager.get_states(self.thread_id):
+            if not state_manager.has_state(self.thread_id, FlowState.BOOKING_PREVIEW_INITIATED):
                 raise Exception("Booking preview not completed")
 
             state_manager.add_state(self.thread_id, FlowState.BOOKING_PREVIEW_COMPLETED)
@@ -54,7 +58,7 @@ class BookingTool(BaseTool):
                 "check_out": check_out.isoformat()
             }
 
-            api_response = requests.post(f"{os.environ['HOTEL_API_BASE_URL']}/bookings", json=booking_data, headers=headers)
+            api_response = hotel_api_client.post("/bookings", json=booking_data, headers=headers)
             
             if (api_response.status_code == 200):
                 booking_details = api_response.json()
@@ -68,6 +72,10 @@ class BookingTool(BaseTool):
                 frontend_state = FrontendState.BOOKING_COMPLETED
                 authorization_url = asgardeo_manager.get_google_authorization_url(self.thread_id, user_id, ["openid", "create_bookings"])
                 state_manager.add_state(self.thread_id, FlowState.BOOKING_COMPLETED)
+                # Availability of the booked room and its hotel may have changed
+                catalog_cache.invalidate(f"/rooms/{room_id}")
+                catalog_cache.invalidate(f"/hotels/{hotel_id}")
+                final = self.result_as_answer
             else:
                 response_dict = {
                     "error": api_response.json().get("detail", "Booking failed"),
@@ -76,6 +84,8 @@ class BookingTool(BaseTool):
                 message = f"Failed to book room: {response_dict['error']}"
                 frontend_state = FrontendState.BOOKING_COMPLETED_ERROR  
                 authorization_url = None 
+                # Failures go back to the agent, which can recover or explain them
+                final = False
             response = Response(
                 chat_response=message,
                 tool_response={
@@ -83,11 +93,11 @@ class BookingTool(BaseTool):
                     "authorization_url": authorization_url
                 }
             )
-            return CrewOutput(response=response, frontend_state=frontend_state).model_dump_json()
+            return tool_result(CrewOutput(response=response, frontend_state=frontend_state), final=final)
 
         except Exception as e:
             error_response = Response(
                 chat_response=f"An error occurred while booking the room: {str(e)}",
                 tool_response={"error": str(e), "status": "error"}
             )
-            return CrewOutput(response=error_response, frontend_state=FrontendState.BOOKING_COMPLETED_ERROR).model_dump_json()
+            return tool_result(CrewOutput(response=error_response, frontend_state=FrontendState.BOOKING_COMPLETED_ERROR))
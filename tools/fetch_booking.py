@@ -3,12 +3,14 @@ import os
 from typing import Type, Optional, Optional, Union
 from crewai.tools import BaseTool
 from pydantic import BaseModel, Field
-import requests
 from utils.state_manager import state_manager
 from utils.constants import FlowState, FrontendState
 
 from schemas import CrewOutput, Response
+from utils.structured_output import tool_result
 from utils.asgardeo_manager import asgardeo_manager
+from utils.http_client import hotel_api_client
+from utils.tool_output import tool_output_shaper
 
 class FetchBookingsToolInput(BaseModel):
     """Input schema for FetchBookingsTool."""
@@ -35,13 +37,13 @@ class FetchBookingsTool(BaseTool):
             'Authorization': f'Bearer {token}'
         }
         
-        api_response = requests.get(f"{os.environ['HOTEL_API_BASE_URL']}/bookings/{booking_id}", headers=headers)
+        api_response = hotel_api_client.get(f"/bookings/{booking_id}", headers=headers)
         rooms_data = api_response.json()
 
         state_manager.add_state(self.thread_id, FlowState.FETCHED_BOOKINGS)
         
         response = Response(
             chat_response=None, 
-            tool_response=rooms_data
+            tool_response=tool_output_shaper.shape("booking", rooms_data, self.thread_id)
         )
-        return CrewOutput(response=response, frontend_state=FrontendState.NO_STATE).model_dump_json()
+        return tool_result(CrewOutput(response=response, frontend_state=FrontendState.NO_STATE))
@@ -1,4 +1,5 @@
 from datetime import date
+import os
 from typing import Type, Optional, Optional
 from crewai.tools import BaseTool
 from pydantic import BaseModel, Field
@@ -23,4 +24,5 @@ class FetchChatHistoryTool(BaseTool):
     def _run(self) -> str:
 
         chat_history: ChatHistory = chat_history_manager.get_chat_history(self.thread_id)
-        return chat_history.get_messages_as_string()
+        max_tokens = int(os.environ.get('CHAT_HISTORY_TOKEN_BUDGET', 4000)) or None
+        return chat_history.get_messages_as_string(max_tokens=max_tokens)
@@ -4,11 +4,14 @@ import os
 from typing import Type, Optional, Optional
 from crewai.tools import BaseTool
 from pydantic import BaseModel, Field
-import requests
 from utils.constants import FlowState, FrontendState
 
 from schemas import CrewOutput, Response
+from utils.structured_output import tool_result
 from utils.asgardeo_manager import asgardeo_manager
+from utils.http_client import hotel_api_client
+from utils.tool_output import tool_output_shaper
+from utils.catalog_cache import catalog_cache
 from utils.state_manager import state_manager
 
 logger = logging.getLogger('agentLogger')
@@ -26,7 +29,7 @@ class FetchHotelsTool(BaseTool):
         super().__init__()
         self.thread_id = thread_id
 
-    def _run(self) -> str:
+    def _fetch_hotels(self):
         try: 
             scopes = ["read_hotels"]
             token = asgardeo_manager.get_app_token(scopes)
@@ -37,12 +40,19 @@ class FetchHotelsTool(BaseTool):
         headers = {
             'Authorization': f'Bearer {token}'
         }
-        api_response = requests.get(f"{os.environ['HOTEL_API_BASE_URL']}/hotels", headers=headers)
-        hotels_data = api_response.json()
+        api_response = hotel_api_client.get("/hotels", headers=headers)
+
+        if api_response.status_code != 200:
+            raise Exception("Failed to fetch hotels")
+
+        return api_response.json()
+
+    def _run(self) -> str:
+        hotels_data = catalog_cache.get_or_load("/hotels", self._fetch_hotels)
 
         state_manager.add_state(self.thread_id, FlowState.FETCHED_HOTELS)
         response = Response(
             chat_response=None, 
-            tool_response=hotels_data
+            tool_response=tool_output_shaper.shape("hotels", hotels_data, self.thread_id)
         )
-        return CrewOutput(response=response, frontend_state=FrontendState.NO_STATE).model_dump_json()
+        return tool_result(CrewOutput(response=response, frontend_state=FrontendState.NO_STATE))
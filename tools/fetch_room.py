@@ -4,12 +4,15 @@ import os
 from typing import Type, Optional, Optional, Union
 from crewai.tools import BaseTool
 from pydantic import BaseModel, Field
-import requests
 from utils.state_manager import state_manager
 from utils.constants import FlowState, FrontendState
 
 from schemas import CrewOutput, Response
+from utils.structured_output import tool_result
 from utils.asgardeo_manager import asgardeo_manager
+from utils.http_client import hotel_api_client
+from utils.tool_output import tool_output_shaper
+from utils.catalog_cache import catalog_cache
 
 logger = logging.getLogger('agentLogger')
 
@@ -27,11 +30,7 @@ class FetchRoomTool(BaseTool):
         super().__init__()
         self.thread_id = thread_id
 
-    def _run(self, room_id: Union[int, str]) -> str:
-
-        if not room_id:
-            raise ValueError("room_id is required. If you don't have a room_id, you can fetch all rooms using the FetchHotelTool.")
-
+    def _fetch_room(self, room_id: Union[int, str]):
         try: 
             scopes = ["read_rooms"]
             token = asgardeo_manager.get_app_token(scopes)
@@ -43,13 +42,24 @@ class FetchRoomTool(BaseTool):
             'Authorization': f'Bearer {token}'
         }
         
-        api_response = requests.get(f"{os.environ['HOTEL_API_BASE_URL']}/rooms/{room_id}", headers=headers)
-        rooms_data = api_response.json()
+        api_response = hotel_api_client.get(f"/rooms/{room_id}", headers=headers)
+
+        if api_response.status_code != 200:
+            raise Exception(f"Failed to fetch room with id {room_id}")
+
+        return api_response.json()
+
+    def _run(self, room_id: Union[int, str]) -> str:
+
+        if not room_id:
+            raise ValueError("room_id is required. If you don't have a room_id, you can fetch all rooms using the FetchHotelTool.")
+
+        rooms_data = catalog_cache.get_or_load(f"/rooms/{room_id}", lambda: self._fetch_room(room_id))
 
         state_manager.add_state(self.thread_id, FlowState.FETCHED_ROOM)
         
         response = Response(
             chat_response=None, 
-            tool_response=rooms_data
+            tool_response=tool_output_shaper.shape("room", rooms_data, self.thread_id)
         )
-        return CrewOutput(response=response, frontend_state=FrontendState.NO_STATE).model_dump_json()
+        return tool_result(CrewOutput(response=response, frontend_state=FrontendState.NO_STATE))
@@ -4,12 +4,13 @@ import os
 from typing import Type, Optional, Union
 from crewai.tools import BaseTool
 from pydantic import BaseModel, Field
-import requests
 from utils.state_manager import state_manager
 from utils.constants import FlowState, FrontendState
 
 from schemas import CrewOutput, Response
+from utils.structured_output import tool_result
 from utils.asgardeo_manager import asgardeo_manager
+from utils.http_client import hotel_api_client
 
 class BookingPreviewToolInput(BaseModel):
     """Input schema for BookingPreviewTool."""
@@ -70,7 +71,7 @@ class BookingPreviewTool(BaseTool):
                 'Authorization': f'Bearer {token}'
             }
             
-            api_response = requests.post(f"{os.environ['HOTEL_API_BASE_URL']}/bookings/preview", json=booking_preview_data, headers=headers)
+            api_response = hotel_api_client.post("/bookings/preview", json=booking_preview_data, headers=headers)
             
             if (api_response.status_code == 200):
                 booking_preview = api_response.json()
@@ -90,11 +91,11 @@ class BookingPreviewTool(BaseTool):
                     "authorization_url": authorization_url
                 }
             )
-            return CrewOutput(response=response, frontend_state=frontend_state).model_dump_json()
+            return tool_result(CrewOutput(response=response, frontend_state=frontend_state))
 
         except Exception as e:
             error_response = Response(
                 chat_response=f"{str(e)}",
                 tool_response={},
             )
-            return CrewOutput(response=error_response, frontend_state=FrontendState.BOOKING_PREVIEW_ERROR).model_dump_json()
+            return tool_result(CrewOutput(response=error_response, frontend_state=FrontendState.BOOKING_PREVIEW_ERROR))
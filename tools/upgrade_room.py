@@ -2,16 +2,109 @@ from datetime import date
 import logging
 import os
 from typing import Type, Optional, Union
-import threading
-import time
 from crewai.tools import BaseTool
 from pydantic import BaseModel, Field
 from utils.state_manager import state_manager
-from utils.email_manager import email_manager
+from utils.email_manager import get_email_manager
 from utils.constants import FlowState, FrontendState
-import requests
 from schemas import CrewOutput, Response
+from utils.structured_output import tool_result
 from utils.asgardeo_manager import asgardeo_manager
+from utils.http_client import hotel_api_client
+from utils.job_scheduler import CibaJob, ciba_scheduler
+
+UPGRADE_JOB_KIND = "room_upgrade"
+
+def build_upgrade_email(booking_id: Union[int, str], room_id : Union[int, str], username: str) -> str:        
+
+    try: 
+        token = asgardeo_manager.get_app_token(["read_bookings"])
+    except Exception as e:
+        raise Exception("Failed to get token. Retry the operation.")
+
+    headers = {
+        'Authorization': f'Bearer {token}'
+    }
+
+    api_response = hotel_api_client.get(f"/bookings/{booking_id}", headers=headers)
+    rooms_data = api_response.json()
+    booking_preview_data = {
+        "room_id": room_id,
+        "check_in": rooms_data.get("check_in"),
+        "check_out": rooms_data.get("check_out")
+    }
+    try: 
+        token = asgardeo_manager.get_app_token(["read_rooms"])
+    except Exception as e:
+        raise
+
+    headers = {
+        'Authorization': f'Bearer {token}'
+    }
+    api_response = hotel_api_client.post("/bookings/preview", json=booking_preview_data, headers=headers)
+    booking_preview_data = api_response.json()
+    html = f"""<!DOCTYPE html>
+                <html lang="en">
+                <head>
+                    <meta charset="UTF-8">
+                    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                    <title>Room Upgrade Confirmation - Gardeo Hotel</title>
+                    <style>
+                        body {{ font-family: Arial, sans-serif; color: #333; }}
+                        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 5px; }}
+                        h1 {{ color: #005f73; }}
+                        .details {{ margin-top: 15px; }}
+                        .details p {{ margin: 5px 0; }}
+                        .footer {{ margin-top: 20px; font-size: 0.9em; color: #555; }}
+                    </style>
+                </head>
+                <body>
+                    <div class="container">
+                        <h1>Room Upgrade Confirmation - Gardeo Hotel</h1>
+                        <p>Dear {username},</p>
+
+                        <p>Warm greetings from Gardeo Hotel!</p>
+
+                        <p>We are delighted to inform you that your room upgrade request has been successfully processed. Below are your updated reservation details:</p>
+
+                        <div class="details">
+                            <p><strong>Room Type:</strong> {booking_preview_data['room_type']}</p>
+                            <p><strong>Total Price:</strong> ${booking_preview_data['total_price']}</p>
+                            <p><strong>Check-in Date:</strong> {booking_preview_data['check_in']}</p>
+                            <p><strong>Check-out Date:</strong> {booking_preview_data['check_out']}</p>
+                        </div>
+
+                        <p>Thank you for choosing Gardeo Hotel. We look forward to providing you with a comfortable and memorable stay.</p>
+
+                        <p>Please feel free to contact us if you require any further assistance.</p>
+
+                        <p>Ayubowan! (May you live long!)</p>
+
+                        <p>Warm regards,</p>
+
+                        <p>Kisali<br>Gardeo Hotel</p>
+
+                        <div class="footer">
+                            <p>Bohoma Isthuthi! (Thank you very much!)</p>
+                        </div>
+                    </div>
+                </body>
+                </html>"""
+    return html
+
+def complete_room_upgrade(job: CibaJob, access_token: str) -> None:
+    """Send the upgrade confirmation once the user approved the CIBA request."""
+    booking_id = job.payload["booking_id"]
+    room_id = job.payload["room_id"]
+    user_id = asgardeo_manager.get_user_id_from_thread_id(job.thread_id)
+    user_claims = asgardeo_manager.get_user_claims(user_id)
+    username = user_claims.get("username")
+    email = user_claims.get("email")
+    email_content = build_upgrade_email(booking_id, room_id, username)
+    get_email_manager().queue_html_email(email, "Room Upgrade", email_content)
+    print(f"Upgrading room with booking_id: {booking_id}")
+
+ciba_scheduler.register_handler(UPGRADE_JOB_KIND, complete_room_upgrade)
 
 class RoomUpgradeToolInput(BaseModel):
     """Input schema for RoomUpgradeTool."""
@@ -23,143 +116,31 @@ class RoomUpgradeTool(BaseTool):
     description: str = "Fetche a single hotel by id."
     args_schema: Type[BaseModel] = RoomUpgradeToolInput
     thread_id: Optional[str] = None
+    # A successful result is the reply, the agent does not rephrase it. Failures go back to the agent.
+    result_as_answer: bool = True
 
     def __init__(self, thread_id: str = None):
         super().__init__()
         self.thread_id = thread_id
     
-    def _process_upgrade_in_background(self, booking_id: Union[int, str], room_id : Union[int, str]):
-        """Process the room upgrade request in background."""
-        try:
-            time.sleep(30)
-            auth_req_id = asgardeo_manager.initiate_ciba(self.thread_id, ["openid", "booking_upgrade"])
-            # Poll for token with retries
-            max_retries = 60
-            retry_interval = 15  # Set to 15 seconds
-            retries = 0
-            time.sleep(retry_interval)
-            
-            while retries < max_retries:
-                response = asgardeo_manager.get_ciba_token(auth_req_id)
-                if response.get("state") == "success":
-                    # Upgrade room with the obtained token
-                    access_token = response.get("access_token")
-                    user_id = asgardeo_manager.get_user_id_from_thread_id(self.thread_id)
-                    user_claims = asgardeo_manager.get_user_claims(user_id)
-                    username = user_claims.get("username")
-                    email = user_claims.get("email")
-                    email_content = self.get_email(booking_id, room_id, username)
-                    email_manager.send_html_email(email, "Room Upgrade", email_content)
-                    print(f"Upgrading room with booking_id: {booking_id}")
-                    return
-                
-                elif response.get("state") == "pending" or response.get("state") == "slow_down":
-                    # Continue polling
-                    print("Polling for token...")
-                    retries += 1
-                    time.sleep(retry_interval)  # Sleep for 15 seconds
-                    continue
-                
-                else:
-                    print(f"Failed to get token for booking_id: {booking_id}")
-                    return
-        
-            
-        except Exception as e:
-            print(f"Error in background thread: {str(e)}")
-
-    def get_email(self, booking_id: Union[int, str], room_id : Union[int, str], username: str) -> str:        
-
-        try: 
-            token = asgardeo_manager.get_app_token(["read_bookings"])
-        except Exception as e:
-            raise Exception("Failed to get token. Retry the operation.")
-
-        headers = {
-            'Authorization': f'Bearer {token}'
-        }
-        
-        api_response = requests.get(f"{os.environ['HOTEL_API_BASE_URL']}/bookings/{booking_id}", headers=headers)
-        rooms_data = api_response.json()
-        booking_preview_data = {
-            "room_id": room_id,
-            "check_in": rooms_data.get("check_in"),
-            "check_out": rooms_data.get("check_out")
-        }
-        try: 
-            token = asgardeo_manager.get_app_token(["read_rooms"])
-        except Exception as e:
-            raise
-
-        headers = {
-            'Authorization': f'Bearer {token}'
-        }
-        api_response = requests.post(f"{os.environ['HOTEL_API_BASE_URL']}/bookings/preview", json=booking_preview_data, headers=headers)
-        booking_preview_data = api_response.json()
-        html = f"""<!DOCTYPE html>
-                    <html lang="en">
-                    <head>
-                        <meta charset="UTF-8">
-                        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                        <title>Room Upgrade Confirmation - Gardeo Hotel</title>
-                        <style>
-                            body {{ font-family: Arial, sans-serif; color: #333; }}
-                            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 5px; }}
-                            h1 {{ color: #005f73; }}
-                            .details {{ margin-top: 15px; }}
-                            .details p {{ margin: 5px 0; }}
-                            .footer {{ margin-top: 20px; font-size: 0.9em; color: #555; }}
-                        </style>
-                    </head>
-                    <body>
-                        <div class="container">
-                            <h1>Room Upgrade Confirmation - Gardeo Hotel</h1>
-                            <p>Dear {username},</p>
-
-                            <p>Warm greetings from Gardeo Hotel!</p>
-
-                            <p>We are delighted to inform you that your room upgrade request has been successfully processed. Below are your updated reservation details:</p>
-
-                            <div class="details">
-                                <p><strong>Room Type:</strong> {booking_preview_data['room_type']}</p>
-                                <p><strong>Total Price:</strong> ${booking_preview_data['total_price']}</p>
-                                <p><strong>Check-in Date:</strong> {booking_preview_data['check_in']}</p>
-                                <p><strong>Check-out Date:</strong> {booking_preview_data['check_out']}</p>
-                            </div>
-
-                            <p>Thank you for choosing Gardeo Hotel. We look forward to providing you with a comfortable and memorable stay.</p>
-
-                            <p>Please feel free to contact us if you require any further assistance.</p>
-
-                            <p>Ayubowan! (May you live long!)</p>
-
-                            <p>Warm regards,</p>
-
-                            <p>Kisali<br>Gardeo Hotel</p>
-
-                            <div class="footer">
-                                <p>Bohoma Isthuthi! (Thank you very much!)</p>
-                            </div>
-                        </div>
-                    </body>
-                    </html>"""
-        return html
+    def get_email(self, booking_id: Union[int, str], room_id : Union[int, str], username: str) -> str:
+        return build_upgrade_email(booking_id, room_id, username)
 
     def _run(self, booking_id: Union[int, str], room_id: Union[int, str]) -> str:
         if not booking_id:
             raise ValueError("booking_id is required. If you don't have a booking_id, you need to create a booking first.")
         
-        # Start a background thread for processing
-        bg_thread = threading.Thread(
-            target=self._process_upgrade_in_background,
-            args=(booking_id, room_id),
-            daemon=True
+        # Poll for the user's approval on the shared CIBA scheduler
+        ciba_scheduler.schedule(
+            UPGRADE_JOB_KIND,
+            self.thread_id,
+            ["openid", "booking_upgrade"],
+            {"booking_id": booking_id, "room_id": room_id}
         )
-        bg_thread.start()
         state_manager.add_state(self.thread_id, FlowState.PROCCESING_UPGRADE)
         response = Response(
             chat_response="Currently, the room you've requested is not available. As soon as it becomes available, we will upgrade your reservation and notify you via email.", 
             tool_response={"status": "processing", "booking_id": booking_id}
         )
         
-        return CrewOutput(response=response, frontend_state=FrontendState.PROCCESING_UPGRADE).model_dump_json()
+        return tool_result(CrewOutput(response=response, frontend_state=FrontendState.PROCCESING_UPGRADE), final=self.result_as_answer)
@@ -1,7 +1,9 @@
 import os
 from dotenv import load_dotenv
 
-load_dotenv()
+# The only place .env is loaded, every entry point imports utils first.
+# As before, values in .env override variables already set in the environment.
+load_dotenv(override=True)
 
 class Config:
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
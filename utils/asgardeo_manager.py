@@ -1,12 +1,19 @@
 import logging
 import os
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import uuid
-import requests
 from pydantic import BaseModel
 
+from utils.idp_client import idp_client
+from utils.pending_auth import PendingAuthorization, pending_auth_store
+from utils.session_store import SESSION_TTL_SECONDS, ModelCodec, session_store
+from utils.token_cache import TokenCache
+from utils.tracing import tracer
+
 logger = logging.getLogger(__name__)
 
+PER_TOKEN_CLAIMS = frozenset({"exp", "iat", "nbf", "jti", "at_hash", "c_hash", "nonce", "auth_time"})
+
 class AuthToken(BaseModel):
     id: str
     scopes: List[str]
@@ -33,12 +40,12 @@ class AsgardeoManager:
         self.redirect_uri = os.environ['REDIRECT_URI']
         self.google_redirect_uri = os.environ['GOOGLE_REDIRECT_URI']
 
-        self.auth_codes: Dict[str, AuthCode] = {}  # Store AuthCode by session_id
-        self.auth_tokens: Dict[str, AuthToken] = {}  # Store AuthToken by token_id
-        self.thread_user_map: Dict[str, str] = {}  # Store user_id against thread_id
-        self.state_thread_map: Dict[str, str] = {}  # Store thread_id against state
-        self.state_mapping: Dict[str, AuthCode] = {}
-        self.user_claims: Dict[str, Dict] = {}
+        # Session state lives in the shared session store so any worker can serve a callback
+        self.auth_codes = session_store.mapping("auth_codes", ModelCodec(AuthCode), SESSION_TTL_SECONDS)  # Store AuthCode by session_id
+        self.auth_tokens = session_store.mapping("auth_tokens", ModelCodec(AuthToken), SESSION_TTL_SECONDS)  # Store AuthToken by token_id
+        self.thread_user_map = session_store.mapping("thread_user_map", ttl=SESSION_TTL_SECONDS)  # Store user_id against thread_id
+        self.user_claims = session_store.mapping("user_claims", ttl=SESSION_TTL_SECONDS)
+        self.app_token_cache = TokenCache(self.fetch_app_token_with_expiry)
 
     def store_auth_code(self, user_id: str, code: str):
             """Store authentication code and user_id"""
@@ -55,15 +62,12 @@ class AsgardeoManager:
     def get_authorization_url(self, thread_id: str, user_id: str, scopes: List[str] = ["openid"]) -> str:
             """
             Generate the authorization URL for the OAuth2 flow matching the exact format provided,
-            with scopes passed as a list
+            with scopes passed as a list. A still-pending request of the thread is reused.
             """
-            try:
-
+            def build_url(state: str, code_challenge: Optional[str]) -> str:
                 scopes_str = " ".join(scopes)
                 nonce = str(uuid.uuid4())[:16]
-                state = str(uuid.uuid4())
-
-                authorization_url = (
+                return (
                     f"{self.authorize_url}?"
                     f"client_id={self.client_id}&"
                     f"redirect_uri={self.redirect_uri}&"
@@ -72,28 +76,21 @@ class AsgardeoManager:
                     f"response_mode=query&"
                     f"state={state}&"
                     f"nonce={nonce}"
+                    + (f"&code_challenge={code_challenge}&code_challenge_method=S256" if code_challenge else "")
                 )
-                self.store_thread_id_against_state(thread_id, state)
-                auth_code = AuthCode(state=state, user_id=user_id, code=None, scopes=scopes)
-                self.state_mapping[state] = auth_code
-                # Store auth code entry
-                self.auth_codes[self.get_token_key(user_id, scopes)] = auth_code
-                return authorization_url
-            except Exception as e:
-                raise
+
+            pending = pending_auth_store.get_or_create("booking", thread_id, user_id, scopes, self.redirect_uri, build_url)
+            return pending.authorization_url
 
     def get_google_authorization_url(self, thread_id: str, user_id: str, scopes: List[str] = ["openid"],) -> str:
             """
             Generate the authorization URL for the OAuth2 flow matching the exact format provided,
-            with scopes passed as a list
+            with scopes passed as a list. A still-pending request of the thread is reused.
             """
-            try:
-
+            def build_url(state: str, code_challenge: Optional[str]) -> str:
                 scopes_str = " ".join(scopes)
                 nonce = str(uuid.uuid4())[:16]
-                state = str(uuid.uuid4())
-
-                authorization_url = (
+                return (
                     f"{self.authorize_url}?"
                     f"client_id={self.client_id}&"
                     f"redirect_uri={self.google_redirect_uri}&"
@@ -106,107 +103,79 @@ class AsgardeoManager:
                     f"federated_token_scope=Google Calendar;https://www.googleapis.com/auth/calendar.events.owned openid&"
                     f"state={state}&"
                     f"nonce={nonce}"
+                    + (f"&code_challenge={code_challenge}&code_challenge_method=S256" if code_challenge else "")
                 )
-                self.store_thread_id_against_state(thread_id, state)
-                auth_code = AuthCode(state=state, user_id=user_id, code=None, scopes=scopes)
-                self.state_mapping[state] = auth_code
-                # Store auth code entry
-                self.auth_codes[self.get_token_key(user_id, scopes)] = auth_code
-                return authorization_url
-            except Exception as e:
-                raise            
 
-    def fetch_user_token(self, state: str) -> str:
+            pending = pending_auth_store.get_or_create("calendar", thread_id, user_id, scopes, self.google_redirect_uri, build_url)
+            return pending.authorization_url
+
+    def consume_pending_authorization(self, state: str) -> Optional[PendingAuthorization]:
         """
-        Exchange authorization code for access token
+        Redeem the pending authorization of an OAuth callback. Each state works once.
         """
-        code_entry:AuthCode = self.state_mapping.get(state)
-        if not code_entry:
-            raise ValueError("No auth code found for user")
-        try:
-            response = requests.post(
-                self.token_url,
-                data={
-                    "grant_type": "authorization_code",
-                    "code": code_entry.code,
-                    "scope": " ".join(code_entry.scopes),
-                    "redirect_uri": self.redirect_uri,
-                    "client_id": self.client_id,
-                    "client_secret": self.client_secret
-                },
-                verify=False
-            )
-            data = response.json()
-            print(data)
-            access_token = data.get("access_token")
-            token_key = self.get_token_key(code_entry.user_id, code_entry.scopes)
-            token = AuthToken(id=code_entry.user_id, scopes=code_entry.scopes, token=access_token)
-            self.auth_tokens[token_key] = token
-            fed_tokens = data.get("federated_tokens")
-            print(fed_tokens)
-            if fed_tokens:
-                fed_access_token = fed_tokens[0].get("accessToken")
-                token = AuthToken(id=code_entry.user_id, scopes=code_entry.scopes, token=fed_access_token)
-                self.auth_tokens[token_key+"_google"] = token
-            return access_token
-        except Exception as e:
-            print(e)
-            raise
+        return pending_auth_store.consume(state)
 
-    def fetch_google_token(self, state: str) -> str:
+    async def exchange_code(self, pending: PendingAuthorization, code: str) -> str:
         """
-        Exchange authorization code for access token
+        Exchange the code of a consumed authorization for access tokens and store them.
+        Serves both the booking and the Google calendar callbacks.
         """
-        code_entry:AuthCode = self.state_mapping.get(state)
-        if not code_entry:
-            raise ValueError("No auth code found for user")
+        data = {
+            "grant_type": "authorization_code",
+            "code": code,
+            "scope": " ".join(pending.scopes),
+            "redirect_uri": pending.redirect_uri,
+            "client_id": self.client_id,
+            "client_secret": self.client_secret
+        }
+        if pending.code_verifier:
+            data["code_verifier"] = pending.code_verifier
         try:
-            response = requests.post(
-                self.token_url,
-                data={
-                    "grant_type": "authorization_code",
-                    "code": code_entry.code,
-                    "scope": " ".join(code_entry.scopes),
-                    "redirect_uri": self.google_redirect_uri,
-                    "client_id": self.client_id,
-                    "client_secret": self.client_secret
-                },
-                verify=False
-            )
+            with tracer.span("token.exchange", kind=pending.kind, scopes=" ".join(pending.scopes)):
+                response = await idp_client.post_async(self.token_url, data)
             data = response.json()
             print(data)
             access_token = data.get("access_token")
-            token_key = self.get_token_key(code_entry.user_id, code_entry.scopes)
-            token = AuthToken(id=code_entry.user_id, scopes=code_entry.scopes, token=access_token)
+            token_key = self.get_token_key(pending.user_id, pending.scopes)
+            token = AuthToken(id=pending.user_id, scopes=pending.scopes, token=access_token)
             self.auth_tokens[token_key] = token
             fed_tokens = data.get("federated_tokens")
             print(fed_tokens)
             if fed_tokens:
                 fed_access_token = fed_tokens[0].get("accessToken")
-                token = AuthToken(id=code_entry.user_id, scopes=code_entry.scopes, token=fed_access_token)
+                token = AuthToken(id=pending.user_id, scopes=pending.scopes, token=fed_access_token)
                 self.auth_tokens[token_key+"_google"] = token
             return access_token
         except Exception as e:
             print(e)
-            raise        
+            raise
 
     def fetch_app_token(self, scopes: List[str]) -> str:
         """
         Get an access token for the app
         """
+        access_token, _ = self.fetch_app_token_with_expiry(scopes)
+        return access_token
+
+    def fetch_app_token_with_expiry(self, scopes: List[str]) -> Tuple[str, Optional[int]]:
+        """
+        Get an access token for the app along with its lifetime in seconds
+        """
         try:
-            response = requests.post(
+            response = idp_client.post(
                 self.token_url,
                 data={
                     "grant_type": "client_credentials",
                     "scope": " ".join(scopes),
                     "client_id": self.client_id,
                     "client_secret": self.client_secret
-                },
-                verify=False
+                }
             )
             data = response.json()
-            return data.get("access_token")
+            access_token = data.get("access_token")
+            if not access_token:
+                raise ValueError(f"Token endpoint did not return an access token: {data.get('error')}")
+            return access_token, data.get("expires_in")
         except Exception as e:
             raise        
 
@@ -214,11 +183,17 @@ class AsgardeoManager:
         """
         Initiate CIBA flow
         """
+        return self.initiate_ciba_request(thread_id, scopes).get("auth_req_id")
+
+    def initiate_ciba_request(self, thread_id: str, scopes: List[str]) -> dict:
+        """
+        Initiate CIBA flow and return the full response (auth_req_id, interval, expires_in)
+        """
         user_id = self.get_user_id_from_thread_id(thread_id)
         user_claims = self.get_user_claims(user_id)
         username = user_claims.get("username")
         try:
-            response = requests.post(
+            response = idp_client.post(
                 self.ciba_url,
                 data={
                     "login_hint": username,
@@ -226,12 +201,13 @@ class AsgardeoManager:
                     "scope": " ".join(scopes),
                     "client_id": self.client_id,
                     "client_secret": self.client_secret
-                },
-                verify=False
+                }
             )
             data = response.json()
             print(data)
-            return data.get("auth_req_id")
+            if not data.get("auth_req_id"):
+                raise ValueError(data.get("error") or "No auth_req_id returned")
+            return data
         except Exception as e:
             raise Exception("Failed to initiate CIBA flow")
 
@@ -240,15 +216,14 @@ class AsgardeoManager:
         Get CIBA token and return state with token or error
         """
         try:
-            response = requests.post(
+            response = idp_client.post(
                 self.token_url,
                 data={
                     "grant_type": "urn:openid:params:grant-type:ciba",
                     "auth_req_id": auth_req_id,
                     "client_id": self.client_id,
                     "client_secret": self.client_secret
-                },
-                verify=False
+                }
             )
             print(response.json())
             if response.status_code == 200:
@@ -265,6 +240,11 @@ class AsgardeoManager:
                         "state": "pending",
                         "error": "authorization_pending"
                     }
+                elif error == "slow_down":
+                    return {
+                        "state": "slow_down",
+                        "error": "slow_down"
+                    }
                 else:
                     return {
                         "state": "error",
@@ -280,13 +260,7 @@ class AsgardeoManager:
         """
         Get valid m2m token.
         """
-        token_entry:AuthToken = self.auth_tokens.get(self.get_token_key("m2m", scopes))
-        if token_entry:
-            return token_entry.token
-        fetch_token = self.fetch_app_token(scopes)
-        token = AuthToken(id="m2m", scopes=scopes, token=fetch_token)
-        self.auth_tokens[self.get_token_key("m2m", scopes)] = token
-        return fetch_token
+        return self.app_token_cache.get(scopes)
     
     def get_user_token(self, user_id: str, scopes: List[str]) -> str:
         """
@@ -312,7 +286,7 @@ class AsgardeoManager:
         """
         Get token key from id and scopes
         """
-        return id+'_'+"_".join(scopes)
+        return id+'_'+"_".join(sorted(set(scopes)))
     
     def store_user_id_against_thread_id(self, thread_id: str, user_id: str):
         """
@@ -326,23 +300,18 @@ class AsgardeoManager:
         """
         return self.thread_user_map.get(thread_id)    
         
-    def store_thread_id_against_state(self, thread_id: str, state: str):
-        """
-        Store thread_id against state
-        """
-        self.state_thread_map[state] = thread_id
-
-    def get_thread_id_from_state(self, state: str) -> str:
-        """
-        Get thread_id from state
-        """
-        return self.state_thread_map.get(state)   
-
     def store_user_claims(self, user_id: str, claims: Dict):
         """
-        Store user claims
+        Store user claims, skipping the write when they did not change
         """
-        self.user_claims[user_id] = claims
+        stored = self.user_claims.get(user_id)
+        if stored is None or self._identity_claims(stored) != self._identity_claims(claims):
+            self.user_claims[user_id] = claims
+
+    @staticmethod
+    def _identity_claims(claims: Dict) -> Dict:
+        """Claims without the per-token ones (exp, iat, ...) that change on every login"""
+        return {key: value for key, value in claims.items() if key not in PER_TOKEN_CLAIMS}
 
     def get_user_claims(self, user_id: str) -> Dict:
         """
@@ -0,0 +1,50 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+class BackgroundLoop:
+    """
+    An asyncio event loop running on a dedicated daemon thread.
+
+    Lets synchronous code (crew tool threads, background jobs) schedule
+    coroutines without owning an event loop. Started lazily on first use.
+    """
+
+    def __init__(self, name: str = "background-loop"):
+        self.name = name
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self._run, args=(loop,), name=self.name, daemon=True)
+                self.thread.start()
+                self.loop = loop
+            return self.loop
+
+    def _run(self, loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Schedule a coroutine on the loop from any thread"""
+        return asyncio.run_coroutine_threadsafe(coro, self.start())
+
+    def run_sync(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the loop and block the calling thread until it finishes"""
+        return self.submit(coro).result(timeout)
+
+    def call_soon(self, callback, *args) -> None:
+        """
+        Schedule a callback on the loop from any thread. It runs in a fresh context,
+        so request-scoped context variables (e.g. a session store batch) do not leak into the loop.
+        """
+        self.start().call_soon_threadsafe(callback, *args, context=contextvars.Context())
+
+# Single instance for application-wide use
+background_loop = BackgroundLoop()
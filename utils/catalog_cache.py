@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class CatalogEntry:
+    value: Any
+    fresh_until: float
+    stale_until: float
+
+class CatalogCache:
+    """
+    Read-through TTL + LRU cache for hotel catalog reads (/hotels, /hotels/{id}, /rooms/{id}).
+
+    - Entries are fresh for ttl seconds, then served stale for up to stale_ttl
+      more seconds while a single background load revalidates them.
+    - At most max_entries are kept, least recently used first out.
+    - Concurrent misses for the same key share a single load.
+    Only catalog reads belong here; bookings and previews must stay uncached.
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None, stale_ttl: float = None):
+        self.max_entries = max_entries or int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', 512))
+        self.ttl = ttl if ttl is not None else float(os.environ.get('CATALOG_CACHE_TTL_SECONDS', 300))
+        self.stale_ttl = stale_ttl if stale_ttl is not None else float(os.environ.get('CATALOG_CACHE_STALE_SECONDS', 600))
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, CatalogEntry]" = OrderedDict()
+        self.inflight: Dict[str, Future] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_load(self, key: str, loader: Callable[[], Any]) -> Any:
+        """Return the cached value for key, calling loader on a miss. Loader errors are not cached."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now < entry.stale_until:
+                self.entries.move_to_end(key)
+                if now < entry.fresh_until:
+                    self.hits += 1
+                    return entry.value
+                self.stale_hits += 1
+                if key not in self.inflight:
+                    future = self.inflight[key] = Future()
+                    threading.Thread(target=self._load, args=(key, loader, future), daemon=True).start()
+                return entry.value
+            self.misses += 1
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+        if owner:
+            self._load(key, loader, future)
+        return future.result()
+
+    def _load(self, key: str, loader: Callable[[], Any], future: Future) -> None:
+        try:
+            value = loader()
+            self.set(key, value)
+            future.set_result(value)
+        except Exception as e:
+            logger.warning(f"Failed to load catalog entry {key}: {e}")
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.entries[key] = CatalogEntry(
+                value=value,
+                fresh_until=now + self.ttl,
+                stale_until=now + self.ttl + self.stale_ttl,
+            )
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate_prefix(self, prefix: str) -> None:
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+# Single instance for application-wide use
+catalog_cache = CatalogCache()
+metrics.register_collector("catalog_cache", catalog_cache.stats)
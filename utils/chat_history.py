@@ -1,10 +1,21 @@
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional
+from typing import Deque, List, Dict, Optional, Tuple
 from datetime import datetime
 import logging
-from threading import Lock
+import os
+import time
+from threading import Lock, Thread
 
-@dataclass
+from utils.session_store import Codec, SessionStore, session_store
+
+logger = logging.getLogger(__name__)
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting prompts (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+@dataclass(slots=True)
 class Message:
     role: str
     content: str
@@ -16,16 +27,27 @@ class Message:
         if self.role not in ["user", "assistant"]:
             raise ValueError("Invalid role. Must be 'user' or 'assistant'")
 
+    def render(self) -> str:
+        return f"{self.role.capitalize()}: {self.content}"
+
 @dataclass
 class ChatHistory:
-    messages: List[Message] = field(default_factory=list)
+    messages: Deque[Message] = field(default_factory=deque)
     max_messages: int = 100
+    # (max_tokens, transcript) of the last render
+    _rendered: Optional[Tuple[Optional[int], str]] = field(default=None, init=False, repr=False, compare=False)
+    _lock: Lock = field(default_factory=Lock, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # Bounded ring buffer, the oldest message is dropped in O(1) once full
+        self.messages = deque(self.messages, maxlen=self.max_messages)
     
     def add_message(self, role: str, content: str) -> None:
         """Add a message with validation and message limit enforcement"""
-        if len(self.messages) >= self.max_messages:
-            self.messages.pop(0)  # Remove oldest message
-        self.messages.append(Message(role=role, content=content))
+        message = Message(role=role, content=content)
+        with self._lock:
+            self.messages.append(message)
+            self._rendered = None
 
     def add_user_message(self, message: str) -> None:
         self.add_message("user", message)
@@ -34,60 +56,147 @@ class ChatHistory:
         self.add_message("assistant", message)
 
     def get_messages(self) -> List[Dict]:
-        return [{"role": msg.role, "content": msg.content} for msg in self.messages]
+        with self._lock:
+            return [{"role": msg.role, "content": msg.content} for msg in self.messages]
+
+    def get_messages_as_string(self, max_tokens: Optional[int] = None) -> str:
+        """
+        Return the transcript. With max_tokens, only the most recent messages that fit
+        the token budget are included. The render is cached per budget until the next message is added.
+        """
+        with self._lock:
+            if self._rendered is None or self._rendered[0] != max_tokens:
+                if max_tokens is not None:
+                    text = self._render_within_budget(max_tokens)
+                else:
+                    text = "\n".join(msg.render() for msg in self.messages)
+                self._rendered = (max_tokens, text)
+            return self._rendered[1]
+
+    def is_same_as(self, other: "ChatHistory") -> bool:
+        """Return whether other holds the same messages, judged by count and newest message"""
+        with self._lock:
+            return len(self.messages) == len(other.messages) and (
+                not self.messages or self.messages[-1] == other.messages[-1]
+            )
 
-    def get_messages_as_string(self) -> str:
-        return "\n".join(
-            f"{msg.role.capitalize()}: {msg.content}" for msg in self.messages
-        )
+    def _render_within_budget(self, max_tokens: int) -> str:
+        lines = []
+        used = 0
+        for msg in reversed(self.messages):
+            line = msg.render()
+            cost = estimate_tokens(line)
+            if lines and used + cost > max_tokens:
+                break
+            lines.append(line)
+            used += cost
+        return "\n".join(reversed(lines))
+
+class ChatHistoryCodec(Codec):
+    """Stores a ChatHistory as a list of [role, content, timestamp] entries"""
+
+    def encode(self, value: ChatHistory) -> List:
+        return [[msg.role, msg.content, msg.timestamp.isoformat()] for msg in value.messages]
+
+    def decode(self, data: List) -> ChatHistory:
+        return ChatHistory(messages=[
+            Message(role=role, content=content, timestamp=datetime.fromisoformat(timestamp))
+            for role, content, timestamp in data
+        ])
 
 class ChatHistoryManager:
-    def __init__(self, max_threads: int = 1000, thread_timeout_hours: int = 24):
-        self.chat_histories: Dict[str, ChatHistory] = {}
+    """
+    Thread store with LRU + TTL eviction.
+
+    Histories are kept in access order, so touching a thread and evicting the
+    least recently used one are both O(1), and expired threads are always at
+    the front. Expiry runs on a background timer, off the request path, and a
+    full store evicts its least recently used thread instead of failing.
+
+    With a shared session store, histories are read through from and written
+    back to the store, so every worker process sees the same conversation.
+    """
+
+    def __init__(
+        self,
+        max_threads: int = 1000,
+        thread_timeout_hours: int = 24,
+        cleanup_interval_seconds: Optional[float] = None,
+        store: Optional[SessionStore] = None,
+    ):
+        self.persisted = None
+        if store is not None and store.shared:
+            self.persisted = store.mapping("chat_history", ChatHistoryCodec(), thread_timeout_hours * 3600)
+        self.chat_histories: "OrderedDict[str, ChatHistory]" = OrderedDict()
         self.max_threads = max_threads
         self.thread_timeout_hours = thread_timeout_hours
         self.lock = Lock()
-        self.last_access: Dict[str, datetime] = {}
+        self.last_access: Dict[str, float] = {}
+        if cleanup_interval_seconds is None:
+            cleanup_interval_seconds = float(os.environ.get('CHAT_HISTORY_CLEANUP_INTERVAL_SECONDS', 300))
+        if cleanup_interval_seconds > 0:
+            start_cleanup_thread([self], cleanup_interval_seconds)
 
-    def _cleanup_old_threads(self) -> None:
+    def _evict_expired(self, now: float) -> int:
+        """Drop expired threads from the front of the LRU order. Caller must hold self.lock."""
+        timeout = self.thread_timeout_hours * 3600
+        removed = 0
+        while self.chat_histories:
+            thread_id = next(iter(self.chat_histories))
+            if now - self.last_access[thread_id] <= timeout:
+                break
+            del self.chat_histories[thread_id]
+            del self.last_access[thread_id]
+            removed += 1
+        return removed
+
+    def cleanup_expired(self) -> int:
         """Remove threads that haven't been accessed in thread_timeout_hours"""
-        current_time = datetime.now()
         with self.lock:
-            threads_to_remove = [
-                thread_id for thread_id, last_access in self.last_access.items()
-                if (current_time - last_access).total_seconds() > self.thread_timeout_hours * 3600
-            ]
-            for thread_id in threads_to_remove:
-                del self.chat_histories[thread_id]
-                del self.last_access[thread_id]
+            return self._evict_expired(time.monotonic())
 
     def get_chat_history(self, thread_id: str) -> ChatHistory:
+        stored = self.persisted.get(thread_id) if self.persisted is not None else None
+        now = time.monotonic()
         with self.lock:
-            if len(self.chat_histories) >= self.max_threads:
-                self._cleanup_old_threads()
-                if len(self.chat_histories) >= self.max_threads:
-                    raise RuntimeError("Maximum number of active threads reached")
-                
+            chat_history = self.chat_histories.get(thread_id)
+            # Keep the local copy (and its cached render) unless another worker appended since
+            if stored is not None and (chat_history is None or not chat_history.is_same_as(stored)):
+                chat_history = stored
             if thread_id not in self.chat_histories:
-                self.chat_histories[thread_id] = ChatHistory()
-            
-            self.last_access[thread_id] = datetime.now()
-            return self.chat_histories[thread_id]
+                chat_history = self.chat_histories[thread_id] = chat_history or ChatHistory()
+                while len(self.chat_histories) > self.max_threads:
+                    evicted_id, _ = self.chat_histories.popitem(last=False)
+                    del self.last_access[evicted_id]
+                    logger.info(f"Evicted least recently used chat thread {evicted_id}")
+            else:
+                self.chat_histories[thread_id] = chat_history
+                self.chat_histories.move_to_end(thread_id)
+            self.last_access[thread_id] = now
+            return chat_history
 
     def add_user_message(self, thread_id: str, message: str) -> None:
         chat_history = self.get_chat_history(thread_id)
         chat_history.add_user_message(message)
+        if self.persisted is not None:
+            self.persisted[thread_id] = chat_history
 
     def add_assistant_message(self, thread_id: str, message: str) -> None:
         chat_history = self.get_chat_history(thread_id)
         chat_history.add_assistant_message(message)
+        if self.persisted is not None:
+            self.persisted[thread_id] = chat_history
 
     def get_thread_messages_as_string(self, thread_id: str) -> str:
+        if self.persisted is not None:
+            return self.get_chat_history(thread_id).get_messages_as_string()
         with self.lock:
-            if thread_id not in self.chat_histories:
+            chat_history = self.chat_histories.get(thread_id)
+            if chat_history is None:
                 return ""
-            self.last_access[thread_id] = datetime.now()
-            return self.chat_histories[thread_id].get_messages_as_string()
+            self.chat_histories.move_to_end(thread_id)
+            self.last_access[thread_id] = time.monotonic()
+        return chat_history.get_messages_as_string()
 
     def remove_thread(self, thread_id: str) -> None:
         """Manually remove a thread from history"""
@@ -95,5 +204,74 @@ class ChatHistoryManager:
             self.chat_histories.pop(thread_id, None)
             self.last_access.pop(thread_id, None)
 
+class ShardedChatHistoryManager:
+    """
+    Lock-striped ChatHistoryManager: threads are spread over independent
+    shards, each with its own lock and LRU, so concurrent requests for
+    different threads rarely contend on the same mutex.
+    """
+
+    def __init__(
+        self,
+        shards: int = 16,
+        max_threads: int = 1000,
+        thread_timeout_hours: int = 24,
+        cleanup_interval_seconds: Optional[float] = None,
+        store: Optional[SessionStore] = None,
+    ):
+        per_shard = max(1, -(-max_threads // shards))
+        self.shards = [
+            ChatHistoryManager(per_shard, thread_timeout_hours, cleanup_interval_seconds=0, store=store)
+            for _ in range(shards)
+        ]
+        if cleanup_interval_seconds is None:
+            cleanup_interval_seconds = float(os.environ.get('CHAT_HISTORY_CLEANUP_INTERVAL_SECONDS', 300))
+        if cleanup_interval_seconds > 0:
+            start_cleanup_thread(self.shards, cleanup_interval_seconds)
+
+    def _shard(self, thread_id: str) -> ChatHistoryManager:
+        return self.shards[hash(thread_id) % len(self.shards)]
+
+    def cleanup_expired(self) -> int:
+        return sum(shard.cleanup_expired() for shard in self.shards)
+
+    def get_chat_history(self, thread_id: str) -> ChatHistory:
+        return self._shard(thread_id).get_chat_history(thread_id)
+
+    def add_user_message(self, thread_id: str, message: str) -> None:
+        self._shard(thread_id).add_user_message(thread_id, message)
+
+    def add_assistant_message(self, thread_id: str, message: str) -> None:
+        self._shard(thread_id).add_assistant_message(thread_id, message)
+
+    def get_thread_messages_as_string(self, thread_id: str) -> str:
+        return self._shard(thread_id).get_thread_messages_as_string(thread_id)
+
+    def remove_thread(self, thread_id: str) -> None:
+        self._shard(thread_id).remove_thread(thread_id)
+
+def start_cleanup_thread(managers: List[ChatHistoryManager], interval_seconds: float) -> Thread:
+    """Periodically expire idle threads in the background"""
+    def run():
+        while True:
+            time.sleep(interval_seconds)
+            for manager in managers:
+                try:
+                    removed = manager.cleanup_expired()
+                    if removed:
+                        logger.info(f"Expired {removed} idle chat threads")
+                except Exception as e:
+                    logger.error(f"Chat history cleanup failed: {e}")
+
+    thread = Thread(target=run, name="chat-history-cleanup", daemon=True)
+    thread.start()
+    return thread
+
+def create_chat_history_manager():
+    shards = int(os.environ.get('CHAT_HISTORY_SHARDS', 1))
+    if shards > 1:
+        return ShardedChatHistoryManager(shards=shards, store=session_store)
+    return ChatHistoryManager(store=session_store)
+
 # Single instance for application-wide use
-chat_history_manager = ChatHistoryManager()
+chat_history_manager = create_chat_history_manager()
@@ -1,7 +1,4 @@
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
 
 class Config:
     GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from utils.session_store import Lease, SessionStore, session_store
+
+logger = logging.getLogger(__name__)
+
+class CrewExecutorBusy(Exception):
+    """Raised when a crew run cannot be admitted to the executor."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class CrewExecutor:
+    """
+    Runs blocking crew executions on a dedicated, bounded worker pool so the
+    event loop stays free for other requests (health checks, OAuth callbacks).
+
+    Admission control:
+    - at most max_workers runs execute concurrently
+    - at most max_queue further runs wait for a worker, otherwise 503
+    - at most max_per_user runs are admitted per user, otherwise 429
+
+    Runs submitted with the same key (the chat thread) execute one after the
+    other in submission order. Later ones wait in a per-key queue without
+    holding a worker, so two turns of one thread never interleave their
+    chat history and flow state writes. With a shared session store, a keyed
+    run also holds the key's lease in the store while it executes, so turns
+    of one thread that land on different worker processes do not overlap
+    either (across processes they are exclusive, but not ordered). The lease
+    is taken before the run gets a worker: while another process holds it,
+    the run retries on a timer, and fails with CrewExecutorBusy after
+    lease_wait seconds.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = None,
+        max_queue: int = None,
+        max_per_user: int = None,
+        retry_after: int = None,
+        store: Optional[SessionStore] = None,
+        lease_seconds: float = None,
+        lease_wait: float = None,
+        lease_poll_interval: float = None,
+    ):
+        self.max_workers = max_workers or int(os.environ.get('CREW_MAX_WORKERS', 4))
+        self.max_queue = max_queue if max_queue is not None else int(os.environ.get('CREW_MAX_QUEUE', 16))
+        self.max_per_user = max_per_user or int(os.environ.get('CREW_MAX_PER_USER', 2))
+        self.retry_after = retry_after or int(os.environ.get('CREW_RETRY_AFTER_SECONDS', 5))
+        self.store = store
+        self.lease_seconds = lease_seconds or float(os.environ.get('CREW_TURN_LEASE_SECONDS', 30))
+        self.lease_wait = lease_wait or float(os.environ.get('CREW_TURN_LEASE_WAIT_SECONDS', 120))
+        self.lease_poll_interval = lease_poll_interval or float(os.environ.get('CREW_TURN_LEASE_POLL_SECONDS', 0.2))
+
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="crew-worker")
+        self.lock = Lock()
+        self.admitted = 0  # Running plus queued runs
+        self.user_inflight: Dict[str, int] = {}
+        # Key -> runs waiting for the key's current run, present while one is active
+        self.serial: Dict[str, Deque[Tuple[contextvars.Context, Callable[..., Any], Tuple[Any, ...], Future]]] = {}
+
+    def _admit(self, user_id: str) -> None:
+        with self.lock:
+            if self.user_inflight.get(user_id, 0) >= self.max_per_user:
+                raise CrewExecutorBusy(
+                    "Too many concurrent requests for this user. Please retry shortly.",
+                    status_code=429,
+                    retry_after=self.retry_after,
+                )
+            if self.admitted >= self.max_workers + self.max_queue:
+                raise CrewExecutorBusy(
+                    "The assistant is busy. Please retry shortly.",
+                    status_code=503,
+                    retry_after=self.retry_after,
+                )
+            self.admitted += 1
+            self.user_inflight[user_id] = self.user_inflight.get(user_id, 0) + 1
+
+    def _release(self, user_id: str) -> None:
+        with self.lock:
+            self.admitted -= 1
+            remaining = self.user_inflight.get(user_id, 1) - 1
+            if remaining > 0:
+                self.user_inflight[user_id] = remaining
+            else:
+                self.user_inflight.pop(user_id, None)
+
+    def submit(self, user_id: str, fn: Callable[..., Any], *args: Any, key: Optional[str] = None) -> "asyncio.Future":
+        """
+        Admit and schedule fn(*args) on the worker pool, returning an awaitable future.
+        Runs with the same key are serialized. Raises CrewExecutorBusy when the run cannot be admitted.
+        """
+        self._admit(user_id)
+        future: Future = Future()
+        # Release on completion rather than when the awaiting request finishes,
+        # so a disconnected client still holds its slot until the worker is free.
+        future.add_done_callback(lambda _: self._release(user_id))
+        job = (contextvars.copy_context(), fn, args, future)
+        if key is not None:
+            with self.lock:
+                waiting = self.serial.get(key)
+                if waiting is not None:
+                    waiting.append(job)
+                    return asyncio.wrap_future(future)
+                self.serial[key] = deque()
+        try:
+            self._start(key, job, raise_errors=True)
+        except Exception:
+            self._next(key)
+            raise
+        return asyncio.wrap_future(future)
+
+    def _start(self, key: Optional[str], job, raise_errors: bool = False) -> None:
+        future = job[3]
+        # Cancelled while it waited for its key, e.g. the client went away
+        if not future.set_running_or_notify_cancel():
+            return self._next(key)
+        if key is not None and self.store is not None:
+            lease = Lease(self.store, "crew_turn_lease", key, self.lease_seconds)
+            return self._start_leased(key, job, lease, time.monotonic() + self.lease_wait)
+        self._submit(key, job, None, raise_errors)
+
+    def _start_leased(self, key: str, job, lease: Lease, deadline: float) -> None:
+        """Submit the run once it holds the key's lease. Until then it waits on a timer, not on a worker."""
+        future = job[3]
+        try:
+            acquired = lease.try_acquire()[0]
+        except Exception as e:
+            future.set_exception(e)
+            return self._next(key)
+        if acquired:
+            return self._submit(key, job, lease)
+        if time.monotonic() >= deadline:
+            future.set_exception(CrewExecutorBusy(
+                "This conversation is busy on another worker. Please retry shortly.",
+                status_code=503,
+                retry_after=self.retry_after,
+            ))
+            return self._next(key)
+        timer = threading.Timer(self.lease_poll_interval, self._start_leased, (key, job, lease, deadline))
+        timer.daemon = True
+        timer.start()
+
+    def _submit(self, key: Optional[str], job, lease: Optional[Lease], raise_errors: bool = False) -> None:
+        ctx, fn, args, future = job
+        try:
+            inner = self.executor.submit(ctx.run, fn, *args)
+        except Exception as e:
+            if lease is not None:
+                lease.release()
+            future.set_exception(e)
+            if raise_errors:
+                raise
+            return self._next(key)
+        inner.add_done_callback(lambda done: self._finish(key, done, future, lease))
+
+    def _finish(self, key: Optional[str], done: Future, future: Future, lease: Optional[Lease]) -> None:
+        if lease is not None:
+            try:
+                lease.release()
+            except Exception as e:
+                logger.error(f"Releasing the turn lease of {key} failed: {e}")
+        if done.cancelled():
+            future.set_exception(asyncio.CancelledError())
+        elif done.exception() is not None:
+            future.set_exception(done.exception())
+        else:
+            future.set_result(done.result())
+        self._next(key)
+
+    def _next(self, key: Optional[str]) -> None:
+        """Start the next run waiting for key, or mark key idle"""
+        if key is None:
+            return
+        with self.lock:
+            waiting = self.serial.get(key)
+            if not waiting:
+                self.serial.pop(key, None)
+                return
+            job = waiting.popleft()
+        self._start(key, job)
+
+    async def run(self, user_id: str, fn: Callable[..., Any], *args: Any, key: Optional[str] = None) -> Any:
+        """Run fn(*args) on the worker pool and await its result."""
+        return await self.submit(user_id, fn, *args, key=key)
+
+    def stats(self) -> Dict[str, int]:
+        """Return a snapshot of the executor load"""
+        with self.lock:
+            return {
+                "admitted": self.admitted,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active_users": len(self.user_inflight),
+                "serialized_keys": len(self.serial),
+                "waiting_on_key": sum(len(waiting) for waiting in self.serial.values()),
+            }
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# Single instance for application-wide use. Only a shared store needs
+# leases, in a single process the per-key queue already orders the turns.
+crew_executor = CrewExecutor(store=session_store if session_store.shared else None)
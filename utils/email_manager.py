@@ -1,20 +1,109 @@
+import asyncio
 import os
+import queue
 import smtplib
 import logging
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
+from typing import List, Optional
+
+
+class SmtpTransport:
+    """
+    How to reach the SMTP server. Swap in a local stand-in for tests, e.g.
+    SmtpTransport(host="127.0.0.1", port=8025, starttls=False, username=None)
+    pointing at an aiosmtpd server.
+    """
+
+    def __init__(self, host=None, port=None, starttls=None, username=None, password=None, timeout=None):
+        self.host = host or os.environ.get('SMTP_HOST', 'smtp.gmail.com')
+        self.port = port or int(os.environ.get('SMTP_PORT', 587))
+        self.starttls = starttls if starttls is not None else os.environ.get('SMTP_STARTTLS', 'true').lower() == 'true'
+        self.username = username
+        self.password = password
+        self.timeout = timeout or float(os.environ.get('SMTP_TIMEOUT_SECONDS', 30))
+
+    def connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            server.starttls()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+
+class SmtpConnectionPool:
+    """
+    Keeps authenticated SMTP sessions open for reuse, so a burst of emails
+    pays the connect, STARTTLS and login handshake once.
+    """
+
+    def __init__(self, transport: SmtpTransport, max_idle_seconds: float = None):
+        self.transport = transport
+        self.max_idle_seconds = max_idle_seconds or float(os.environ.get('SMTP_MAX_IDLE_SECONDS', 60))
+        self.idle: "queue.LifoQueue" = queue.LifoQueue()
+
+    def acquire(self) -> smtplib.SMTP:
+        while True:
+            try:
+                server, released_at = self.idle.get_nowait()
+            except queue.Empty:
+                return self.transport.connect()
+            if time.monotonic() - released_at < self.max_idle_seconds and self._is_alive(server):
+                return server
+            self.discard(server)
+
+    def release(self, server: smtplib.SMTP) -> None:
+        self.idle.put((server, time.monotonic()))
+
+    def discard(self, server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _is_alive(self, server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+
+@dataclass
+class OutgoingEmail:
+    sender: str
+    recipients: List[str]
+    message: str
+    to: str
+    future: Future = field(default_factory=Future)
+    attempts: int = 0
 
 
 class EmailManager:
-    def __init__(self, gmail_user=None, gmail_password=None):
+    def __init__(self, gmail_user=None, gmail_password=None, transport=None, workers=None, batch_size=None, max_retries=None):
         """
         Initialize EmailManager with Gmail credentials.
+
+        Emails are queued and delivered by background workers. Each worker
+        drains up to batch_size queued emails and sends them over one pooled
+        SMTP session, retrying failed sends with exponential backoff.
         
         Args:
             gmail_user (str): Gmail email address. If None, will look for GMAIL_USER environment variable.
             gmail_password (str): Gmail password or app password. If None, will look for GMAIL_PASSWORD environment variable.
+            transport (SmtpTransport): SMTP server to deliver through. Defaults to Gmail SMTP with the credentials above.
+            workers (int): Number of delivery workers, each holding at most one SMTP session.
+            batch_size (int): Maximum number of emails sent over one session in a row.
+            max_retries (int): Delivery attempts per email before giving up.
         """
         self.gmail_user = gmail_user or os.environ.get('GMAIL_USER')
         self.gmail_password = gmail_password or os.environ.get('GMAIL_PASSWORD')
@@ -23,10 +112,34 @@ class EmailManager:
             raise ValueError("Gmail credentials not provided. Set GMAIL_USER and GMAIL_PASSWORD environment variables or pass them as parameters.")
         
         self.logger = logging.getLogger(__name__)
+        self.transport = transport or SmtpTransport(username=self.gmail_user, password=self.gmail_password)
+        self.pool = SmtpConnectionPool(self.transport)
+        self.batch_size = batch_size or int(os.environ.get('SMTP_BATCH_SIZE', 20))
+        self.max_retries = max_retries or int(os.environ.get('SMTP_MAX_RETRIES', 3))
+        self.retry_backoff = float(os.environ.get('SMTP_RETRY_BACKOFF_SECONDS', 1))
+        self.outbox: "queue.Queue[OutgoingEmail]" = queue.Queue()
+        for i in range(workers or int(os.environ.get('SMTP_WORKERS', 2))):
+            threading.Thread(target=self._deliver_forever, name=f"email-worker-{i}", daemon=True).start()
     
     def send_email(self, to_email, subject, body, is_html=False, cc=None, bcc=None, attachments=None):
         """
-        Send an email using Gmail SMTP.
+        Send an email using Gmail SMTP and wait for delivery.
+
+        Args:
+            See queue_email.
+            
+        Returns:
+            bool: True if email sent successfully, False otherwise.
+        """
+        return self.queue_email(to_email, subject, body, is_html, cc, bcc, attachments).result()
+
+    async def send_email_async(self, to_email, subject, body, is_html=False, cc=None, bcc=None, attachments=None):
+        """Send an email from async code without blocking the event loop. See queue_email."""
+        return await asyncio.wrap_future(self.queue_email(to_email, subject, body, is_html, cc, bcc, attachments))
+
+    def queue_email(self, to_email, subject, body, is_html=False, cc=None, bcc=None, attachments=None):
+        """
+        Queue an email for delivery using Gmail SMTP without waiting for it.
         
         Args:
             to_email (str or list): Recipient email address(es).
@@ -38,7 +151,7 @@ class EmailManager:
             attachments (list): List of file paths to attach.
             
         Returns:
-            bool: True if email sent successfully, False otherwise.
+            Future: Resolves to True if email sent successfully, False otherwise.
         """
         try:
             msg = MIMEMultipart()
@@ -77,11 +190,6 @@ class EmailManager:
                 for file_path in attachments:
                     self._attach_file(msg, file_path)
             
-            # Connect to Gmail SMTP server
-            server = smtplib.SMTP('smtp.gmail.com', 587)
-            server.starttls()
-            server.login(self.gmail_user, self.gmail_password)
-            
             # Compile list of all recipients
             all_recipients = []
             
@@ -105,17 +213,70 @@ class EmailManager:
                 else:
                     all_recipients.append(bcc)
             
-            # Send email
-            server.sendmail(self.gmail_user, all_recipients, msg.as_string())
-            server.quit()
-            
-            self.logger.info(f"Email sent successfully to {msg['To']}")
-            return True
+            # Queue email for delivery
+            email = OutgoingEmail(sender=self.gmail_user, recipients=all_recipients, message=msg.as_string(), to=msg['To'])
+            self.outbox.put(email)
+            return email.future
         
         except Exception as e:
             self.logger.error(f"Failed to send email: {str(e)}")
-            return False
-    
+            future = Future()
+            future.set_result(False)
+            return future
+
+    def _deliver_forever(self):
+        while True:
+            batch = [self.outbox.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.outbox.get_nowait())
+                except queue.Empty:
+                    break
+            self._deliver_batch(batch)
+
+    def _deliver_batch(self, batch):
+        """Send a batch of emails over one SMTP session, retrying failures with backoff"""
+        pending = list(batch)
+        while pending:
+            try:
+                server = self.pool.acquire()
+            except Exception as e:
+                self.logger.error(f"Failed to connect to SMTP server: {str(e)}")
+                pending = self._retry_later(pending, e)
+                continue
+            failed = []
+            error = None
+            for email in pending:
+                try:
+                    server.sendmail(email.sender, email.recipients, email.message)
+                    self.logger.info(f"Email sent successfully to {email.to}")
+                    email.future.set_result(True)
+                except smtplib.SMTPRecipientsRefused as e:
+                    self.logger.error(f"Failed to send email to {email.to}: {str(e)}")
+                    email.future.set_result(False)
+                except Exception as e:
+                    failed.append(email)
+                    error = e
+            if error is None:
+                self.pool.release(server)
+            else:
+                # The session may be broken, do not hand it back to the pool
+                self.pool.discard(server)
+            pending = self._retry_later(failed, error) if failed else []
+
+    def _retry_later(self, emails, error):
+        retry = []
+        for email in emails:
+            email.attempts += 1
+            if email.attempts >= self.max_retries:
+                self.logger.error(f"Failed to send email to {email.to}: {str(error)}")
+                email.future.set_result(False)
+            else:
+                retry.append(email)
+        if retry:
+            time.sleep(self.retry_backoff * (2 ** (retry[0].attempts - 1)))
+        return retry
+
     def send_plain_email(self, to_email, subject, body, cc=None, bcc=None, attachments=None):
         """Shorthand method to send plain text email."""
         return self.send_email(to_email, subject, body, False, cc, bcc, attachments)
@@ -123,6 +284,10 @@ class EmailManager:
     def send_html_email(self, to_email, subject, body, cc=None, bcc=None, attachments=None):
         """Shorthand method to send HTML email."""
         return self.send_email(to_email, subject, body, True, cc, bcc, attachments)
+
+    def queue_html_email(self, to_email, subject, body, cc=None, bcc=None, attachments=None):
+        """Shorthand method to queue HTML email without waiting for delivery."""
+        return self.queue_email(to_email, subject, body, True, cc, bcc, attachments)
     
     def _attach_file(self, msg, file_path):
         """
@@ -152,4 +317,20 @@ class EmailManager:
         except Exception as e:
             self.logger.error(f"Failed to attach file {file_path}: {str(e)}")
 
-email_manager = EmailManager()
+_email_manager = None
+_email_manager_lock = threading.Lock()
+
+def get_email_manager() -> EmailManager:
+    """Return the shared EmailManager, created on first use"""
+    global _email_manager
+    if _email_manager is None:
+        with _email_manager_lock:
+            if _email_manager is None:
+                _email_manager = EmailManager()
+    return _email_manager
+
+def __getattr__(name):
+    # Keep `from utils.email_manager import email_manager` working without constructing it at import
+    if name == "email_manager":
+        return get_email_manager()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
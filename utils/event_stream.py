@@ -0,0 +1,63 @@
+import asyncio
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Optional, Tuple
+
+_current_stream: ContextVar[Optional["TurnEventStream"]] = ContextVar("turn_event_stream", default=None)
+
+class TurnEventStream:
+    """
+    Collects the events of a single chat turn (LLM tokens, tool calls, flow
+    state transitions) from the crew worker thread and hands them to the
+    asyncio consumer that writes the Server-Sent-Events response.
+    """
+
+    _CLOSED = object()
+
+    def __init__(self, thread_id: Optional[str], loop: asyncio.AbstractEventLoop = None):
+        self.thread_id = thread_id
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(self, event: str, data: Any) -> None:
+        """Queue an event. Safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (event, data))
+
+    def close(self) -> None:
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, self._CLOSED)
+
+    @contextmanager
+    def bind(self):
+        """Route events emitted in the current context to this stream"""
+        token = _current_stream.set(self)
+        try:
+            yield self
+        finally:
+            _current_stream.reset(token)
+
+    async def events(self) -> AsyncIterator[Tuple[str, Any]]:
+        while True:
+            item = await self.queue.get()
+            if item is self._CLOSED:
+                return
+            yield item
+
+def get_current_stream() -> Optional[TurnEventStream]:
+    return _current_stream.get()
+
+def emit_event(event: str, data: Any, thread_id: Optional[str] = None) -> None:
+    """
+    Emit an event to the stream bound to the current context, if any.
+    When thread_id is given, events for other threads are dropped.
+    """
+    stream = _current_stream.get()
+    if stream is None:
+        return
+    if thread_id is not None and stream.thread_id != thread_id:
+        return
+    stream.emit(event, data)
+
+def format_sse(event: str, data: Any) -> str:
+    """Format a single Server-Sent-Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import random
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.tracing import SPAN_KIND_CLIENT, tracer
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+class HotelApiClient:
+    """
+    Shared client for the hotel API.
+
+    Keeps connections alive in a pooled session, applies connect/read timeouts
+    to every call and retries idempotent GETs with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        pool_size: Optional[int] = None,
+    ):
+        self._base_url = base_url
+        self.connect_timeout = connect_timeout or float(os.environ.get('HOTEL_API_CONNECT_TIMEOUT', 3.05))
+        self.read_timeout = read_timeout or float(os.environ.get('HOTEL_API_READ_TIMEOUT', 15))
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('HOTEL_API_MAX_RETRIES', 3))
+        self.pool_size = pool_size or int(os.environ.get('HOTEL_API_POOL_SIZE', 20))
+        self.backoff_factor = float(os.environ.get('HOTEL_API_BACKOFF_FACTOR', 0.2))
+
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            backoff_jitter=self.backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def base_url(self) -> str:
+        # Resolved lazily so the environment can be loaded after import
+        return (self._base_url or os.environ['HOTEL_API_BASE_URL']).rstrip("/")
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def get(self, path: str, headers: Optional[dict] = None, **kwargs) -> requests.Response:
+        """GET a hotel API path. Retried on connection errors and retryable status codes."""
+        kwargs.setdefault("timeout", self.timeout)
+        with tracer.span("HTTP GET", SPAN_KIND_CLIENT, **{"http.method": "GET", "http.target": path}) as span:
+            response = self.session.get(self.url(path), headers=headers, **kwargs)
+            span.set_attribute("http.status_code", response.status_code)
+            return response
+
+    def post(self, path: str, json: Optional[dict] = None, headers: Optional[dict] = None, **kwargs) -> requests.Response:
+        """POST to a hotel API path. Never retried since it may not be idempotent."""
+        kwargs.setdefault("timeout", self.timeout)
+        with tracer.span("HTTP POST", SPAN_KIND_CLIENT, **{"http.method": "POST", "http.target": path}) as span:
+            response = self.session.post(self.url(path), json=json, headers=headers, **kwargs)
+            span.set_attribute("http.status_code", response.status_code)
+            return response
+
+    def close(self) -> None:
+        self.session.close()
+
+class AsyncHotelApiClient:
+    """
+    Async variant of HotelApiClient backed by a pooled httpx.AsyncClient.
+    Uses the same configuration and retry policy.
+    """
+
+    def __init__(self, sync_client: Optional[HotelApiClient] = None):
+        import httpx
+
+        self.config = sync_client or HotelApiClient()
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.config.read_timeout, connect=self.config.connect_timeout),
+            limits=httpx.Limits(max_connections=self.config.pool_size, max_keepalive_connections=self.config.pool_size),
+        )
+
+    async def get(self, path: str, headers: Optional[dict] = None, **kwargs):
+        with tracer.span("HTTP GET", SPAN_KIND_CLIENT, **{"http.method": "GET", "http.target": path}) as span:
+            response = await self._get(path, headers, **kwargs)
+            span.set_attribute("http.status_code", response.status_code)
+            return response
+
+    async def _get(self, path: str, headers: Optional[dict] = None, **kwargs):
+        import httpx
+
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.get(self.config.url(path), headers=headers, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.config.max_retries:
+                    return response
+            except httpx.TransportError:
+                if attempt >= self.config.max_retries:
+                    raise
+            delay = self.config.backoff_factor * (2 ** attempt) + random.uniform(0, self.config.backoff_factor)
+            attempt += 1
+            logger.debug(f"Retrying GET {path} in {delay:.2f}s (attempt {attempt})")
+            await asyncio.sleep(delay)
+
+    async def post(self, path: str, json: Optional[dict] = None, headers: Optional[dict] = None, **kwargs):
+        with tracer.span("HTTP POST", SPAN_KIND_CLIENT, **{"http.method": "POST", "http.target": path}) as span:
+            response = await self.client.post(self.config.url(path), json=json, headers=headers, **kwargs)
+            span.set_attribute("http.status_code", response.status_code)
+            return response
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+# Single instance for application-wide use
+hotel_api_client = HotelApiClient()
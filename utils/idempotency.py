@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from utils.metrics import metrics
+from utils.session_store import Codec, Lease, SessionStore, session_store
+
+logger = logging.getLogger(__name__)
+
+class IdempotencyConflict(Exception):
+    """Raised when an idempotency key is reused for a different request."""
+
+@dataclass
+class IdempotentRun:
+    fingerprint: str
+    future: Future
+    lease: Lease
+
+def request_fingerprint(*parts: Any) -> str:
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+
+class IdempotencyCache:
+    """
+    Results of requests sent with an Idempotency-Key header, per user.
+
+    Claims and results live in the session store, so with a shared backend
+    a retry that lands on another worker process is recognized as well.
+    - The first request with a key takes a lease on it and runs; retries with
+      the same key and payload get its result instead of another crew run.
+    - A retry that arrives while the first request still runs waits for the
+      same result: through a local future on the same worker, by polling the
+      store on another one. The run outlives a client that disconnected.
+    - The lease is renewed while the run is alive. If its worker dies, the
+      lease runs out and a waiting retry takes over.
+    - Failed runs are forgotten so they can be retried. Reusing a key for a
+      different payload raises IdempotencyConflict.
+    Results are kept for ttl seconds.
+    """
+
+    def __init__(
+        self,
+        store: SessionStore = session_store,
+        ttl: float = None,
+        lease_seconds: float = None,
+        poll_interval: float = None,
+    ):
+        self.store = store
+        self.ttl = ttl or float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 3600))
+        self.lease_seconds = lease_seconds or float(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', 30))
+        self.poll_interval = poll_interval or float(os.environ.get('IDEMPOTENCY_POLL_INTERVAL_SECONDS', 0.2))
+        # Never batched: a result must be visible to retries as soon as it is stored
+        self.results = store.mapping("idempotency", batched=False)
+        self.lock = threading.Lock()
+        self.running: Dict[str, IdempotentRun] = {}
+        self.replayed = 0
+        self.joined = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    def _conflict(self) -> IdempotencyConflict:
+        self.conflicts += 1
+        return IdempotencyConflict("Idempotency-Key was already used for a different request")
+
+    def _stored_result(self, name: str, fingerprint: str, codec: Codec) -> Optional[Future]:
+        """A completed future holding the stored result for name, or None. Caller must hold self.lock."""
+        stored = self.results.get(name)
+        if stored is None:
+            return None
+        if stored["fingerprint"] != fingerprint:
+            raise self._conflict()
+        future: Future = Future()
+        future.set_result(codec.decode(stored["result"]) if self.store.serializes else stored["result"])
+        self.replayed += 1
+        return future
+
+    def claim(self, scope: str, key: str, fingerprint: str, codec: Codec = None) -> Tuple[Optional[Future], bool]:
+        """
+        Return the future holding the result for key and whether the caller has to produce it.
+        The future is None while another worker runs the key, call again after a pause.
+        """
+        codec = codec or Codec()
+        name = f"{scope}:{key}"
+        with self.lock:
+            run = self.running.get(name)
+            if run is not None:
+                if run.fingerprint != fingerprint:
+                    raise self._conflict()
+                self.joined += 1
+                return run.future, False
+            future = self._stored_result(name, fingerprint, codec)
+            if future is not None:
+                return future, False
+            lease = Lease(self.store, "idempotency_lease", name, self.lease_seconds, {"fingerprint": fingerprint})
+            acquired, holder = lease.try_acquire()
+            if not acquired:
+                if holder["fingerprint"] != fingerprint:
+                    raise self._conflict()
+                return None, False
+            # The previous holder may have stored its result between the read and the acquire
+            future = self._stored_result(name, fingerprint, codec)
+            if future is not None:
+                lease.release()
+                return future, False
+            self.misses += 1
+            run = self.running[name] = IdempotentRun(fingerprint, Future(), lease)
+            return run.future, True
+
+    async def run(
+        self, scope: str, key: str, fingerprint: str, fn: Callable[[], Awaitable[Any]], codec: Codec = None
+    ) -> Any:
+        """
+        Await fn() once per (scope, key), sharing its result with every request that reuses the key.
+        codec encodes the result for serializing session stores.
+        """
+        codec = codec or Codec()
+        future, owner = self.claim(scope, key, fingerprint, codec)
+        if future is None:
+            with self.lock:
+                self.joined += 1
+            while future is None:
+                # Running on another worker: wait until it stores a result, fails or loses its lease
+                await asyncio.sleep(self.poll_interval)
+                future, owner = self.claim(scope, key, fingerprint, codec)
+        if owner:
+            # A task of its own, so the owner's request going away does not cancel the run
+            task = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._settle(f"{scope}:{key}", codec, done))
+        # Shielded: a waiter that disconnects must not cancel the shared future
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def _settle(self, name: str, codec: Codec, task: "asyncio.Task") -> None:
+        with self.lock:
+            run = self.running.pop(name)
+        try:
+            if not task.cancelled() and task.exception() is None:
+                result = task.result()
+                stored = codec.encode(result) if self.store.serializes else result
+                self.results.set(name, {"fingerprint": run.fingerprint, "result": stored}, self.ttl)
+        except Exception as e:
+            # Waiters still get the result, only a later retry runs again
+            logger.error(f"Storing the result for idempotency key {name} failed: {e}")
+        finally:
+            run.lease.release()
+        if task.cancelled():
+            run.future.set_exception(asyncio.CancelledError())
+        elif task.exception() is not None:
+            run.future.set_exception(task.exception())
+        else:
+            run.future.set_result(task.result())
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "running": len(self.running),
+                "replayed": self.replayed,
+                "joined": self.joined,
+                "misses": self.misses,
+                "conflicts": self.conflicts,
+            }
+
+# Single instance for application-wide use
+idempotency_cache = IdempotencyCache()
+metrics.register_collector("idempotency", idempotency_cache.stats)
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Optional
+
+from utils.background_loop import BackgroundLoop, background_loop
+from utils.tracing import SPAN_KIND_CLIENT, tracer
+
+logger = logging.getLogger(__name__)
+
+class IdpClient:
+    """
+    Pooled async HTTP client for the identity provider (token, CIBA and JWKS endpoints).
+
+    The httpx.AsyncClient is bound to the shared background loop, so every
+    request runs there: async handlers await it without blocking their own
+    event loop, and crew tool threads use the blocking facade.
+    """
+
+    def __init__(self, loop: BackgroundLoop = background_loop):
+        self.loop = loop
+        self.timeout = float(os.environ.get('IDP_TIMEOUT_SECONDS', 10))
+        self.connect_timeout = float(os.environ.get('IDP_CONNECT_TIMEOUT_SECONDS', 3.05))
+        self.pool_size = int(os.environ.get('IDP_POOL_SIZE', 10))
+        # TLS verification was disabled for the IdP until now, keep that unless configured
+        self.verify = os.environ.get('IDP_VERIFY_TLS', 'false').lower() == 'true'
+        self._client = None
+
+    @property
+    def client(self):
+        """Created on first use, on the background loop"""
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                verify=self.verify,
+            )
+        return self._client
+
+    async def _request(self, method: str, url: str, data: Optional[dict] = None):
+        return await self.client.request(method, url, data=data)
+
+    async def post_async(self, url: str, data: dict):
+        """POST a form from any event loop"""
+        with self._span("POST", url) as span:
+            response = await asyncio.wrap_future(self.loop.submit(self._request("POST", url, data)))
+            span.set_attribute("http.status_code", response.status_code)
+            return response
+
+    async def get_async(self, url: str):
+        with self._span("GET", url) as span:
+            response = await asyncio.wrap_future(self.loop.submit(self._request("GET", url)))
+            span.set_attribute("http.status_code", response.status_code)
+            return response
+
+    def post(self, url: str, data: dict):
+        """POST a form and block until the response arrives. Not for use on an event loop thread."""
+        with self._span("POST", url) as span:
+            response = self._run_sync(self._request("POST", url, data))
+            span.set_attribute("http.status_code", response.status_code)
+            return response
+
+    def get(self, url: str):
+        with self._span("GET", url) as span:
+            response = self._run_sync(self._request("GET", url))
+            span.set_attribute("http.status_code", response.status_code)
+            return response
+
+    def _span(self, method: str, url: str):
+        # Started on the caller's side, the request itself runs in the loop's context
+        return tracer.span(f"HTTP {method}", SPAN_KIND_CLIENT, **{"http.method": method, "http.url": url, "peer.service": "idp"})
+
+    def _run_sync(self, coro):
+        if self.loop.thread is threading.current_thread():
+            coro.close()
+            raise RuntimeError("Blocking IdP call on the background loop, use the async methods instead")
+        # Allow for connect + read, so a hung loop cannot block the caller forever
+        return self.loop.run_sync(coro, timeout=self.timeout + self.connect_timeout + 1)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+# Single instance for application-wide use
+idp_client = IdpClient()
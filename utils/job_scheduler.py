@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Union
+
+from pydantic import BaseModel
+
+from utils.asgardeo_manager import asgardeo_manager
+from utils.background_loop import BackgroundLoop, background_loop
+from utils.session_store import ModelCodec, session_store
+
+logger = logging.getLogger(__name__)
+
+# Seconds added to the polling interval when the IdP answers slow_down (RFC 8628 / CIBA)
+SLOW_DOWN_INCREMENT = 5
+
+class CibaJob(BaseModel):
+    id: str
+    kind: str
+    thread_id: Optional[str]
+    scopes: List[str]
+    payload: Dict[str, Union[int, str, None]]
+    auth_req_id: Optional[str] = None
+    interval: float
+    next_run_at: float
+    deadline: float
+    lease_until: float
+    # Consecutive steps that raised, reset by the next step that completes
+    attempts: int = 0
+
+class CibaJobScheduler:
+    """
+    Runs CIBA polling jobs on a single background event loop.
+
+    Every job is one timer on the loop (asyncio keeps them in a heap), so a
+    pending job costs no thread while it waits. Due steps run on a small
+    executor capped at max_concurrency. Polling honors the IdP's interval and
+    slow_down answers. Jobs are persisted in the session store, one key per
+    job, after every step, and jobs whose owner stopped renewing their lease
+    (e.g. after a restart) are picked up again by a periodic recovery sweep
+    over that namespace. A step that raises (e.g. the IdP is unreachable) is
+    retried with exponential backoff, and the job is dropped after
+    max_attempts consecutive failures.
+    """
+
+    def __init__(
+        self,
+        loop: BackgroundLoop = background_loop,
+        max_concurrency: int = None,
+        initial_delay: float = None,
+        default_interval: float = None,
+        max_duration: float = None,
+        lease_grace: float = None,
+        recover_interval: float = None,
+        max_attempts: int = None,
+        retry_backoff: float = None,
+    ):
+        self.loop = loop
+        self.max_concurrency = max_concurrency or int(os.environ.get('CIBA_MAX_CONCURRENCY', 4))
+        self.initial_delay = initial_delay if initial_delay is not None else float(os.environ.get('CIBA_INITIAL_DELAY_SECONDS', 30))
+        self.default_interval = default_interval or float(os.environ.get('CIBA_POLL_INTERVAL_SECONDS', 15))
+        self.max_duration = max_duration or float(os.environ.get('CIBA_MAX_DURATION_SECONDS', 15 * 60))
+        self.lease_grace = lease_grace or float(os.environ.get('CIBA_LEASE_GRACE_SECONDS', 60))
+        self.recover_interval = recover_interval or float(os.environ.get('CIBA_RECOVER_INTERVAL_SECONDS', 60))
+        self.max_attempts = max_attempts or int(os.environ.get('CIBA_MAX_ATTEMPTS', 5))
+        self.retry_backoff = retry_backoff or float(os.environ.get('CIBA_RETRY_BACKOFF_SECONDS', 5))
+
+        # Never batched: jobs outlive the request that schedules them
+        self.jobs = session_store.mapping("ciba_jobs", ModelCodec(CibaJob), batched=False)
+        self.handlers: Dict[str, Callable[[CibaJob, str], None]] = {}
+        self.scheduled: Dict[str, asyncio.TimerHandle] = {}
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.started = False
+        self.start_lock = threading.Lock()
+
+    def register_handler(self, kind: str, handler: Callable[[CibaJob, str], None]) -> None:
+        """Register the callback run with (job, access_token) once a job of kind is authorized"""
+        self.handlers[kind] = handler
+
+    def start(self) -> None:
+        """Start the scheduler loop and recover persisted jobs"""
+        with self.start_lock:
+            if self.started:
+                return
+            self.started = True
+        self.loop.call_soon(self._start_on_loop)
+
+    def _start_on_loop(self) -> None:
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._recover()
+
+    def schedule(self, kind: str, thread_id: Optional[str], scopes: List[str], payload: Dict) -> CibaJob:
+        """Persist a new job and schedule its CIBA initiation"""
+        now = time.time()
+        job = CibaJob(
+            id=str(uuid.uuid4()),
+            kind=kind,
+            thread_id=thread_id,
+            scopes=scopes,
+            payload=payload,
+            interval=self.default_interval,
+            next_run_at=now + self.initial_delay,
+            deadline=now + self.initial_delay + self.max_duration,
+            lease_until=now + self.initial_delay + self.lease_grace,
+        )
+        self._save(job)
+        self.start()
+        self.loop.call_soon(self._schedule, job)
+        return job
+
+    def pending_count(self) -> int:
+        return len(self.scheduled)
+
+    # Runs on the scheduler loop
+
+    def _schedule(self, job: CibaJob) -> None:
+        loop = asyncio.get_running_loop()
+        delay = max(0.0, job.next_run_at - time.time())
+        self.scheduled[job.id] = loop.call_later(delay, lambda: loop.create_task(self._run_step(job)))
+
+    def _recover(self) -> None:
+        loop = asyncio.get_running_loop()
+        now = time.time()
+        for job_id in self.jobs.keys():
+            if job_id in self.scheduled:
+                continue
+            job = self._claim(job_id, now)
+            if job is not None:
+                logger.info(f"Recovering CIBA job {job.id} ({job.kind})")
+                self._schedule(job)
+        loop.call_later(self.recover_interval, self._recover)
+
+    def _claim(self, job_id: str, now: float) -> Optional[CibaJob]:
+        """
+        Take over a job whose lease ran out. The check and the lease renewal are one
+        atomic update, so when several workers sweep at once only one of them wins.
+        """
+        listed = self.jobs.get(job_id)
+        if listed is None or listed.kind not in self.handlers or listed.lease_until >= now:
+            return None
+        outcome = {}
+
+        def apply(job: Optional[CibaJob]) -> CibaJob:
+            if job is None:
+                # Finished since it was listed, do not store it again
+                raise KeyError(job_id)
+            if job.lease_until >= now:
+                return job
+            job.lease_until = max(now, job.next_run_at) + self.lease_grace
+            outcome["claimed"] = True
+            return job
+
+        try:
+            job = self.jobs.update(job_id, apply, ttl=self._ttl(listed))
+        except KeyError:
+            return None
+        return job if outcome.get("claimed") else None
+
+    async def _run_step(self, job: CibaJob) -> None:
+        async with self.semaphore:
+            try:
+                done = await asyncio.get_running_loop().run_in_executor(None, self._step, job)
+                job.attempts = 0
+                delay = job.interval
+            except Exception as e:
+                job.attempts += 1
+                done = job.attempts >= self.max_attempts
+                delay = self.retry_backoff * 2 ** (job.attempts - 1)
+                if done:
+                    logger.error(f"CIBA job {job.id} failed {job.attempts} times, giving up: {e}")
+                else:
+                    logger.warning(f"CIBA job {job.id} failed (attempt {job.attempts}), retrying in {delay:.1f}s: {e}")
+        if done:
+            self.scheduled.pop(job.id, None)
+            self._finish(job)
+            return
+        job.next_run_at = time.time() + delay
+        job.lease_until = job.next_run_at + self.lease_grace
+        self._save(job)
+        self._schedule(job)
+
+    def _step(self, job: CibaJob) -> bool:
+        """Run one blocking step of a job. Returns True when the job is finished."""
+        if time.time() > job.deadline:
+            logger.warning(f"CIBA job {job.id} expired before authorization")
+            return True
+        if job.auth_req_id is None:
+            data = asgardeo_manager.initiate_ciba_request(job.thread_id, job.scopes)
+            job.auth_req_id = data["auth_req_id"]
+            job.interval = float(data.get("interval") or job.interval)
+            if data.get("expires_in"):
+                job.deadline = min(job.deadline, time.time() + float(data["expires_in"]))
+            return False
+
+        response = asgardeo_manager.get_ciba_token(job.auth_req_id)
+        state = response.get("state")
+        if state == "success":
+            self.handlers[job.kind](job, response.get("token"))
+            return True
+        if state == "slow_down":
+            job.interval += SLOW_DOWN_INCREMENT
+            return False
+        if state == "pending":
+            return False
+        logger.warning(f"CIBA job {job.id} failed: {response.get('error')}")
+        return True
+
+    # Persistence
+
+    def _ttl(self, job: CibaJob) -> float:
+        return max(1.0, job.deadline - time.time() + self.lease_grace)
+
+    def _save(self, job: CibaJob) -> None:
+        self.jobs.set(job.id, job, ttl=self._ttl(job))
+
+    def _finish(self, job: CibaJob) -> None:
+        del self.jobs[job.id]
+
+# Single instance for application-wide use
+ciba_scheduler = CibaJobScheduler()
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import jwt
+from jwt.exceptions import InvalidTokenError, PyJWKClientConnectionError
+
+from utils.idp_client import idp_client
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+def default_jwks_url() -> Optional[str]:
+    """Asgardeo serves its JWKS next to the token endpoint (.../oauth2/jwks)"""
+    token_url = os.environ.get('TOKEN_URL')
+    if not token_url:
+        return None
+    return token_url.rsplit('/token', 1)[0] + '/jwks'
+
+class JwksCache:
+    """
+    Signing keys by kid, loaded once from JWKS_FILE or JWKS_URL.
+
+    Keys are reloaded after max_age seconds, and early when a token names a
+    kid we do not know (key rotation). Reloads are rate limited to one per
+    min_refresh_interval so garbage kids cannot hammer the IdP. A failed
+    reload keeps the keys we already have.
+    """
+
+    def __init__(self, url: str = None, path: str = None, max_age: float = None, min_refresh_interval: float = None):
+        self.path = path or os.environ.get('JWKS_FILE')
+        self.url = url or os.environ.get('JWKS_URL') or default_jwks_url()
+        self.max_age = max_age or float(os.environ.get('JWKS_MAX_AGE_SECONDS', 3600))
+        self.min_refresh_interval = min_refresh_interval if min_refresh_interval is not None else float(os.environ.get('JWKS_MIN_REFRESH_SECONDS', 60))
+        self.lock = threading.Lock()
+        self.keys: Dict[str, jwt.PyJWK] = {}
+        self.loaded_at = 0.0
+        self.attempted_at = 0.0
+
+    def _fetch(self) -> dict:
+        if self.path:
+            with open(self.path) as f:
+                return json.load(f)
+        if not self.url:
+            raise PyJWKClientConnectionError("No JWKS_URL or JWKS_FILE configured")
+        response = idp_client.get(self.url)
+        response.raise_for_status()
+        return response.json()
+
+    def _refresh(self) -> None:
+        """Reload the key set. Called with the lock held."""
+        self.attempted_at = time.monotonic()
+        try:
+            jwk_set = jwt.PyJWKSet.from_dict(self._fetch())
+        except Exception as e:
+            metrics.increment("jwks_refresh_total", result="error")
+            if not self.keys:
+                raise PyJWKClientConnectionError(f"Failed to load JWKS: {e}")
+            logger.warning(f"Failed to refresh JWKS, keeping {len(self.keys)} cached keys: {e}")
+            return
+        metrics.increment("jwks_refresh_total", result="ok")
+        self.keys = {key.key_id: key for key in jwk_set.keys if key.key_id}
+        self.loaded_at = self.attempted_at
+
+    def get_signing_key(self, kid: Optional[str]) -> jwt.PyJWK:
+        with self.lock:
+            now = time.monotonic()
+            can_refresh = now - self.attempted_at >= self.min_refresh_interval
+            if not self.keys or (can_refresh and (kid not in self.keys or now - self.loaded_at >= self.max_age)):
+                self._refresh()
+            key = self.keys.get(kid)
+            if key is None and kid is None and len(self.keys) == 1:
+                # Tokens without a kid are accepted when the set has a single key
+                key = next(iter(self.keys.values()))
+        if key is None:
+            raise InvalidTokenError(f"Unknown signing key: {kid}")
+        return key
+
+class JwtVerifier:
+    """
+    Verifies bearer tokens locally and caches their decoded claims.
+
+    Claims are cached by token hash until the token's exp, so repeated
+    requests with the same token cost a hash and a dict lookup.
+    """
+
+    def __init__(self, jwks: JwksCache = None, max_entries: int = None):
+        self.jwks = jwks or JwksCache()
+        self.verify_signature = os.environ.get('JWT_VERIFY_SIGNATURE', 'true').lower() == 'true'
+        self.algorithms: List[str] = os.environ.get('JWT_ALGORITHMS', 'RS256').split(',')
+        self.audience = os.environ.get('JWT_AUDIENCE')
+        self.issuer = os.environ.get('JWT_ISSUER')
+        self.leeway = float(os.environ.get('JWT_LEEWAY_SECONDS', 30))
+        self.max_entries = max_entries or int(os.environ.get('JWT_CLAIMS_CACHE_MAX_ENTRIES', 4096))
+        self.lock = threading.Lock()
+        self.claims: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, token: str) -> Tuple[dict, bool]:
+        """
+        Return the verified claims of token and whether they were freshly
+        decoded (False on a cache hit). Raises InvalidTokenError.
+        """
+        key = hashlib.sha256(token.encode()).hexdigest()
+        now = time.time()
+        with self.lock:
+            entry = self.claims.get(key)
+            if entry and now < entry[1]:
+                self.claims.move_to_end(key)
+                self.hits += 1
+                return entry[0], False
+            self.misses += 1
+
+        claims = self._decode(token)
+        exp = claims.get("exp")
+        if exp is not None:
+            with self.lock:
+                self.claims[key] = (claims, float(exp) + self.leeway)
+                while len(self.claims) > self.max_entries:
+                    self.claims.popitem(last=False)
+        return claims, True
+
+    def _decode(self, token: str) -> dict:
+        if not self.verify_signature:
+            return jwt.decode(token, options={"verify_signature": False})
+        kid = jwt.get_unverified_header(token).get("kid")
+        return jwt.decode(
+            token,
+            self.jwks.get_signing_key(kid),
+            algorithms=self.algorithms,
+            audience=self.audience,
+            issuer=self.issuer,
+            leeway=self.leeway,
+            options={"verify_aud": self.audience is not None, "require": ["sub"]},
+        )
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"entries": len(self.claims), "hits": self.hits, "misses": self.misses}
+
+# Single instance for application-wide use
+jwt_verifier = JwtVerifier()
+metrics.register_collector("jwt_claims_cache", jwt_verifier.stats)
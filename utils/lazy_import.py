@@ -0,0 +1,63 @@
+import importlib
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from types import ModuleType
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class LazyModule:
+    """
+    A module imported on first use instead of at application import.
+
+    Keeps heavy import graphs (crewai, litellm and the tool modules) off the
+    cold-start path. preload() starts the import on a background thread, so
+    the server accepts connections while it runs and the first caller only
+    waits for whatever is left.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.module: Optional[ModuleType] = None
+        self.import_seconds: Optional[float] = None
+        self._preload: Optional[Future] = None
+
+    def get(self) -> ModuleType:
+        if self.module is None:
+            # The import lock serializes concurrent first callers
+            with self.lock:
+                if self.module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self.name)
+                    self.import_seconds = time.perf_counter() - start
+                    logger.info(f"Imported {self.name} in {self.import_seconds:.2f}s")
+                    self.module = module
+        return self.module
+
+    def preload(self) -> Future:
+        """Import on a daemon thread. Errors are logged and raised again on get()."""
+        with self.lock:
+            if self._preload is None:
+                self._preload = Future()
+                threading.Thread(target=self._run_preload, name=f"preload-{self.name}", daemon=True).start()
+            return self._preload
+
+    def _run_preload(self) -> None:
+        try:
+            self._preload.set_result(self.get())
+        except BaseException as e:
+            logger.exception(f"Preloading {self.name} failed")
+            self._preload.set_exception(e)
+
+    @property
+    def loaded(self) -> bool:
+        return self.module is not None
+
+    def stats(self) -> dict:
+        return {"loaded": int(self.loaded), "import_seconds": self.import_seconds or 0.0}
+
+    def __getattr__(self, name: str):
+        return getattr(self.get(), name)
@@ -0,0 +1,51 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import List
+
+from utils.chat_history import Message
+
+CONFIRMATION_PATTERN = re.compile(
+    r"^\s*(yes|yeah|yep|yup|sure|ok|okay|confirm|confirmed|go ahead|please do|do it|book it|no|nope|cancel)\b"
+    r"[\w\s,.!']{0,40}$",
+    re.IGNORECASE,
+)
+ID_PATTERN = re.compile(r"\b(hotel|room|booking)\s*(id)?\s*(number|no\.?)?\s*[:#]?\s*\d+\b", re.IGNORECASE)
+DATE_PATTERN = re.compile(
+    r"\b\d{4}-\d{2}-\d{2}\b"
+    r"|\b\d{1,2}(st|nd|rd|th)?\s+(of\s+)?(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\b"
+    r"|\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\s+\d{1,2}(st|nd|rd|th)?\b",
+    re.IGNORECASE,
+)
+
+@dataclass
+class RouteDecision:
+    aggregate: bool
+    reason: str
+
+    @property
+    def path(self) -> str:
+        return "aggregated" if self.aggregate else "fast"
+
+def is_fast_path_enabled() -> bool:
+    return os.environ.get('CREW_FAST_PATH', 'true').lower() == 'true'
+
+def route_message(message: str, messages: List[Message]) -> RouteDecision:
+    """
+    Decide whether the "Message Aggregator" pass is needed for a message.
+
+    messages is the thread history including the current user message.
+    The pass is skipped when the message can be handled on its own:
+    - it is the first message in the thread
+    - it is a short confirmation reply to the previous assistant message
+    - it already carries explicit IDs and dates
+    """
+    if not is_fast_path_enabled():
+        return RouteDecision(aggregate=True, reason="disabled")
+    if sum(1 for msg in messages if msg.role == "user") <= 1:
+        return RouteDecision(aggregate=False, reason="first_message")
+    if CONFIRMATION_PATTERN.match(message):
+        return RouteDecision(aggregate=False, reason="confirmation")
+    if ID_PATTERN.search(message) and DATE_PATTERN.search(message):
+        return RouteDecision(aggregate=False, reason="self_contained")
+    return RouteDecision(aggregate=True, reason="needs_context")
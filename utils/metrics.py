@@ -0,0 +1,139 @@
+import math
+import re
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, List, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _metric_key(name: str, labels: Dict[str, str]) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+def _prometheus_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _prometheus_labels(labels: Dict[str, str], **extra: str) -> str:
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{_prometheus_name(key)}="{_escape_label_value(value)}"' for key, value in sorted(labels.items())) + "}"
+
+def _prometheus_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metrics:
+    """
+    Minimal in-process counters and timings, keyed by name and labels.
+    Timings keep a latency histogram so they can be scraped in Prometheus format.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.lock = Lock()
+        self.buckets = buckets
+        self.counters: Dict[str, float] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self.histograms: Dict[str, List[int]] = {}
+        self.series: Dict[str, Tuple[str, Dict[str, str]]] = {}
+        self.collectors: Dict[str, Callable[[], Dict]] = {}
+
+    def register_collector(self, name: str, collector: Callable[[], Dict]) -> None:
+        """Register a callable whose stats are included in every snapshot under name"""
+        with self.lock:
+            self.collectors[name] = collector
+
+    def increment(self, name: str, value: float = 1, **labels: str) -> None:
+        key = _metric_key(name, labels)
+        with self.lock:
+            if key not in self.counters:
+                self.series[key] = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = _metric_key(name, labels)
+        bucket = bisect_left(self.buckets, seconds)
+        with self.lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = {"count": 0, "total": 0.0, "max": 0.0}
+                self.histograms[key] = [0] * (len(self.buckets) + 1)
+                self.series[key] = (name, labels)
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+            self.histograms[key][bucket] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels: str):
+        """Observe the wall time of the wrapped block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self.lock:
+            snapshot = {
+                "counters": dict(self.counters),
+                "timings": {
+                    key: dict(timing, avg=timing["total"] / timing["count"])
+                    for key, timing in self.timings.items()
+                },
+            }
+            collectors = dict(self.collectors)
+        for name, collector in collectors.items():
+            snapshot[name] = collector()
+        return snapshot
+
+    def prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines: List[str] = []
+        typed = set()
+
+        def declare(name: str, metric_type: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        with self.lock:
+            counters = [(self.series[key], value) for key, value in self.counters.items()]
+            timings = [(self.series[key], dict(timing), list(self.histograms[key])) for key, timing in self.timings.items()]
+            collectors = dict(self.collectors)
+
+        for (name, labels), value in sorted(counters, key=lambda item: item[0][0]):
+            name = _prometheus_name(name)
+            declare(name, "counter")
+            lines.append(f"{name}{_prometheus_labels(labels)} {_prometheus_value(value)}")
+
+        for (name, labels), timing, histogram in sorted(timings, key=lambda item: item[0][0]):
+            name = _prometheus_name(name)
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{_prometheus_labels(labels, le=_prometheus_value(float(bound)))} {cumulative}")
+            lines.append(f"{name}_sum{_prometheus_labels(labels)} {_prometheus_value(timing['total'])}")
+            lines.append(f"{name}_count{_prometheus_labels(labels)} {timing['count']}")
+
+        # Collector stats are point-in-time values, exported as gauges
+        for collector_name, collector in sorted(collectors.items()):
+            for stat, value in collector().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = _prometheus_name(f"{collector_name}_{stat}")
+                    declare(name, "gauge")
+                    lines.append(f"{name} {_prometheus_value(value)}")
+        return "\n".join(lines) + "\n"
+
+# Single instance for application-wide use
+metrics = Metrics()
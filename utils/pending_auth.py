@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import logging
+import os
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from utils.metrics import metrics
+from utils.session_store import ModelCodec, session_store
+
+logger = logging.getLogger(__name__)
+
+class PendingAuthorization(BaseModel):
+    state: str
+    kind: str
+    thread_id: Optional[str]
+    user_id: Optional[str]
+    scopes: List[str]
+    redirect_uri: str
+    authorization_url: str
+    code_verifier: Optional[str] = None
+    expires_at: float
+
+def pkce_challenge(code_verifier: str) -> str:
+    """S256 code challenge for a PKCE code verifier"""
+    digest = hashlib.sha256(code_verifier.encode()).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+class PendingAuthorizationStore:
+    """
+    Authorization requests waiting for their OAuth callback, keyed by state.
+
+    - Entries expire after ttl seconds and are removed when the callback
+      consumes them, so a state can only be redeemed once.
+    - A thread asking again for the same kind and scopes gets its still-valid
+      pending request back instead of a new one (e.g. a retried booking preview).
+    - At most max_entries requests issued by this process are kept; the
+      oldest are dropped first.
+    """
+
+    def __init__(self, ttl: float = None, max_entries: int = None, min_remaining: float = None):
+        self.ttl = ttl or float(os.environ.get('PENDING_AUTH_TTL_SECONDS', 600))
+        self.max_entries = max_entries or int(os.environ.get('PENDING_AUTH_MAX_ENTRIES', 10000))
+        # A pending request is only reused while the user still has this long to complete it
+        self.min_remaining = min_remaining if min_remaining is not None else float(os.environ.get('PENDING_AUTH_MIN_REMAINING_SECONDS', 60))
+        self.use_pkce = os.environ.get('OAUTH_USE_PKCE', 'false').lower() == 'true'
+        self.pending = session_store.mapping("pending_auth", ModelCodec(PendingAuthorization), self.ttl)
+        self.by_request = session_store.mapping("pending_auth_request", ttl=self.ttl)
+        self.lock = threading.Lock()
+        # States issued by this process, oldest first, to enforce max_entries
+        self.issued: "OrderedDict[str, float]" = OrderedDict()
+
+    def _request_key(self, kind: str, thread_id: Optional[str], scopes: List[str]) -> str:
+        return f"{kind}:{thread_id}:{' '.join(sorted(set(scopes)))}"
+
+    def get_or_create(
+        self,
+        kind: str,
+        thread_id: Optional[str],
+        user_id: Optional[str],
+        scopes: List[str],
+        redirect_uri: str,
+        build_url: Callable[[str, Optional[str]], str],
+    ) -> PendingAuthorization:
+        """
+        Return the pending authorization for (kind, thread_id, scopes), creating
+        one if there is none still valid. build_url(state, code_challenge) builds
+        the authorization URL of a new request.
+        """
+        request_key = self._request_key(kind, thread_id, scopes)
+        with self.lock:
+            state = self.by_request.get(request_key)
+            pending = self.pending.get(state) if state else None
+            if pending and pending.user_id == user_id and pending.expires_at - time.time() > self.min_remaining:
+                metrics.increment("pending_auth_total", kind=kind, result="reused")
+                return pending
+
+            state = str(uuid.uuid4())
+            code_verifier = secrets.token_urlsafe(48) if self.use_pkce else None
+            pending = PendingAuthorization(
+                state=state,
+                kind=kind,
+                thread_id=thread_id,
+                user_id=user_id,
+                scopes=scopes,
+                redirect_uri=redirect_uri,
+                authorization_url=build_url(state, pkce_challenge(code_verifier) if code_verifier else None),
+                code_verifier=code_verifier,
+                expires_at=time.time() + self.ttl,
+            )
+            self.pending[state] = pending
+            self.by_request[request_key] = state
+            self._track(state, pending.expires_at)
+        metrics.increment("pending_auth_total", kind=kind, result="created")
+        return pending
+
+    def _track(self, state: str, expires_at: float) -> None:
+        """Record an issued state and drop the oldest ones beyond max_entries. Called with the lock held."""
+        self.issued[state] = expires_at
+        now = time.time()
+        while self.issued:
+            oldest, oldest_expires_at = next(iter(self.issued.items()))
+            if oldest_expires_at > now and len(self.issued) <= self.max_entries:
+                break
+            del self.issued[oldest]
+            if oldest_expires_at > now:
+                logger.warning(f"Pending authorization limit reached, dropping {oldest}")
+                metrics.increment("pending_auth_evictions_total")
+                del self.pending[oldest]
+
+    def consume(self, state: str) -> Optional[PendingAuthorization]:
+        """Redeem a state from an OAuth callback. Returns None if unknown, expired or already used."""
+        pending = self.pending.pop(state)
+        with self.lock:
+            self.issued.pop(state, None)
+        if pending is None or pending.expires_at <= time.time():
+            return None
+        request_key = self._request_key(pending.kind, pending.thread_id, pending.scopes)
+        if self.by_request.get(request_key) == state:
+            del self.by_request[request_key]
+        return pending
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"issued": len(self.issued)}
+
+# Single instance for application-wide use
+pending_auth_store = PendingAuthorizationStore()
+metrics.register_collector("pending_auth", pending_auth_store.stats)
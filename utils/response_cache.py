@@ -0,0 +1,256 @@
+import copy
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
+
+from utils.constants import FlowState
+from utils.message_router import CONFIRMATION_PATTERN, DATE_PATTERN
+from utils.metrics import metrics
+
+# Only turns that used nothing but these tools are cached. Bookings, previews,
+# upgrades and calendar entries have side effects, chat history and bookings are per user.
+CACHEABLE_TOOLS: FrozenSet[str] = frozenset({"FetchHotelsTool", "FetchHotelTool", "FetchRoomTool"})
+
+# States a cached turn may replay on a hit, the ones the catalog tools record
+CACHEABLE_STATES: FrozenSet[FlowState] = frozenset({FlowState.FETCHED_HOTELS, FlowState.FETCHED_HOTEL, FlowState.FETCHED_ROOM})
+
+# Read-only catalog questions: about hotels or rooms, without a booking verb,
+# dates, or a reference to something earlier in the conversation
+CATALOG_PATTERN = re.compile(
+    r"\b(hotels?|rooms?|suites?|villas?|amenit\w*|facilit\w*|pools?|spa|restaurants?|dining|prices?|rates?|locations?|cit(y|ies))\b",
+    re.IGNORECASE,
+)
+WRITE_PATTERN = re.compile(
+    r"\b(book\w*|reserv\w*|cancel\w*|upgrad\w*|confirm\w*|calend[ae]r|pay\w*|change|modify|refund\w*|my|mine)\b",
+    re.IGNORECASE,
+)
+REFERENCE_PATTERN = re.compile(r"\b(it|its|that|this|those|these|there|them|one|ones|same|again|previous|last)\b", re.IGNORECASE)
+
+# Words that do not change what is being asked for. Messages are compared on
+# the remaining words, so "rooms in Kandy" is far from "rooms in Galle" while
+# "show me your hotels" and "what hotels do you have" are the same question.
+FILLER_WORDS = frozenset("""
+    a an the and or of in at on for to with that who me you your we us our i do does did is are be can could would will
+    please pls show list tell give see find get what which where how any some all about more info information
+    have has got available offer options hi hello hey thanks thank
+""".split())
+
+NUMBER_PATTERN = re.compile(r"\d+")
+NON_WORD_PATTERN = re.compile(r"[^\w\s]")
+
+_turn_tools: ContextVar[Optional[Set[str]]] = ContextVar("response_cache_turn_tools", default=None)
+
+def note_tool_use(tool_name: str) -> None:
+    """Record that the current turn ran tool_name. Called for every tool the crew starts."""
+    tools = _turn_tools.get()
+    if tools is not None:
+        tools.add(tool_name)
+
+def normalize(message: str) -> str:
+    return " ".join(NON_WORD_PATTERN.sub(" ", message.lower()).split())
+
+def _trigrams(text: str) -> Counter:
+    padded = f" {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def _norm(grams: Counter) -> float:
+    return math.sqrt(sum(count * count for count in grams.values()))
+
+def _stem(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+@dataclass
+class CachedResponse:
+    """
+    What a turn returned: the resolved crew output, the unresolved one its chat
+    history entry is rendered from, the full payloads behind that entry's tool
+    output handles (None when some could not be resolved) and the states it recorded.
+    Handles belong to one thread, so a hit re-issues them before writing the history entry.
+    """
+    crew_dict: Dict[str, Any]
+    history_dict: Dict[str, Any]
+    payloads: Optional[Dict[str, Any]]
+    states: List[FlowState]
+
+@dataclass
+class ResponseCacheEntry:
+    text: str
+    grams: Counter
+    norm: float
+    numbers: Tuple[str, ...]
+    response: CachedResponse
+    expires_at: float
+    hits: int = field(default=0)
+
+class ResponseCache:
+    """
+    Opt-in cache of whole chat turns for read-only catalog questions
+    ("what hotels do you have", "show me rooms in Kandy").
+
+    Entries are keyed by the thread's flow-state digest and matched by cosine
+    similarity of the character trigrams of the message's non-filler words,
+    at or above threshold; numbers must agree exactly. Turns that ran any
+    tool outside CACHEABLE_TOOLS are never stored. Entries live for ttl
+    seconds, at most max_entries are kept, least recently used first out.
+    """
+
+    def __init__(self, enabled: bool = None, threshold: float = None, ttl: float = None, max_entries: int = None):
+        self.enabled = enabled if enabled is not None else os.environ.get('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+        self.threshold = threshold or float(os.environ.get('RESPONSE_CACHE_SIMILARITY', 0.8))
+        self.ttl = ttl or float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', 300))
+        self.max_entries = max_entries or int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 512))
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Tuple[str, str], ResponseCacheEntry]" = OrderedDict()
+        # Flow-state digest -> keys of its entries, the candidates scanned on a lookup
+        self.by_digest: Dict[str, Set[Tuple[str, str]]] = {}
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stored = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def is_cacheable(self, message: str) -> bool:
+        """Whether message is a read-only catalog question that does not depend on earlier turns"""
+        return bool(
+            CATALOG_PATTERN.search(message)
+            and not WRITE_PATTERN.search(message)
+            and not REFERENCE_PATTERN.search(message)
+            and not DATE_PATTERN.search(message)
+            and not CONFIRMATION_PATTERN.match(message)
+        )
+
+    def _features(self, text: str) -> Tuple[Counter, float, Tuple[str, ...]]:
+        """Trigrams of the non-filler words, their norm, and the numbers in text"""
+        grams = _trigrams(" ".join(_stem(word) for word in text.split() if word not in FILLER_WORDS))
+        return grams, _norm(grams), tuple(NUMBER_PATTERN.findall(text))
+
+    def lookup(self, message: str, flow_digest: str) -> Optional[CachedResponse]:
+        """Return a copy of the cached response for message, or None"""
+        if not self.enabled:
+            return None
+        if not self.is_cacheable(message):
+            with self.lock:
+                self.bypassed += 1
+            return None
+        text = normalize(message)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get((flow_digest, text))
+            exact = entry is not None and now < entry.expires_at
+            if not exact:
+                entry = self._most_similar(text, flow_digest, now)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((flow_digest, entry.text))
+            entry.hits += 1
+            self.hits += 1
+            if not exact:
+                self.similar_hits += 1
+            response = entry.response
+        return copy.deepcopy(response)
+
+    def _most_similar(self, text: str, flow_digest: str, now: float) -> Optional[ResponseCacheEntry]:
+        grams, norm, numbers = self._features(text)
+        best, best_score = None, self.threshold
+        for key in list(self.by_digest.get(flow_digest, ())):
+            entry = self.entries[key]
+            if now >= entry.expires_at:
+                self._remove(key)
+                continue
+            # Trigrams barely tell "room 101" from "room 102"
+            if entry.numbers != numbers:
+                continue
+            dot = sum(count * entry.grams.get(gram, 0) for gram, count in grams.items())
+            score = dot / (norm * entry.norm) if norm and entry.norm else 0.0
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def store(self, message: str, flow_digest: str, response: CachedResponse, tools_used: Set[str]) -> bool:
+        """
+        Cache the outcome of a turn, unless it ran a tool or recorded a state outside
+        the read-only set, or its history refers to tool outputs that are already gone
+        """
+        if not self.enabled or not self.is_cacheable(message):
+            return False
+        if (
+            not tools_used <= CACHEABLE_TOOLS
+            or not set(response.states) <= CACHEABLE_STATES
+            or response.payloads is None
+        ):
+            with self.lock:
+                self.rejected += 1
+            return False
+        text = normalize(message)
+        grams, norm, numbers = self._features(text)
+        key = (flow_digest, text)
+        entry = ResponseCacheEntry(
+            text=text,
+            grams=grams,
+            norm=norm,
+            numbers=numbers,
+            response=copy.deepcopy(response),
+            expires_at=time.monotonic() + self.ttl,
+        )
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self.by_digest.setdefault(flow_digest, set()).add(key)
+            self.stored += 1
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return True
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        self.entries.pop(key, None)
+        keys = self.by_digest.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_digest[key[0]]
+
+    @contextmanager
+    def record_tools(self) -> Iterator[Set[str]]:
+        """Collect the names of the tools run inside the block, see note_tool_use"""
+        tools: Set[str] = set()
+        token = _turn_tools.set(tools)
+        try:
+            yield tools
+        finally:
+            _turn_tools.reset(token)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.by_digest.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": int(self.enabled),
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bypassed": self.bypassed,
+                "stored": self.stored,
+                "rejected": self.rejected,
+                "evictions": self.evictions,
+            }
+
+# Single instance for application-wide use
+response_cache = ResponseCache()
+metrics.register_collector("response_cache", response_cache.stats)
@@ -0,0 +1,599 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+_DELETED = object()
+
+class Codec:
+    """Converts stored values to and from JSON-compatible data. The default is the identity."""
+
+    def encode(self, value: Any) -> Any:
+        return value
+
+    def decode(self, data: Any) -> Any:
+        return data
+
+class ModelCodec(Codec):
+    """Codec for pydantic models"""
+
+    def __init__(self, model: Type[BaseModel]):
+        self.model = model
+
+    def encode(self, value: BaseModel) -> Any:
+        return value.model_dump(mode="json")
+
+    def decode(self, data: Any) -> BaseModel:
+        return self.model.model_validate(data)
+
+class _Batch:
+    """Writes buffered and reads memoized for the duration of one request"""
+
+    def __init__(self):
+        self.reads: Dict[Tuple[str, str], Any] = {}
+        self.writes: Dict[Tuple[str, str], Tuple[Any, Optional[float]]] = {}
+
+_current_batch: ContextVar[Optional[_Batch]] = ContextVar("session_store_batch", default=None)
+
+class SessionStore(ABC):
+    """
+    Key/value storage for session state, partitioned by namespace.
+
+    Backends implement the underscored primitives. Inside batch(), reads are
+    memoized and writes are buffered, then flushed with one set_many per
+    namespace when the batch exits. update() is never buffered: it is an
+    atomic read-modify-write against the backend, for values that other
+    requests change concurrently.
+    """
+
+    # True when values are visible to other processes
+    shared: bool = False
+    # True when values must be encoded to JSON-compatible data before storing
+    serializes: bool = True
+
+    @abstractmethod
+    def _get_many(self, namespace: str, keys: Iterable[str]) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def _set_many(self, namespace: str, items: Dict[str, Any], ttl: Optional[float]) -> None:
+        ...
+
+    @abstractmethod
+    def _delete(self, namespace: str, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def _pop(self, namespace: str, key: str) -> Any:
+        """Atomically read and delete a key. Returns _MISSING when absent."""
+        ...
+
+    @abstractmethod
+    def _keys(self, namespace: str) -> Iterable[str]:
+        """Return the unexpired keys of a namespace"""
+        ...
+
+    @abstractmethod
+    def _update(self, namespace: str, key: str, fn: Callable[[Any], Any], ttl: Optional[float]) -> Any:
+        """Atomically replace a key's value with fn(value), fn gets _MISSING when absent. Returns the new value."""
+        ...
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        return self.get_many(namespace, [key]).get(key, default)
+
+    def get_many(self, namespace: str, keys: Iterable[str]) -> Dict[str, Any]:
+        batch = _current_batch.get()
+        keys = list(keys)
+        result: Dict[str, Any] = {}
+        missing = []
+        for key in keys:
+            if batch is not None and (namespace, key) in batch.writes:
+                value = batch.writes[(namespace, key)][0]
+            elif batch is not None and (namespace, key) in batch.reads:
+                value = batch.reads[(namespace, key)]
+            else:
+                missing.append(key)
+                continue
+            if value is not _DELETED and value is not _MISSING:
+                result[key] = value
+        if missing:
+            fetched = self._get_many(namespace, missing)
+            for key in missing:
+                if key in fetched:
+                    result[key] = fetched[key]
+                if batch is not None:
+                    batch.reads[(namespace, key)] = fetched.get(key, _MISSING)
+        return result
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.set_many(namespace, {key: value}, ttl)
+
+    def set_many(self, namespace: str, items: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        batch = _current_batch.get()
+        if batch is not None:
+            for key, value in items.items():
+                batch.writes[(namespace, key)] = (value, ttl)
+            return
+        self._set_many(namespace, items, ttl)
+
+    def delete(self, namespace: str, key: str) -> None:
+        batch = _current_batch.get()
+        if batch is not None:
+            batch.writes[(namespace, key)] = (_DELETED, None)
+            return
+        self._delete(namespace, key)
+
+    def pop(self, namespace: str, key: str, default: Any = None) -> Any:
+        """Read and delete a key. Not buffered, so single-use entries are consumed exactly once."""
+        batch = _current_batch.get()
+        if batch is not None:
+            batch.writes.pop((namespace, key), None)
+            batch.reads[(namespace, key)] = _MISSING
+        value = self._pop(namespace, key)
+        return default if value is _MISSING else value
+
+    def keys(self, namespace: str) -> List[str]:
+        """List the keys of a namespace, including writes buffered in the current batch"""
+        keys = set(self._keys(namespace))
+        batch = _current_batch.get()
+        if batch is not None:
+            for (written_namespace, key), (value, _) in batch.writes.items():
+                if written_namespace != namespace:
+                    continue
+                if value is _DELETED:
+                    keys.discard(key)
+                else:
+                    keys.add(key)
+        return list(keys)
+
+    def update(self, namespace: str, key: str, fn: Callable[[Any], Any], ttl: Optional[float] = None) -> Any:
+        """
+        Atomically apply fn to a key's stored value (_MISSING when absent) and store the result.
+        Not buffered, so concurrent updates from other requests or workers are never overwritten.
+        """
+        batch = _current_batch.get()
+        if batch is not None:
+            batch.writes.pop((namespace, key), None)
+            batch.reads.pop((namespace, key), None)
+        return self._update(namespace, key, fn, ttl)
+
+    @contextmanager
+    def batch(self):
+        """Buffer writes and memoize reads in the current context until the block exits"""
+        if _current_batch.get() is not None:
+            yield
+            return
+        batch = _Batch()
+        token = _current_batch.set(batch)
+        try:
+            yield
+        finally:
+            _current_batch.reset(token)
+            self._flush(batch)
+
+    @contextmanager
+    def direct(self):
+        """Bypass an enclosing batch, for writes other threads must see immediately"""
+        token = _current_batch.set(None)
+        try:
+            yield
+        finally:
+            _current_batch.reset(token)
+
+    def _flush(self, batch: _Batch) -> None:
+        grouped: Dict[Tuple[str, Optional[float]], Dict[str, Any]] = {}
+        for (namespace, key), (value, ttl) in batch.writes.items():
+            if value is _DELETED:
+                self._delete(namespace, key)
+            else:
+                grouped.setdefault((namespace, ttl), {})[key] = value
+        for (namespace, ttl), items in grouped.items():
+            self._set_many(namespace, items, ttl)
+
+    def mapping(
+        self, namespace: str, codec: Codec = None, ttl: Optional[float] = None, batched: bool = True
+    ) -> "StoreMapping":
+        return StoreMapping(self, namespace, codec or Codec(), ttl, batched)
+
+class StoreMapping:
+    """
+    Dict-like view over one namespace of a SessionStore. With batched=False,
+    reads and writes always go to the backend, even inside a batch.
+    """
+
+    def __init__(self, store: SessionStore, namespace: str, codec: Codec, ttl: Optional[float], batched: bool = True):
+        self.store = store
+        self.namespace = namespace
+        self.codec = codec
+        self.ttl = ttl
+        self.batched = batched
+
+    def _scope(self):
+        return nullcontext() if self.batched else self.store.direct()
+
+    def _encode(self, value: Any) -> Any:
+        return self.codec.encode(value) if self.store.serializes else value
+
+    def _decode(self, data: Any) -> Any:
+        return self.codec.decode(data) if self.store.serializes else data
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._scope():
+            data = self.store.get(self.namespace, str(key), _MISSING)
+        return default if data is _MISSING else self._decode(data)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        with self._scope():
+            found = self.store.get_many(self.namespace, map(str, keys))
+        return {key: self._decode(data) for key, data in found.items()}
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        with self._scope():
+            self.store.set(self.namespace, str(key), self._encode(value), ttl or self.ttl)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        data = self.store.pop(self.namespace, str(key), _MISSING)
+        return default if data is _MISSING else self._decode(data)
+
+    def keys(self) -> List[str]:
+        with self._scope():
+            return self.store.keys(self.namespace)
+
+    def update(self, key: str, fn: Callable[[Any], Any], default: Any = None, ttl: Optional[float] = None) -> Any:
+        """Atomically replace the value with fn(value), fn gets default when absent. Returns the new value."""
+        def apply(data):
+            return self._encode(fn(default if data is _MISSING else self._decode(data)))
+
+        return self._decode(self.store.update(self.namespace, str(key), apply, ttl or self.ttl))
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.set(key, value)
+
+    def __delitem__(self, key: str) -> None:
+        with self._scope():
+            self.store.delete(self.namespace, str(key))
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+class Lease:
+    """
+    Exclusive, expiring claim on one key of a SessionStore, visible to every
+    process that shares the store. While held it is renewed from a background
+    thread, so a holder that dies frees it after at most duration seconds.
+    """
+
+    def __init__(self, store: SessionStore, namespace: str, key: str, duration: float, data: Any = None):
+        self.store = store
+        self.namespace = namespace
+        self.key = key
+        self.duration = duration
+        self.data = data
+        self.token = uuid.uuid4().hex
+        self.stopped = threading.Event()
+        self.renewer: Optional[threading.Thread] = None
+
+    def _take(self) -> Tuple[bool, Any]:
+        outcome = {}
+
+        def apply(current):
+            now = time.time()
+            if current is _MISSING or current["until"] <= now or current["token"] == self.token:
+                outcome["acquired"] = True
+                return {"token": self.token, "until": now + self.duration, "data": self.data}
+            outcome["acquired"] = False
+            return current
+
+        record = self.store.update(self.namespace, self.key, apply, self.duration)
+        return outcome["acquired"], record["data"]
+
+    def try_acquire(self) -> Tuple[bool, Any]:
+        """Take the lease if it is free. Returns whether it was taken and the holder's data."""
+        acquired, data = self._take()
+        if acquired and self.renewer is None:
+            self.renewer = threading.Thread(target=self._renew, name=f"lease-{self.namespace}", daemon=True)
+            self.renewer.start()
+        return acquired, data
+
+    def acquire(self, timeout: Optional[float] = None, poll_interval: float = 0.05) -> bool:
+        """Wait until the lease is taken, or timeout seconds passed. Returns whether it was taken."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.try_acquire()[0]:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_interval)
+        return True
+
+    def _renew(self) -> None:
+        while not self.stopped.wait(self.duration / 3):
+            try:
+                if not self._take()[0]:
+                    logger.warning(f"Lease {self.namespace}:{self.key} was taken over by another holder")
+                    return
+            except Exception as e:
+                logger.error(f"Renewing lease {self.namespace}:{self.key} failed: {e}")
+
+    def release(self) -> None:
+        self.stopped.set()
+
+        def apply(current):
+            if current is _MISSING:
+                return {"token": None, "until": 0, "data": None}
+            if current["token"] == self.token:
+                return {**current, "until": 0}
+            return current
+
+        self.store.update(self.namespace, self.key, apply, self.duration)
+
+class InMemorySessionStore(SessionStore):
+    """
+    Process-local backend. Values are stored by reference, without encoding.
+    Expired entries are dropped when read and purged periodically, so sessions
+    that are never read again do not accumulate.
+    """
+
+    shared = False
+    serializes = False
+
+    def __init__(self, purge_every: int = 500):
+        self.lock = threading.Lock()
+        self.data: Dict[str, Dict[str, Tuple[Any, Optional[float]]]] = {}
+        self.purge_every = purge_every
+        self.writes = 0
+
+    def _count_writes(self, count: int) -> None:
+        """Purge expired entries every purge_every writes. Caller must hold self.lock."""
+        self.writes += count
+        if self.writes < self.purge_every:
+            return
+        self.writes = 0
+        now = time.monotonic()
+        for entries in self.data.values():
+            expired = [key for key, (_, expires_at) in entries.items() if expires_at is not None and expires_at <= now]
+            for key in expired:
+                del entries[key]
+
+    def _get_many(self, namespace, keys):
+        now = time.monotonic()
+        result = {}
+        with self.lock:
+            entries = self.data.get(namespace, {})
+            for key in keys:
+                entry = entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] is not None and entry[1] <= now:
+                    del entries[key]
+                    continue
+                result[key] = entry[0]
+        return result
+
+    def _set_many(self, namespace, items, ttl):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            entries = self.data.setdefault(namespace, {})
+            for key, value in items.items():
+                entries[key] = (value, expires_at)
+            self._count_writes(len(items))
+
+    def _delete(self, namespace, key):
+        with self.lock:
+            self.data.get(namespace, {}).pop(key, None)
+
+    def _pop(self, namespace, key):
+        with self.lock:
+            entry = self.data.get(namespace, {}).pop(key, None)
+        if entry is None or (entry[1] is not None and entry[1] <= time.monotonic()):
+            return _MISSING
+        return entry[0]
+
+    def _keys(self, namespace):
+        now = time.monotonic()
+        with self.lock:
+            entries = self.data.get(namespace, {})
+            return [key for key, (_, expires_at) in entries.items() if expires_at is None or expires_at > now]
+
+    def _update(self, namespace, key, fn, ttl):
+        now = time.monotonic()
+        with self.lock:
+            entries = self.data.setdefault(namespace, {})
+            entry = entries.get(key)
+            current = _MISSING if entry is None or (entry[1] is not None and entry[1] <= now) else entry[0]
+            value = fn(current)
+            entries[key] = (value, now + ttl if ttl else None)
+            self._count_writes(1)
+        return value
+
+class SQLiteSessionStore(SessionStore):
+    """
+    File backend. Shared by all worker processes on the same node.
+    Values are stored as JSON, expired rows are ignored on read and purged periodically.
+    """
+
+    shared = True
+
+    def __init__(self, path: str = None, purge_every: int = 500):
+        self.path = path or os.environ.get('SESSION_STORE_PATH', 'data/sessions.db')
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self.purge_every = purge_every
+        self.writes = 0
+
+    def _get_many(self, namespace, keys):
+        keys = list(keys)
+        placeholders = ",".join("?" for _ in keys)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT key, value FROM sessions WHERE namespace = ? AND key IN ({placeholders}) "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                [namespace, *keys, time.time()],
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def _set_many(self, namespace, items, ttl):
+        expires_at = time.time() + ttl if ttl else None
+        rows = [(namespace, key, json.dumps(value), expires_at) for key, value in items.items()]
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)", rows)
+                self.writes += len(rows)
+                if self.writes >= self.purge_every:
+                    self.writes = 0
+                    self.conn.execute("DELETE FROM sessions WHERE expires_at IS NOT NULL AND expires_at <= ?", [time.time()])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _delete(self, namespace, key):
+        with self.lock:
+            self.conn.execute("DELETE FROM sessions WHERE namespace = ? AND key = ?", [namespace, key])
+
+    def _pop(self, namespace, key):
+        with self.lock:
+            row = self.conn.execute(
+                "DELETE FROM sessions WHERE namespace = ? AND key = ? RETURNING value, expires_at",
+                [namespace, key],
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return _MISSING
+        return json.loads(row[0])
+
+    def _keys(self, namespace):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key FROM sessions WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+                [namespace, time.time()],
+            ).fetchall()
+        return [key for key, in rows]
+
+    def _update(self, namespace, key, fn, ttl):
+        now = time.time()
+        with self.lock:
+            # The write lock is taken before reading, so updates from other processes are serialized
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT value FROM sessions WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    [namespace, key, now],
+                ).fetchone()
+                value = fn(_MISSING if row is None else json.loads(row[0]))
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                    [namespace, key, json.dumps(value), now + ttl if ttl else None],
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return value
+
+def _ttl_ms(ttl: Optional[float]) -> Optional[int]:
+    """TTL in milliseconds for SET PX. Redis rejects 0, so sub-millisecond TTLs round up."""
+    return max(1, int(ttl * 1000)) if ttl else None
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis-protocol backend, shared across nodes. Accepts any client with the
+    redis-py interface (e.g. a fakeredis instance for local testing).
+    """
+
+    shared = True
+
+    def __init__(self, client=None, url: str = None, prefix: str = None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url or os.environ.get('SESSION_STORE_URL', 'redis://localhost:6379/0'))
+        self.client = client
+        self.prefix = prefix or os.environ.get('SESSION_STORE_PREFIX', 'hotel-agent')
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def _get_many(self, namespace, keys):
+        keys = list(keys)
+        values = self.client.mget([self._key(namespace, key) for key in keys])
+        return {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def _set_many(self, namespace, items, ttl):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.set(self._key(namespace, key), json.dumps(value), px=_ttl_ms(ttl))
+        pipe.execute()
+
+    def _delete(self, namespace, key):
+        self.client.delete(self._key(namespace, key))
+
+    def _pop(self, namespace, key):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.get(self._key(namespace, key))
+        pipe.delete(self._key(namespace, key))
+        value, _ = pipe.execute()
+        return _MISSING if value is None else json.loads(value)
+
+    def _keys(self, namespace):
+        prefix = self._key(namespace, "")
+        keys = self.client.scan_iter(match=f"{prefix}*", count=500)
+        return [(key.decode() if isinstance(key, bytes) else key)[len(prefix):] for key in keys]
+
+    def _update(self, namespace, key, fn, ttl):
+        from redis.exceptions import WatchError
+
+        name = self._key(namespace, key)
+        with self.client.pipeline(transaction=True) as pipe:
+            # Optimistic: retried when another client changed the key between WATCH and EXEC
+            while True:
+                try:
+                    pipe.watch(name)
+                    stored = pipe.get(name)
+                    value = fn(_MISSING if stored is None else json.loads(stored))
+                    pipe.multi()
+                    pipe.set(name, json.dumps(value), px=_ttl_ms(ttl))
+                    pipe.execute()
+                    return value
+                except WatchError:
+                    continue
+
+def create_session_store() -> SessionStore:
+    backend = os.environ.get('SESSION_STORE_BACKEND', 'memory').lower()
+    if backend == 'sqlite':
+        return SQLiteSessionStore()
+    if backend == 'redis':
+        return RedisSessionStore()
+    if backend != 'memory':
+        raise ValueError(f"Unknown SESSION_STORE_BACKEND: {backend}")
+    return InMemorySessionStore()
+
+SESSION_TTL_SECONDS = float(os.environ.get('SESSION_TTL_SECONDS', 24 * 3600))
+
+# Single instance for application-wide use
+session_store = create_session_store()
@@ -1,61 +1,192 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass, field
-from typing import List, Dict
+import os
+from threading import Lock
+from typing import Callable, Deque, List, Dict, Optional, Tuple
 from enum import Enum
 
 from utils.constants import FlowState
+from utils.session_store import SESSION_TTL_SECONDS, Codec, session_store
+
+# One bit per FlowState, so membership is a single mask test
+FLOW_STATE_BITS: Dict[FlowState, int] = {state: 1 << index for index, state in enumerate(FlowState)}
+
+FLOW_STATE_LOG_SIZE = int(os.environ.get('FLOW_STATE_LOG_SIZE', 50))
 
 @dataclass
 class FlowStates:
-    states: List[FlowState] = field(default_factory=list)
+    """
+    Compact flow state of a thread: a bitmask of the states reached so far,
+    plus a bounded, ordered log of transitions for auditing.
+    """
+    mask: int = 0
+    transitions: Deque[FlowState] = field(default_factory=lambda: deque(maxlen=FLOW_STATE_LOG_SIZE))
+    seq: int = 0  # Number of transitions recorded so far, used as a read cursor
+    _digest: Optional[str] = field(default=None, init=False, repr=False, compare=False)
     
     def add_state(self, state: FlowState) -> None:
-        """Add a state to the list of states."""
-        self.states.append(state)
+        """Record a transition to state."""
+        self.transitions.append(state)
+        self.seq += 1
+        bit = FLOW_STATE_BITS[state]
+        if not self.mask & bit:
+            self.mask |= bit
+            self._digest = None
+
+    def has_state(self, state: FlowState) -> bool:
+        """Return whether state has been reached."""
+        return bool(self.mask & FLOW_STATE_BITS[state])
 
     def get_states(self) -> List[FlowState]:
-        """Return the list of states."""
-        return self.states
+        """Return the distinct states reached, in flow order."""
+        return [state for state, bit in FLOW_STATE_BITS.items() if self.mask & bit]
+
+    def get_transitions(self) -> List[FlowState]:
+        """Return the most recent transitions, oldest first."""
+        return list(self.transitions)
+
+    def get_transitions_since(self, cursor: int) -> Tuple[List[FlowState], bool]:
+        """
+        Return the transitions recorded after cursor and whether some of them
+        were already dropped from the bounded log.
+        """
+        first_seq = self.seq - len(self.transitions)
+        start = max(cursor, first_seq)
+        transitions = list(self.transitions)[start - first_seq:] if start < self.seq else []
+        return transitions, cursor < first_seq
 
     def get_states_as_string(self) -> str:
-        """Return the states as a formatted string."""
-        return " ".join(state.name for state in self.states)
+        """Return the states as a formatted string, cached until the states change."""
+        if self._digest is None:
+            self._digest = " ".join(state.name for state in self.get_states())
+        return self._digest
+
+class FlowStatesCodec(Codec):
+    """Stores FlowStates by state name, so persisted data does not depend on bit positions"""
+
+    def encode(self, value: FlowStates) -> Dict[str, List[str]]:
+        return {
+            "states": [state.name for state in value.get_states()],
+            "transitions": [state.name for state in value.transitions],
+            "seq": value.seq,
+        }
+
+    def decode(self, data) -> FlowStates:
+        flow_states = FlowStates()
+        if isinstance(data, list):
+            # Legacy format: the full list of transitions
+            data = {"states": data, "transitions": data}
+        for name in data["states"]:
+            flow_states.mask |= FLOW_STATE_BITS[FlowState[name]]
+        flow_states.transitions.extend(FlowState[name] for name in data["transitions"])
+        flow_states.seq = data.get("seq", len(data["transitions"]))
+        return flow_states
+
+class MessageStates:
+    """States recorded for one thread during a single /chat invocation"""
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.states: List[FlowState] = []
+        self.lock = Lock()
+
+    def add_state(self, state: FlowState) -> None:
+        with self.lock:
+            self.states.append(state)
+
+    def drain(self) -> List[FlowState]:
+        """Return the collected states and reset the collector."""
+        with self.lock:
+            states, self.states = self.states, []
+            return states
+
+_current_message_states: ContextVar[Optional[MessageStates]] = ContextVar("message_states", default=None)
 
 class StateManager:
-    def __init__(self) -> None:
+    def __init__(self, lock_stripes: int = 64) -> None:
         """Initialize the StateManager with an empty dictionary for thread states."""
-        self.thread_states: Dict[int, FlowStates] = {}
-        self.message_states: Dict[int, FlowStates] = {}
+        # Kept out of request batches: callbacks add states while a turn runs, and /state must see them at once
+        self.thread_states = session_store.mapping("thread_states", FlowStatesCodec(), SESSION_TTL_SECONDS, batched=False)
+        self.listeners: List[Callable[[int, FlowState], None]] = []
+        # Tools record states from crew worker threads, so updates are serialized per thread
+        self.locks = [Lock() for _ in range(lock_stripes)]
+
+    def _lock(self, thread_id: int) -> Lock:
+        return self.locks[hash(thread_id) % len(self.locks)]
+
+    def add_listener(self, listener: Callable[[int, FlowState], None]) -> None:
+        """Register a callback invoked with (thread_id, state) on every state transition."""
+        self.listeners.append(listener)
 
     def add_state(self, thread_id: int, state: FlowState) -> None:
         """Add a state to the flow states for a specific thread."""
-        if thread_id not in self.thread_states:
-            self.thread_states[thread_id] = FlowStates()
-            self.message_states[thread_id] = FlowStates()
-        self.thread_states[thread_id].add_state(state)
-        self.message_states[thread_id].add_state(state)
+        def apply(thread_states: Optional[FlowStates]) -> FlowStates:
+            thread_states = thread_states or FlowStates()
+            thread_states.add_state(state)
+            return thread_states
+
+        with self._lock(thread_id):
+            # Atomic in the store, so a concurrent update from another worker is merged, not overwritten
+            self.thread_states.update(thread_id, apply)
+        message_states = _current_message_states.get()
+        if message_states is not None and message_states.thread_id == thread_id:
+            message_states.add_state(state)
+        for listener in self.listeners:
+            listener(thread_id, state)
 
     def get_states(self, thread_id: int) -> List[FlowState]:
         """Return the list of states for a specific thread."""
-        if thread_id in self.thread_states:
-            return self.thread_states[thread_id].get_states()
+        thread_states = self.thread_states.get(thread_id)
+        if thread_states:
+            return thread_states.get_states()
+        return []
+
+    def has_state(self, thread_id: int, state: FlowState) -> bool:
+        """Return whether a specific thread has reached state."""
+        thread_states = self.thread_states.get(thread_id)
+        return bool(thread_states) and thread_states.has_state(state)
+
+    def get_transitions(self, thread_id: int) -> List[FlowState]:
+        """Return the recent transition log for a specific thread."""
+        thread_states = self.thread_states.get(thread_id)
+        if thread_states:
+            with self._lock(thread_id):
+                return thread_states.get_transitions()
         return []
 
+    def get_transitions_since(self, thread_id: int, cursor: int = 0) -> Tuple[List[FlowState], int, bool]:
+        """
+        Return the transitions recorded after cursor, the cursor to pass next time
+        and whether older transitions were already dropped from the log.
+        """
+        thread_states = self.thread_states.get(thread_id)
+        if not thread_states:
+            return [], 0, False
+        with self._lock(thread_id):
+            transitions, truncated = thread_states.get_transitions_since(cursor)
+            return transitions, thread_states.seq, truncated
+
     def get_states_as_string(self, thread_id: int) -> str:
         """Return the states as a formatted string for a specific thread."""
-        if thread_id in self.thread_states:
-            return self.thread_states[thread_id].get_states_as_string()
+        thread_states = self.thread_states.get(thread_id)
+        if thread_states:
+            return thread_states.get_states_as_string()
         return ""
-    
-    def get_message_states(self, thread_id: int) -> List[FlowState]:
-        """Return the list of states for a specific message."""
-        if thread_id in self.thread_states:
-            return self.thread_states[thread_id].get_states()
-        return []
-    
-    def clear_message_states(self, thread_id: int) -> None:
-        """Clear the message states for a specific thread."""
-        if thread_id in self.message_states:
-            self.message_states[thread_id].states = []
+
+    @contextmanager
+    def collect_message_states(self, thread_id: int):
+        """
+        Collect the states a thread records in the current context (one /chat
+        invocation) and yield the collector. Call drain() once to read them.
+        """
+        message_states = MessageStates(thread_id)
+        token = _current_message_states.set(message_states)
+        try:
+            yield message_states
+        finally:
+            _current_message_states.reset(token)
 
 # Single instance for application-wide use
 state_manager = StateManager()
@@ -0,0 +1,211 @@
+import ast
+import json
+import re
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+from pydantic import TypeAdapter, ValidationError
+
+from schemas import CrewOutput, Response
+from utils.constants import FrontendState
+from utils.metrics import metrics
+
+FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+FINAL_ANSWER_PATTERN = re.compile(r"^.*?Final Answer:\s*", re.DOTALL)
+FRONTEND_STATES = frozenset(state.value for state in FrontendState)
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSING = {"{": "}", "[": "]"}
+# A key left without its value at the end of a cut off object
+DANGLING_KEY_PATTERN = re.compile(r'([{,])\s*"(?:[^"\\]|\\.)*"\s*:?\s*$')
+
+@dataclass
+class ToolResult:
+    output: CrewOutput
+    # Set by tools with result_as_answer, whose output is the turn's answer as is
+    final: bool = False
+
+_turn_tool_results: ContextVar[Optional[List[ToolResult]]] = ContextVar("turn_tool_results", default=None)
+
+def tool_result(output: CrewOutput, final: bool = False) -> str:
+    """
+    Publish a tool's structured result to the running turn and return the JSON
+    the LLM sees. The turn's final output takes tool_response and
+    frontend_state from here, so they do not depend on the LLM copying them
+    back. A final result is returned to the user unchanged.
+    """
+    results = _turn_tool_results.get()
+    if results is not None:
+        results.append(ToolResult(output, final))
+    return output.model_dump_json()
+
+def published_tool_results() -> Optional[List[ToolResult]]:
+    """The results published so far in the running turn, None outside a turn"""
+    return _turn_tool_results.get()
+
+@contextmanager
+def collect_tool_results() -> Iterator[List[ToolResult]]:
+    """Collect the results published by the tools run inside the block, oldest first"""
+    results: List[ToolResult] = []
+    token = _turn_tool_results.set(results)
+    try:
+        yield results
+    finally:
+        _turn_tool_results.reset(token)
+
+def _json_candidate(text: str) -> str:
+    """The part of an LLM answer that should hold the JSON object"""
+    text = FINAL_ANSWER_PATTERN.sub("", text.strip(), count=1)
+    fenced = FENCE_PATTERN.search(text)
+    if fenced:
+        text = fenced.group(1)
+    start = text.find("{")
+    return text[start:] if start >= 0 else text
+
+def _close_json(text: str) -> str:
+    """
+    Single pass over text that fixes what LLMs commonly get wrong: single-quoted
+    strings, Python literals, trailing commas, raw newlines in strings, and an
+    object cut off before its closing quotes and brackets or after a key. Stops after the
+    first complete top-level value, dropping trailing prose.
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    quote = None
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == "\\" and i + 1 < len(text):
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if char == quote:
+                out.append('"')
+                quote = None
+            elif char == '"':
+                out.append('\\"')
+            elif char == "\n":
+                out.append("\\n")
+            else:
+                out.append(char)
+            i += 1
+            continue
+        if char in "\"'":
+            quote = char
+            out.append('"')
+        elif char in CLOSING:
+            stack.append(CLOSING[char])
+            out.append(char)
+        elif char in "}]":
+            while out and out[-1].strip() in (",", ""):
+                out.pop()
+            if stack:
+                out.append(stack.pop())
+            if not stack:
+                break
+        elif char.isalpha():
+            # Any letter, isalpha() is true for non-ASCII letters as well
+            word = re.match(r"[^\W\d_]+", text[i:]).group(0)
+            out.append(PYTHON_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(char)
+        i += 1
+    if quote:
+        out.append('"')
+    while out and out[-1].strip() in (",", ":", ""):
+        out.pop()
+    text = "".join(out)
+    if stack and stack[-1] == "}":
+        text = DANGLING_KEY_PATTERN.sub(r"\1", text).rstrip().rstrip(",")
+    return text + "".join(reversed(stack))
+
+def repair_json(text: str) -> Optional[Any]:
+    """Best-effort decode of the JSON value in an LLM answer, None if nothing usable is found"""
+    candidate = _json_candidate(text)
+    try:
+        return json.JSONDecoder().raw_decode(candidate)[0]
+    except ValueError:
+        pass
+    try:
+        return json.loads(_close_json(candidate))
+    except ValueError:
+        pass
+    # str() of a dict, as the chat history stores earlier answers
+    try:
+        return ast.literal_eval(candidate)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+class StructuredOutputParser:
+    """
+    Validates the crew's final answer against CrewOutput locally.
+
+    The TypeAdapter is built once and validates raw JSON without an
+    intermediate dict. Answers that are not valid JSON go through
+    repair_json; answers with no usable object become a plain chat_response.
+    Either way no LLM call is spent on fixing the format.
+    """
+
+    def __init__(self):
+        self.adapter = TypeAdapter(CrewOutput)
+        # Compact JSON, embedded in every task prompt
+        self.schema_json = json.dumps(CrewOutput.model_json_schema(), separators=(",", ":"))
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {"valid": 0, "repaired": 0, "fallback": 0, "merged_tool_results": 0, "tool_answers": 0}
+
+    def _count(self, outcome: str) -> None:
+        with self.lock:
+            self.counts[outcome] += 1
+
+    def parse(self, text: str) -> Optional[CrewOutput]:
+        """Return the CrewOutput in text, repairing its JSON when needed, or None"""
+        try:
+            output = self.adapter.validate_json(text.strip())
+            self._count("valid")
+            return output
+        except ValidationError:
+            pass
+        value = repair_json(text)
+        if isinstance(value, dict):
+            # Usually the last field, so the first one lost or cut short when an answer is cut off
+            if value.get("frontend_state") not in FRONTEND_STATES:
+                value["frontend_state"] = FrontendState.NO_STATE.value
+            try:
+                output = self.adapter.validate_python(value)
+                self._count("repaired")
+                return output
+            except ValidationError:
+                pass
+        return None
+
+    def finalize(self, text: str, tool_results: List[ToolResult]) -> CrewOutput:
+        """The turn's CrewOutput from the final answer text and the results the tools published"""
+        final = next((result for result in reversed(tool_results) if result.final), None)
+        if final is not None:
+            # The tool ended the turn (result_as_answer), its output is the answer
+            self._count("tool_answers")
+            return final.output.model_copy(deep=True)
+        output = self.parse(text or "")
+        if output is None:
+            self._count("fallback")
+            output = CrewOutput(response=Response(chat_response=(text or "").strip()), frontend_state=FrontendState.NO_STATE)
+        latest = next((result.output for result in reversed(tool_results) if result.output.response.tool_response is not None), None)
+        if latest is not None and output.response.tool_response is None:
+            output.response.tool_response = latest.response.tool_response
+            self._count("merged_tool_results")
+        if tool_results and output.frontend_state == FrontendState.NO_STATE:
+            output.frontend_state = tool_results[-1].output.frontend_state
+        return output
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counts)
+
+# Single instance for application-wide use
+structured_output_parser = StructuredOutputParser()
+metrics.register_collector("structured_output", structured_output_parser.stats)
@@ -0,0 +1,87 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Tuple
+
+from utils.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class CachedToken:
+    token: str
+    expires_at: float
+    refresh_at: float
+
+class TokenCache:
+    """
+    Expiry-aware cache for client-credentials tokens.
+
+    - Entries are keyed by the normalized (sorted, de-duplicated) scope set.
+    - A token accessed inside its refresh window is served as-is while a
+      background refresh replaces it, so the hot path never waits on the IdP.
+    - Concurrent misses for the same scope set share a single fetch.
+    """
+
+    def __init__(
+        self,
+        fetcher: Callable[[list], Tuple[str, int]],
+        refresh_margin: float = None,
+        default_ttl: float = None,
+    ):
+        self.fetcher = fetcher  # scopes -> (access_token, expires_in)
+        self.refresh_margin = refresh_margin or float(os.environ.get('APP_TOKEN_REFRESH_MARGIN_SECONDS', 60))
+        self.default_ttl = default_ttl or float(os.environ.get('APP_TOKEN_DEFAULT_TTL_SECONDS', 3600))
+        self.lock = threading.Lock()
+        self.entries: Dict[Tuple[str, ...], CachedToken] = {}
+        self.inflight: Dict[Tuple[str, ...], Future] = {}
+
+    @staticmethod
+    def normalize_scopes(scopes: Iterable[str]) -> Tuple[str, ...]:
+        return tuple(sorted(set(scopes)))
+
+    def get(self, scopes: Iterable[str]) -> str:
+        """Return a valid token for scopes, fetching it if needed"""
+        key = self.normalize_scopes(scopes)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now < entry.expires_at:
+                if now >= entry.refresh_at and key not in self.inflight:
+                    future = self.inflight[key] = Future()
+                    threading.Thread(target=self._refresh, args=(key, future), daemon=True).start()
+                return entry.token
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+        if owner:
+            self._refresh(key, future)
+        return future.result()
+
+    def _refresh(self, key: Tuple[str, ...], future: Future) -> None:
+        try:
+            with tracer.span("token.fetch", scopes=" ".join(key)):
+                token, expires_in = self.fetcher(list(key))
+            ttl = float(expires_in or self.default_ttl)
+            now = time.monotonic()
+            with self.lock:
+                self.entries[key] = CachedToken(
+                    token=token,
+                    expires_at=now + ttl,
+                    refresh_at=now + ttl - min(self.refresh_margin, ttl / 2),
+                )
+            future.set_result(token)
+        except Exception as e:
+            logger.error(f"Failed to fetch app token for scopes {list(key)}: {e}")
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def invalidate(self, scopes: Iterable[str]) -> None:
+        with self.lock:
+            self.entries.pop(self.normalize_scopes(scopes), None)
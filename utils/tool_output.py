@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Optional
+
+from utils.metrics import metrics
+
+# Key marking a shaped tool output; main swaps such nodes for the full payload
+HANDLE_KEY = "handle"
+
+# Fields the agent needs from each kind of tool output. Nested objects are
+# projected with the same set; objects that match none of the fields (an
+# unknown upstream schema) keep all of theirs, so projection never empties a result.
+TOOL_OUTPUT_FIELDS: Dict[str, FrozenSet[str]] = {
+    "hotels": frozenset({
+        "id", "hotel_id", "name", "hotel_name", "city", "location", "address",
+        "rating", "price", "price_per_night", "currency", "rooms",
+    }),
+    "hotel": frozenset({
+        "id", "hotel_id", "room_id", "name", "hotel_name", "city", "location", "rating",
+        "rooms", "room_type", "type", "price", "price_per_night", "currency",
+        "capacity", "max_occupancy", "is_available", "amenities",
+    }),
+    "room": frozenset({
+        "id", "room_id", "hotel_id", "hotel_name", "room_type", "type", "name",
+        "price", "price_per_night", "currency", "capacity", "max_occupancy",
+        "is_available", "amenities",
+    }),
+    "booking": frozenset({
+        "id", "booking_id", "hotel_id", "hotel_name", "room_id", "room_type",
+        "check_in", "check_out", "total_price", "currency", "status",
+    }),
+}
+
+@dataclass
+class ToolPayload:
+    thread_id: Optional[str]
+    data: Any
+    expires_at: float
+
+class ToolOutputShaper:
+    """
+    Shrinks tool outputs before they are fed back to the LLM.
+
+    Outputs larger than inline_chars are projected to the fields in
+    TOOL_OUTPUT_FIELDS, with lists capped at max_items and strings at
+    max_chars. The full payload is kept in a bounded TTL + LRU side cache and
+    the LLM gets {"handle": ..., "data": <projection>}. resolve() replaces the
+    handles in the final tool_response with the full payload for the frontend.
+    """
+
+    def __init__(
+        self,
+        max_items: int = None,
+        max_chars: int = None,
+        inline_chars: int = None,
+        max_entries: int = None,
+        ttl: float = None,
+    ):
+        self.max_items = max_items or int(os.environ.get('TOOL_OUTPUT_MAX_ITEMS', 10))
+        self.max_chars = max_chars or int(os.environ.get('TOOL_OUTPUT_MAX_STRING_CHARS', 200))
+        self.inline_chars = inline_chars if inline_chars is not None else int(os.environ.get('TOOL_OUTPUT_INLINE_CHARS', 1000))
+        self.max_entries = max_entries or int(os.environ.get('TOOL_PAYLOAD_CACHE_MAX_ENTRIES', 1024))
+        self.ttl = ttl or float(os.environ.get('TOOL_PAYLOAD_CACHE_TTL_SECONDS', 1800))
+        self.lock = threading.Lock()
+        self.payloads: "OrderedDict[str, ToolPayload]" = OrderedDict()
+        self.resolved = 0
+        self.unresolved = 0
+        self.evictions = 0
+
+    def shape(self, kind: str, data: Any, thread_id: Optional[str] = None) -> Any:
+        """Return the LLM-facing version of a tool output"""
+        raw_chars = len(json.dumps(data, default=str))
+        metrics.increment("tool_output_chars_total", raw_chars, kind=kind, stage="raw")
+        if raw_chars <= self.inline_chars:
+            metrics.increment("tool_output_chars_total", raw_chars, kind=kind, stage="shaped")
+            return data
+
+        shaped = {
+            HANDLE_KEY: self.put(data, thread_id),
+            "data": self._project(data, TOOL_OUTPUT_FIELDS.get(kind, frozenset())),
+        }
+        metrics.increment("tool_output_chars_total", len(json.dumps(shaped, default=str)), kind=kind, stage="shaped")
+        return shaped
+
+    def _project(self, value: Any, fields: FrozenSet[str]) -> Any:
+        if isinstance(value, dict):
+            keys = [key for key in value if key in fields] or list(value)
+            return {key: self._project(value[key], fields) for key in keys}
+        if isinstance(value, list):
+            items = [self._project(item, fields) for item in value[:self.max_items]]
+            if len(value) > self.max_items:
+                items.append(f"... {len(value) - self.max_items} more items omitted")
+            return items
+        if isinstance(value, str) and len(value) > self.max_chars:
+            return value[:self.max_chars] + "..."
+        return value
+
+    def put(self, data: Any, thread_id: Optional[str] = None) -> str:
+        """Keep the full payload and return its handle"""
+        handle = f"tool-{uuid.uuid4().hex[:16]}"
+        now = time.monotonic()
+        with self.lock:
+            self.payloads[handle] = ToolPayload(thread_id, data, now + self.ttl)
+            while len(self.payloads) > self.max_entries:
+                self.payloads.popitem(last=False)
+                self.evictions += 1
+        return handle
+
+    def get(self, handle: str, thread_id: Optional[str] = None) -> Optional[Any]:
+        """Return the full payload for handle if it belongs to thread_id and has not expired"""
+        with self.lock:
+            payload = self.payloads.get(handle)
+            if payload is None or payload.thread_id != thread_id:
+                return None
+            if payload.expires_at < time.monotonic():
+                del self.payloads[handle]
+                return None
+            self.payloads.move_to_end(handle)
+            return payload.data
+
+    def resolve(self, value: Any, thread_id: Optional[str] = None) -> Any:
+        """Replace every shaped output inside value with its full payload"""
+        if isinstance(value, dict):
+            handle = value.get(HANDLE_KEY)
+            if isinstance(handle, str):
+                data = self.get(handle, thread_id)
+                with self.lock:
+                    if data is None:
+                        self.unresolved += 1
+                    else:
+                        self.resolved += 1
+                if data is not None:
+                    return data
+            return {key: self.resolve(item, thread_id) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve(item, thread_id) for item in value]
+        return value
+
+    def collect(self, value: Any, thread_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Return the full payloads of the handles inside value, or None when one of them cannot be resolved"""
+        payloads: Dict[str, Any] = {}
+
+        def walk(node: Any) -> bool:
+            if isinstance(node, dict):
+                handle = node.get(HANDLE_KEY)
+                if isinstance(handle, str):
+                    data = self.get(handle, thread_id)
+                    if data is None:
+                        return False
+                    payloads[handle] = data
+                return all(walk(item) for item in node.values())
+            if isinstance(node, list):
+                return all(walk(item) for item in node)
+            return True
+
+        return payloads if walk(value) else None
+
+    def rebind(self, value: Any, payloads: Dict[str, Any], thread_id: Optional[str] = None) -> Any:
+        """Return a copy of value whose handles are re-issued for thread_id, see collect()"""
+        handles = {handle: self.put(data, thread_id) for handle, data in payloads.items()}
+
+        def walk(node: Any) -> Any:
+            if isinstance(node, dict):
+                node = {key: walk(item) for key, item in node.items()}
+                if node.get(HANDLE_KEY) in handles:
+                    node[HANDLE_KEY] = handles[node[HANDLE_KEY]]
+                return node
+            if isinstance(node, list):
+                return [walk(item) for item in node]
+            return node
+
+        return walk(value)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self.payloads),
+                "resolved": self.resolved,
+                "unresolved": self.unresolved,
+                "evictions": self.evictions,
+            }
+
+# Single instance for application-wide use
+tool_output_shaper = ToolOutputShaper()
+metrics.register_collector("tool_payloads", tool_output_shaper.stats)
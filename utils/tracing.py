@@ -0,0 +1,193 @@
+import functools
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+from utils.metrics import metrics
+
+# OpenTelemetry span kinds and status codes, as used in OTLP/JSON
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+class NoopSpan:
+    """Returned by a disabled tracer. Every method does nothing."""
+
+    def __enter__(self) -> "NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+NOOP_SPAN = NoopSpan()
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+class Span:
+    """
+    A timed operation. Used as a context manager, it becomes the parent of
+    spans started inside it, including on threads that copy the context
+    (the crew executor does).
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, kind: int, attributes: Dict[str, Any], parent: Optional["Span"]):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = STATUS_OK
+        self.status_message: Optional[str] = None
+        self._token = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Ended from another context (e.g. an event handler on another thread)
+            pass
+        if exc is not None:
+            self.status = STATUS_ERROR
+            self.status_message = f"{exc_type.__name__}: {exc}"
+        self.end()
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.tracer._finish(self)
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+            "status": {"code": self.status, **({"message": self.status_message} if self.status_message else {})},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+class Tracer:
+    """
+    In-process tracer. Finished spans are kept in a bounded buffer, exported
+    as OTLP/JSON by /traces, and their durations are observed in metrics as
+    span_seconds{span=...}. When disabled, span() returns a shared no-op.
+    """
+
+    def __init__(self, enabled: bool = None, buffer_size: int = None, service_name: str = None):
+        self.enabled = enabled if enabled is not None else os.environ.get('TRACING_ENABLED', 'true').lower() == 'true'
+        self.buffer_size = buffer_size or int(os.environ.get('TRACE_BUFFER_SIZE', 5000))
+        self.service_name = service_name or os.environ.get('OTEL_SERVICE_NAME', 'hotel-agent')
+        self.lock = threading.Lock()
+        self.spans: Deque[Span] = deque(maxlen=self.buffer_size)
+        self._open = threading.local()
+
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes: Any):
+        """Start a span as a child of the current one. Use it as a context manager."""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, kind, attributes, _current_span.get())
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def start_span(self, key: Any, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes: Any):
+        """
+        Start and activate a span that is ended later by end_span(key) on the
+        same thread. For operations only visible as start/finish events.
+        """
+        span = self.span(name, kind, **attributes)
+        if span is not NOOP_SPAN:
+            span.__enter__()
+            open_spans = self._open.__dict__.setdefault("spans", {})
+            open_spans[key] = span
+        return span
+
+    def end_span(self, key: Any, error: Optional[BaseException] = None, **attributes: Any) -> None:
+        span = self._open.__dict__.get("spans", {}).pop(key, None)
+        if span is None:
+            return
+        span.set_attributes(attributes)
+        span.__exit__(type(error) if error else None, error, None)
+
+    def _finish(self, span: Span) -> None:
+        metrics.observe("span_seconds", span.duration, span=span.name)
+        with self.lock:
+            self.spans.append(span)
+
+    def export(self, trace_id: Optional[str] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+        """Finished spans in OTLP/JSON (ExportTraceServiceRequest) form, newest last"""
+        with self.lock:
+            spans: List[Span] = [span for span in self.spans if trace_id is None or span.trace_id == trace_id]
+        if limit:
+            spans = spans[-limit:]
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "hotel-agent"},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }]
+        }
+
+def trace_tool(tool_class):
+    """Run every _run of a crew tool class inside a "tool" span. Idempotent."""
+    run = tool_class._run
+    if getattr(run, "__traced__", False):
+        return tool_class
+
+    @functools.wraps(run)
+    def _run(self, *args, **kwargs):
+        with tracer.span(f"tool {self.name}", tool=self.name, thread_id=getattr(self, "thread_id", None)):
+            return run(self, *args, **kwargs)
+
+    _run.__traced__ = True
+    tool_class._run = _run
+    return tool_class
+
+# Single instance for application-wide use
+tracer = Tracer()